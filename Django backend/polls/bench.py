@@ -0,0 +1,119 @@
+"""Общие помощники для команд bench_* (замеры на временной SQLite-базе)."""
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.utils import timezone
+
+from .leaderboard import rebuild_leaderboard
+from .models import Choice, Poll, Task, TaskAnswer, TaskOption, Test, TestAttempt, Vote
+from .stats import rebuild_stats
+
+
+@contextmanager
+def temporary_database():
+    """
+    Создает чистую базу во временном файле (с миграциями) и переключает
+    на нее соединение default. Рабочая db.sqlite3 не затрагивается.
+    """
+    fd, path = tempfile.mkstemp(prefix='quiz-bench-', suffix='.sqlite3')
+    os.close(fd)
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings['NAME']
+    test_settings['NAME'] = path
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield path
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+class Stopwatch:
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+# --- Генератор данных для bench_api ---
+# Все строится от random.Random(seed), так что при одном seed и одних
+# размерах получается одна и та же база (с точностью до времени создания).
+
+def seed_polls(rnd, polls, choices, votes):
+    """polls опросов по choices вариантов и votes голосов в каждом."""
+    created = Poll.objects.bulk_create([
+        Poll(title=f'Опрос {i}', owner=f'owner{i % 10}', multiple_answers=bool(i % 2)) for i in range(polls)
+    ])
+    all_choices = Choice.objects.bulk_create([
+        Choice(poll=poll, choice_text=f'Вариант {j}') for poll in created for j in range(choices)
+    ])
+    by_poll = {}
+    for choice in all_choices:
+        by_poll.setdefault(choice.poll_id, []).append(choice)
+    rows = []
+    for poll in created:
+        for i in range(votes):
+            choice = rnd.choice(by_poll[poll.id])
+            choice.votes_count += 1
+            rows.append(Vote(poll=poll, choice=choice, user=f'voter{i}', single_answer=not poll.multiple_answers))
+    Vote.objects.bulk_create(rows, batch_size=2000)
+    Choice.objects.bulk_update(all_choices, ['votes_count'], batch_size=2000)
+    return created
+
+
+def seed_tests(rnd, tests, tasks, attempts, options=4):
+    """tests тестов по tasks заданий и attempts проверенных попыток в каждом."""
+    types = ('single', 'multiple', 'text')
+    created = Test.objects.bulk_create([Test(title=f'Тест {i}', owner=f'owner{i % 10}') for i in range(tests)])
+    all_tasks = Task.objects.bulk_create([
+        Task(test=test, question=f'Вопрос {j}', task_type=types[j % 3], score=1 + j % 3, correct_text=f'ответ {j}')
+        for test in created for j in range(tasks)
+    ])
+    all_options = TaskOption.objects.bulk_create([
+        TaskOption(task=task, text=f'Вариант {k}', is_correct=k == 0 or (task.task_type == 'multiple' and k == 1))
+        for task in all_tasks if task.task_type != 'text' for k in range(options)
+    ], batch_size=2000)
+    options_by_task = {}
+    for option in all_options:
+        options_by_task.setdefault(option.task_id, []).append(option.id)
+    tasks_by_test = {}
+    for task in all_tasks:
+        tasks_by_test.setdefault(task.test_id, []).append(task)
+
+    now = timezone.now()
+    for test in created:
+        rows = TestAttempt.objects.bulk_create([
+            TestAttempt(test=test, user=f'student{i}', completed_at=now,
+                        score_obtained=rnd.randrange(tasks * 2 + 1), total_score=tasks * 2)
+            for i in range(attempts)
+        ], batch_size=2000)
+        answers = [
+            TaskAnswer(attempt=attempt, task=task, answer_text=rnd.choice([task.correct_text, 'не знаю']))
+            for attempt in rows for task in tasks_by_test[test.id]
+        ]
+        TaskAnswer.objects.bulk_create(answers, batch_size=2000)
+        Through = TaskAnswer.selected_options.through
+        Through.objects.bulk_create([
+            Through(taskanswer_id=answer.id, taskoption_id=rnd.choice(options_by_task[answer.task_id]))
+            for answer in answers if answer.task_id in options_by_task
+        ], batch_size=2000)
+        rebuild_stats(test.id)
+        rebuild_leaderboard(test.id)
+    return created
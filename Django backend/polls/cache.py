@@ -0,0 +1,136 @@
+"""
+Версионный кэш результатов опросов.
+
+Версии объектов хранятся в базе: Poll.version, Test.version и
+CollectionVersion для списков (pk COLLECTION). Из них же строится ETag
+(polls/conditional.py), так что все процессы видят одну и ту же версию.
+Пути записи увеличивают версию в своей транзакции (invalidate_poll,
+invalidate_test): откат записи откатывает и версию, а новую версию
+читатель видит вместе с самими изменениями. Версия списка меняется только
+при создании, удалении и правке самих объектов (collection=True): голоса и
+попытки трогают лишь строки своих опросов и тестов, а не одну общую строку,
+на которой иначе ждали бы друг друга записи во все опросы. ETag списка
+дополнительно строится из id и версий строк страницы (polls/conditional.py). Готовые ответы хранятся
+в кэше процесса под ключом с версией - устаревшие записи больше никогда не
+читаются и со временем вытесняются (LocMemCache вытесняет давно не
+читавшиеся ключи первыми, размер задается MAX_ENTRIES в CACHES['polls']).
+
+Опрос перестает быть активным просто со временем, без записи, поэтому в
+версию опроса входит отметка об истечении end_date, а в версию списка
+опросов - дата последнего истекшего опроса.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CollectionVersion, Poll, Test
+
+CACHE_ALIAS = 'polls'
+# Псевдо-pk для версии списка объектов одного вида
+COLLECTION = 'all'
+VERSIONED_MODELS = {'poll': Poll, 'test': Test}
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def get_version(kind, pk):
+    """
+    Версия в виде строки "<номер>[.<отметка времени>]" (номер - до точки),
+    None - объекта нет.
+    """
+    if pk == COLLECTION:
+        version = CollectionVersion.objects.filter(kind=kind).values_list('version', flat=True).first() or 0
+        if kind != 'poll':
+            return str(version)
+        expired = (
+            Poll.objects.filter(end_date__lte=timezone.now())
+            .order_by('-end_date').values_list('end_date', flat=True).first()
+        )
+        return f'{version}.{int(expired.timestamp())}' if expired else str(version)
+    if kind != 'poll':
+        version = Test.objects.filter(pk=pk).values_list('version', flat=True).first()
+        return None if version is None else str(version)
+    row = Poll.objects.filter(pk=pk).values_list('version', 'end_date').first()
+    if row is None:
+        return None
+    version, end_date = row
+    return f'{version}.x' if end_date and end_date <= timezone.now() else str(version)
+
+
+def version_number(version):
+    """Номер из строки версии (см. get_version) или None, если это не версия."""
+    number = version.split('.', 1)[0]
+    return int(number) if number.isdigit() else None
+
+
+def bump_version(kind, pk):
+    if pk != COLLECTION:
+        VERSIONED_MODELS[kind].objects.filter(pk=pk).update(version=F('version') + 1)
+    elif not CollectionVersion.objects.filter(kind=kind).update(version=F('version') + 1):
+        CollectionVersion.objects.get_or_create(kind=kind)
+
+
+def _invalidate(kind, pks, collection):
+    # Один UPDATE на все объекты; версия всего списка - только если изменился
+    # сам набор объектов или их поля, а не голоса и попытки
+    VERSIONED_MODELS[kind].objects.filter(pk__in=pks).update(version=F('version') + 1)
+    if collection:
+        bump_version(kind, COLLECTION)
+
+
+def invalidate_poll(poll_id, collection=False):
+    _invalidate('poll', [poll_id], collection)
+
+
+def invalidate_polls(poll_ids):
+    _invalidate('poll', poll_ids, False)
+
+
+def invalidate_test(test_id, collection=False):
+    _invalidate('test', [test_id], collection)
+
+
+def result_cache_enabled():
+    return getattr(settings, 'POLLS_RESULT_CACHE', True)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cached_payload(kind, pk, build, version=None):
+    """
+    Возвращает сериализованный объект из кэша или строит его через build().
+    version - уже прочитанная версия объекта, чтобы не читать ее еще раз.
+    """
+    if not result_cache_enabled():
+        return build()
+    if version is None:
+        version = get_version(kind, pk)
+    if version is None:
+        # Объекта нет, build() ответит 404
+        return build()
+    cache = get_cache()
+    key = f'{kind}:{pk}:payload:{version}'
+    payload = cache.get(key)
+    if payload is not None:
+        _count('hits')
+        return payload
+    _count('misses')
+    payload = build()
+    cache.set(key, payload)
+    return payload
+
+
+def cache_stats():
+    with _stats_lock:
+        return dict(_stats)
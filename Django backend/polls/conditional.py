@@ -0,0 +1,125 @@
+"""
+Условные запросы по ETag.
+
+ETag строится из версии объекта, которая хранится в базе (polls/cache.py):
+проверка If-None-Match стоит одного чтения версии по первичному ключу и
+ничего не сериализует, а ETag одинаков во всех процессах. ETag списка -
+версия набора объектов плюс id и версии строк текущей страницы: голоса и
+попытки меняют только версии своих строк, а не общую версию списка.
+If-Match на PUT/PATCH/DELETE защищает от молчаливой перезаписи чужих правок:
+условный UPDATE версии первым оператором транзакции записи пропускает
+только одну правку с этим ETag, остальные получают 412.
+"""
+import hashlib
+
+from django.db import transaction
+from django.db.models import F
+from django.utils.cache import parse_etags, patch_vary_headers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from .cache import COLLECTION, VERSIONED_MODELS, get_version, version_number
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'Объект был изменен, загрузите его заново.'
+    default_code = 'precondition_failed'
+
+
+def _etag_matches(header, etag, weak):
+    etags = parse_etags(header)
+    if '*' in etags:
+        return True
+    if weak:
+        etags = [e.removeprefix('W/') for e in etags]
+    return etag in etags
+
+
+class ConditionalMixin:
+    # Вид объекта в polls/cache.py: 'poll' или 'test'
+    version_kind = None
+    # Заголовки запроса, от которых зависит тело ответа (и get_etag_variant)
+    vary_headers = ()
+
+    def get_etag_variant(self):
+        # Если тело ответа зависит не только от объекта (кто спрашивает, флаги),
+        # это нужно добавить в ETag
+        return ''
+
+    def get_version(self):
+        pk = self.kwargs.get('pk')
+        if pk is not None:
+            return get_version(self.version_kind, pk)
+        # Та же выборка, что отдаст list(), но только (id, версия) строк страницы
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        if self.paginator is not None:
+            queryset = self.paginator.page_queryset(queryset, self.request)
+        rows = hashlib.md5(repr(list(queryset.values_list('pk', 'version'))).encode()).hexdigest()[:12]
+        return f'{get_version(self.version_kind, COLLECTION)}.{rows}'
+
+    def get_etag(self, version):
+        pk = self.kwargs.get('pk', COLLECTION)
+        etag = f'{self.version_kind}-{pk}-{version}'
+        variant = self.get_etag_variant()
+        if variant:
+            etag += '-' + hashlib.md5(variant.encode()).hexdigest()[:12]
+        return f'"{etag}"'
+
+    def get(self, request, *args, **kwargs):
+        # Версия читается из той же базы, что и тело (реплика или default),
+        # так что ETag никогда не опережает тело ответа
+        self.version = self.get_version()
+        if self.version is None:
+            # Объекта нет: 404 без ETag
+            return super().get(request, *args, **kwargs)
+        etag = self.get_etag(self.version)
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and _etag_matches(if_none_match, etag, weak=True):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.vary_headers:
+            patch_vary_headers(response, self.vary_headers)
+        return response
+
+    def check_if_match(self, request):
+        """
+        Вызывается внутри транзакции записи. Версия, названная в If-Match,
+        сразу увеличивается условным UPDATE: параллельная правка с тем же ETag
+        ждет блокировку записи, а потом уже не находит эту версию.
+        """
+        if_match = request.headers.get('If-Match')
+        if not if_match:
+            return
+        etags = parse_etags(if_match)
+        if '*' in etags:
+            return
+        prefix = f'"{self.version_kind}-{self.kwargs["pk"]}-'
+        versions = {
+            version_number(etag[len(prefix):].rstrip('"').split('-', 1)[0])
+            for etag in etags if etag.startswith(prefix)
+        }
+        versions.discard(None)
+        model = VERSIONED_MODELS[self.version_kind]
+        if not versions or not model.objects.filter(pk=self.kwargs['pk'], version__in=versions).update(
+                version=F('version') + 1):
+            raise PreconditionFailed()
+
+    def update(self, request, *args, **kwargs):
+        with transaction.atomic():
+            self.check_if_match(request)
+            response = super().update(request, *args, **kwargs)
+        response['ETag'] = self.get_etag(self.get_version())
+        return response
+
+    def destroy(self, request, *args, **kwargs):
+        with transaction.atomic():
+            self.check_if_match(request)
+            return super().destroy(request, *args, **kwargs)
@@ -0,0 +1,130 @@
+"""
+Выгрузка голосов опроса и попыток теста в CSV и NDJSON.
+
+Ответ - StreamingHttpResponse: строки читаются из базы пачками
+(QuerySet.iterator(chunk_size=...)) и сразу уходят клиенту, так что
+память не зависит от числа строк. Попытки выгружаются вместе с ответами
+на задания и выбранными вариантами: prefetch_related работает на каждую
+пачку iterator(), это три запроса на пачку, а не запрос на попытку.
+"""
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+
+from .models import TaskAnswer, TaskOption, TestAttempt, Vote
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+CONTENT_TYPES = {
+    CSV: 'text/csv; charset=utf-8',
+    NDJSON: 'application/x-ndjson',
+}
+
+
+def chunk_size():
+    return getattr(settings, 'POLLS_EXPORT_CHUNK_SIZE', 2000)
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def _csv_value(value):
+    # csv сам пишет None как пустую строку, списки id - через ";"
+    return ';'.join(map(str, value)) if isinstance(value, list) else value
+
+
+def stream_response(rows, header, output, filename):
+    """
+    rows - итератор dict с ключами из header. Строки склеиваются в блоки
+    по chunk_size(): отдавать каждую строку отдельным куском в разы дороже.
+    """
+    block = chunk_size()
+
+    def lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if output == CSV else None
+        if writer is not None:
+            writer.writerow(header)
+        for n, row in enumerate(rows, start=1):
+            if writer is not None:
+                writer.writerow([_csv_value(row[key]) for key in header])
+            else:
+                buffer.write(json.dumps(row, ensure_ascii=False) + '\n')
+            if n % block == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    response = StreamingHttpResponse(lines(), content_type=CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{output}"'
+    return response
+
+
+VOTE_COLUMNS = ['id', 'choice_id', 'choice_text', 'user', 'created_at']
+
+
+def vote_rows(poll):
+    votes = Vote.objects.filter(poll=poll).order_by('id').values_list(
+        'id', 'choice_id', 'choice__choice_text', 'user', 'created_at')
+    for vote_id, choice_id, choice_text, user, created_at in votes.iterator(chunk_size=chunk_size()):
+        yield {
+            'id': vote_id,
+            'choice_id': choice_id,
+            'choice_text': choice_text,
+            # В анонимном опросе имена не выгружаются
+            'user': None if poll.is_anonymous else user,
+            'created_at': _isoformat(created_at),
+        }
+
+
+ATTEMPT_COLUMNS = ['id', 'user', 'status', 'score_obtained', 'total_score', 'started_at', 'completed_at']
+ANSWER_COLUMNS = ['task_id', 'answer_text', 'selected_options']
+
+
+def _attempts(test):
+    answers = TaskAnswer.objects.order_by('id').only('id', 'attempt_id', 'task_id', 'answer_text').prefetch_related(
+        Prefetch('selected_options', queryset=TaskOption.objects.only('id').order_by('id'))
+    )
+    return TestAttempt.objects.filter(test=test).order_by('id').defer('raw_answers').prefetch_related(
+        Prefetch('answers', queryset=answers)
+    ).iterator(chunk_size=chunk_size())
+
+
+def _attempt_row(attempt):
+    return {
+        'id': attempt.id,
+        'user': attempt.user,
+        'status': attempt.status,
+        'score_obtained': attempt.score_obtained,
+        'total_score': attempt.total_score,
+        'started_at': _isoformat(attempt.started_at),
+        'completed_at': _isoformat(attempt.completed_at),
+    }
+
+
+def _answer_row(answer):
+    return {
+        'task_id': answer.task_id,
+        'answer_text': answer.answer_text,
+        'selected_options': [option.id for option in answer.selected_options.all()],
+    }
+
+
+def attempt_rows(test, output):
+    """NDJSON - попытка на строку с вложенными ответами, CSV - строка на ответ."""
+    for attempt in _attempts(test):
+        row = _attempt_row(attempt)
+        answers = [_answer_row(answer) for answer in attempt.answers.all()]
+        if output == NDJSON:
+            row['answers'] = answers
+            yield row
+            continue
+        empty = dict.fromkeys(ANSWER_COLUMNS)
+        for answer in answers or [empty]:
+            yield {**row, **answer}
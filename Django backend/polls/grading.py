@@ -0,0 +1,204 @@
+"""
+Проверка попыток теста по заранее собранному ключу ответов.
+
+AnswerKey загружает задания и варианты теста двумя запросами и хранит
+только то, что нужно для оценки: баллы, тип задания, нормализованный
+правильный текст и множества id вариантов. Дальше все ответы попытки
+оцениваются в памяти, а TaskAnswer и их связи с вариантами пишутся
+пачками (save_answers). Правила оценки те же, что были в
+TestAttemptSerializer.create:
+
+* text - совпадение с одним из принятых ответов после нормализации
+  по профилю задания, с допуском опечаток (polls/matching.py);
+* single - выбран ровно один вариант, и он верный;
+* multiple - выбранное множество совпадает с множеством верных (непустым);
+* баллы за задание прибавляются к total_score на каждый ответ.
+
+Ключи кэшируются на уровне процесса (get_answer_key) по версии ключа
+Test.key_version. Версия хранится в базе, поэтому правка в одном процессе
+видна кэшам всех остальных. Ее увеличивают правки теста через API и
+сигналы сохранения/удаления Test, Task, TaskOption (polls/signals.py) в той
+же транзакции, что и сама правка, а сдача попыток ее не трогает.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models import F
+from django.dispatch import receiver
+
+from .matching import TextMatcher, accepted_answers
+from .models import Task, TaskAnswer, TaskOption, Test
+
+TaskKey = namedtuple('TaskKey', 'score task_type matcher option_ids correct_ids')
+
+GradeResult = namedtuple('GradeResult', 'total_score score_obtained correct')
+
+
+class AnswerKey:
+    def __init__(self, test_id, tasks):
+        self.test_id = test_id
+        self.tasks = tasks  # {task_id: TaskKey}
+
+    @classmethod
+    def load(cls, test_id):
+        options = {}
+        correct = {}
+        for option_id, task_id, is_correct in TaskOption.objects.filter(task__test_id=test_id).values_list(
+                'id', 'task_id', 'is_correct'):
+            options.setdefault(task_id, set()).add(option_id)
+            if is_correct:
+                correct.setdefault(task_id, set()).add(option_id)
+
+        tasks = {}
+        for task_id, score, task_type, correct_text, alternatives, profile, max_typos in Task.objects.filter(
+                test_id=test_id).values_list('id', 'score', 'task_type', 'correct_text', 'alternative_answers',
+                                             'text_profile', 'max_typos'):
+            tasks[task_id] = TaskKey(
+                score=score,
+                task_type=task_type,
+                # Принятые ответы нормализуются здесь, один раз на версию ключа;
+                # без них текстовый ответ не засчитывается
+                matcher=TextMatcher(accepted_answers(correct_text, alternatives), profile, max_typos),
+                option_ids=frozenset(options.get(task_id, ())),
+                correct_ids=frozenset(correct.get(task_id, ())),
+            )
+        return cls(test_id, tasks)
+
+    def validate(self, answers):
+        """Список ошибок по ответам в формате DRF (пустой dict - ответ в порядке)."""
+        errors = []
+        for answer in answers:
+            error = {}
+            task = self.tasks.get(answer['task'])
+            if task is None:
+                error['task'] = [f"Задание {answer['task']} не относится к этому тесту."]
+            else:
+                foreign = [o for o in answer.get('selected_options', []) if o not in task.option_ids]
+                if foreign:
+                    error['selected_options'] = [f"Варианты {foreign} не относятся к заданию {answer['task']}."]
+            errors.append(error)
+        return errors if any(errors) else []
+
+    def is_correct(self, task, answer):
+        if task.task_type == 'text':
+            return task.matcher.match(answer.get('answer_text'))
+        selected = answer.get('selected_options', [])
+        if task.task_type == 'single':
+            return len(selected) == 1 and selected[0] in task.correct_ids
+        if task.task_type == 'multiple':
+            return bool(task.correct_ids) and set(selected) == task.correct_ids
+        return False
+
+    def grade(self, answers):
+        total, obtained, correct = 0, 0, []
+        for answer in answers:
+            task = self.tasks[answer['task']]
+            total += task.score
+            ok = self.is_correct(task, answer)
+            if ok:
+                obtained += task.score
+            correct.append(ok)
+        return GradeResult(total, obtained, correct)
+
+
+class AnswerKeyCache:
+    """
+    LRU-кэш ключей ответов. Размер ограничен суммарным числом заданий во всех
+    ключах (max_tasks), а не числом тестов: один большой экзамен занимает
+    столько же места, сколько сотня маленьких.
+    """
+    def __init__(self, max_tasks):
+        self.max_tasks = max_tasks
+        self._entries = OrderedDict()  # test_id -> (version, AnswerKey)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, test_id, version=None):
+        if version is None:
+            version = Test.objects.filter(pk=test_id).values_list('key_version', flat=True).first()
+        with self._lock:
+            entry = self._entries.get(test_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(test_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        key = AnswerKey.load(test_id)
+        self._store(test_id, version, key)
+        return key
+
+    def _store(self, test_id, version, key):
+        with self._lock:
+            old = self._entries.pop(test_id, None)
+            if old is not None:
+                self._size -= len(old[1].tasks)
+            if len(key.tasks) > self.max_tasks:
+                return
+            self._entries[test_id] = (version, key)
+            self._size += len(key.tasks)
+            while self._size > self.max_tasks:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted.tasks)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'tasks': self._size,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+_key_cache = None
+_key_cache_lock = threading.Lock()
+
+
+def get_answer_key_cache():
+    global _key_cache
+    with _key_cache_lock:
+        if _key_cache is None:
+            _key_cache = AnswerKeyCache(getattr(settings, 'POLLS_ANSWER_KEY_CACHE_TASKS', 50000))
+        return _key_cache
+
+
+def get_answer_key(test_id, version=None):
+    """version - уже прочитанный Test.key_version, чтобы не читать его еще раз."""
+    return get_answer_key_cache().get(test_id, version)
+
+
+def invalidate_answer_key(test_id):
+    # Сразу, а не после коммита: откат правки откатит и новую версию
+    Test.objects.filter(pk=test_id).update(key_version=F('key_version') + 1)
+
+
+@receiver(setting_changed)
+def _reset_key_cache(setting, **kwargs):
+    global _key_cache
+    if setting == 'POLLS_ANSWER_KEY_CACHE_TASKS':
+        _key_cache = None
+
+
+def save_answers(attempt, answers):
+    """Пишет ответы попытки и выбранные варианты пачками, без запроса на ответ."""
+    rows = [
+        TaskAnswer(attempt=attempt, task_id=answer['task'], answer_text=answer.get('answer_text', ''))
+        for answer in answers
+    ]
+    TaskAnswer.objects.bulk_create(rows)
+    Through = TaskAnswer.selected_options.through
+    Through.objects.bulk_create([
+        Through(taskanswer_id=row.id, taskoption_id=option_id)
+        for row, answer in zip(rows, answers)
+        for option_id in dict.fromkeys(answer.get('selected_options', []))
+    ])
+    return rows
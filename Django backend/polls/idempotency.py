@@ -0,0 +1,131 @@
+"""
+Повтор запросов с заголовком Idempotency-Key.
+
+Клиент, не дождавшийся ответа на голос или сдачу теста, повторяет запрос с
+тем же ключом и получает ответ на исходный запрос (с заголовком
+Idempotent-Replayed), а второй записи не происходит.
+
+Ключи хранятся в таблице IdempotencyKey, общей для всех процессов, и
+действуют POLLS_IDEMPOTENCY_TTL секунд (просроченные удаляются пачками при
+каждой новой записи и командой purge_idempotency_keys). Строка ключа
+вставляется первой в той же транзакции, что и голос или попытка: либо коммитятся обе записи, либо ни
+одной, а параллельный повтор ждет на уникальном ключе и потом получает
+сохраненный ответ. Ключ действует в пределах пути запроса и привязан к телу
+запроса: тот же ключ с другим телом - ошибка 422. Запоминаются только
+успешные ответы (2xx), после ошибки запрос можно повторить с тем же ключом.
+Хранится не тело ответа, а его суть (id записи, компактные счетчики): тело
+повтора собирается заново, и строка ключа не растет вместе с опросом.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+# Сколько просроченных ключей удаляется попутно при каждой новой записи
+PURGE_BATCH = 100
+
+
+class KeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'Idempotency-Key уже использован с другим запросом.'
+    default_code = 'idempotency_key_reused'
+
+
+class KeyInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Запрос с этим Idempotency-Key еще выполняется, повторите позже.'
+    default_code = 'idempotency_key_in_progress'
+
+
+class _KeyTaken(Exception):
+    """Параллельный запрос с тем же ключом успел закоммитить свой ответ."""
+
+
+def ttl():
+    return getattr(settings, 'POLLS_IDEMPOTENCY_TTL', 24 * 60 * 60)
+
+
+def _fingerprint(data):
+    body = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _claim(key, fingerprint):
+    now = timezone.now()
+    # Просроченная строка с тем же ключом больше не действует; заодно удаляем
+    # пачку других просроченных, чтобы таблица не росла без purge_idempotency_keys
+    expired = IdempotencyKey.objects.filter(expires_at__lte=now)
+    oldest = expired.order_by('expires_at').values('pk')[:PURGE_BATCH]
+    expired.filter(Q(key=key) | Q(pk__in=oldest)).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(key=key, fingerprint=fingerprint, expires_at=now + timedelta(seconds=ttl()))
+    except IntegrityError:
+        raise _KeyTaken
+
+
+class IdempotencyMixin:
+    """
+    Для APIView: оборачивает post().
+
+    Ответ целиком не хранится - вид запоминает только его суть
+    (idempotent_result: id записи, компактные счетчики) и по ней
+    собирает тело повтора (replay_response).
+    """
+
+    def idempotent_result(self, response):
+        """Небольшой JSON, по которому replay_response восстановит ответ."""
+        raise NotImplementedError
+
+    def replay_response(self, request, result, status_code):
+        raise NotImplementedError
+
+    def post(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return super().post(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            raise ValidationError({HEADER: f'Не длиннее {MAX_KEY_LENGTH} символов.'})
+
+        key = hashlib.sha256(f'{request.path}\n{key}'.encode()).hexdigest()
+        fingerprint = _fingerprint(request.data)
+        saved = IdempotencyKey.objects.filter(key=key, expires_at__gt=timezone.now()).first()
+        if saved is not None:
+            return self.replay(request, saved, fingerprint)
+
+        # Вторая попытка нужна, если параллельный запрос с этим ключом
+        # упал и удалил свою строку, пока мы ждали на уникальном ключе
+        for _ in range(2):
+            try:
+                with transaction.atomic():
+                    entry = _claim(key, fingerprint)
+                    response = super().post(request, *args, **kwargs)
+                    if not status.is_success(response.status_code):
+                        entry.delete()
+                        return response
+                    entry.status_code = response.status_code
+                    entry.response = self.idempotent_result(response)
+                    entry.save(update_fields=['status_code', 'response'])
+                return response
+            except _KeyTaken:
+                saved = IdempotencyKey.objects.filter(key=key).first()
+                if saved is not None:
+                    return self.replay(request, saved, fingerprint)
+        raise KeyInProgress()
+
+    def replay(self, request, entry, fingerprint):
+        if entry.fingerprint != fingerprint:
+            raise KeyReused()
+        response = self.replay_response(request, entry.response, entry.status_code)
+        response['Idempotent-Replayed'] = 'true'
+        return response
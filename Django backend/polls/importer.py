@@ -0,0 +1,126 @@
+"""
+Массовый импорт опросов и тестов из NDJSON.
+
+Каждая строка - один объект JSON с полем "type": "poll" или "test", остальные
+поля - как в POST /api/polls/create/ и /api/tests/ соответственно.
+Строки читаются по одной и проверяются теми же сериализаторами
+(PollCreateSerializer, TestSerializer). Прошедшие проверку копятся в пачку
+и пишутся одной транзакцией через create_many тех же сериализаторов:
+bulk_create объектов, затем всех вариантов или заданий и вариантов пачки. Если пачка не записалась (например,
+нарушено ограничение базы), ее записи повторяются по одной, и в отчет
+попадают только сбойные строки. В памяти одновременно только пачка и
+не больше POLLS_IMPORT_MAX_ERRORS описаний ошибок, так что расход памяти
+не зависит от размера файла.
+"""
+import json
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .cache import COLLECTION, bump_version
+from .models import ANONYMOUS_USER
+from .serializers import PollCreateSerializer, TestSerializer
+
+logger = logging.getLogger(__name__)
+
+SERIALIZERS = {
+    'poll': PollCreateSerializer,
+    'test': TestSerializer,
+}
+
+
+class Importer:
+    def __init__(self, owner=None, batch_size=None, max_errors=None):
+        self.owner = owner or ANONYMOUS_USER
+        self.batch_size = batch_size or getattr(settings, 'POLLS_IMPORT_BATCH_SIZE', 200)
+        self.max_errors = max_errors if max_errors is not None else getattr(settings, 'POLLS_IMPORT_MAX_ERRORS', 1000)
+        self.created = Counter()
+        self.errors = []
+        self.error_count = 0
+        self._batches = {kind: [] for kind in SERIALIZERS}
+
+    def error(self, line, detail):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'errors': detail})
+
+    def feed(self, line, raw):
+        """Проверяет одну строку файла и ставит ее в пачку."""
+        try:
+            if isinstance(raw, bytes):
+                raw = raw.decode('utf-8')
+        except UnicodeDecodeError as exc:
+            # Битая строка - ошибка этой строки, а не всего импорта
+            self.error(line, {'encoding': [f'Строка не в UTF-8: {exc.reason} (байт {exc.start}).']})
+            return
+        if not raw.strip():
+            return
+        try:
+            record = json.loads(raw)
+        except ValueError as exc:
+            self.error(line, {'json': [str(exc)]})
+            return
+        if not isinstance(record, dict):
+            self.error(line, {'json': ['Ожидался объект.']})
+            return
+        kind = record.pop('type', None)
+        if kind not in SERIALIZERS:
+            self.error(line, {'type': [f'Ожидалось одно из: {", ".join(SERIALIZERS)}.']})
+            return
+        serializer = SERIALIZERS[kind](data=record)
+        if not serializer.is_valid():
+            self.error(line, serializer.errors)
+            return
+        data = serializer.validated_data
+        if not data.get('owner'):
+            data['owner'] = self.owner
+        batch = self._batches[kind]
+        batch.append((line, data))
+        if len(batch) >= self.batch_size:
+            self.flush(kind)
+
+    def flush(self, kind=None):
+        for kind in [kind] if kind else list(SERIALIZERS):
+            batch, self._batches[kind] = self._batches[kind], []
+            if batch:
+                self._write(kind, batch)
+
+    def run(self, lines):
+        """lines - итератор строк (str или bytes), нумерация с 1."""
+        for line, raw in enumerate(lines, start=1):
+            self.feed(line, raw)
+        self.flush()
+        return self.report()
+
+    def report(self):
+        return {
+            'created': {'polls': self.created['poll'], 'tests': self.created['test']},
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+    def _write(self, kind, batch):
+        write = SERIALIZERS[kind].create_many
+        try:
+            with transaction.atomic():
+                write([data for _, data in batch])
+                self._committed(kind)
+            self.created[kind] += len(batch)
+            return
+        except DatabaseError:
+            logger.info('Пачка импорта (%s) не записалась целиком, пишем по одной', kind)
+        for line, data in batch:
+            try:
+                with transaction.atomic():
+                    write([data])
+                    self._committed(kind)
+            except DatabaseError as exc:
+                self.error(line, {'non_field_errors': [str(exc)]})
+                continue
+            self.created[kind] += 1
+
+    def _committed(self, kind):
+        # Новые объекты еще никто не кэшировал, меняется только версия списка
+        bump_version(kind, COLLECTION)
@@ -0,0 +1,160 @@
+"""
+Отложенная запись голосов (write-behind).
+
+В режиме POLLS_VOTE_INGEST = 'buffered' VoteSerializer не пишет голос сразу,
+а кладет его в буфер процесса. Буфер сбрасывается, когда набирается
+POLLS_VOTE_BUFFER_SIZE голосов или проходит POLLS_VOTE_BUFFER_DELAY секунд
+с первого голоса в пачке. Сброс - это одна транзакция: bulk_create голосов
+и один сгруппированный UPDATE счетчиков (Choice.objects.add_votes).
+При штатной остановке процесса остаток буфера сбрасывается через atexit.
+"""
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, connection, transaction
+from django.dispatch import receiver
+
+from .cache import invalidate_polls
+from .live import publish_votes_on_commit
+from .models import Choice, Poll, Vote
+
+logger = logging.getLogger(__name__)
+
+DIRECT = 'direct'
+BUFFERED = 'buffered'
+
+
+class VoteBuffer:
+    def __init__(self, max_size=500, max_delay=0.5):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, vote):
+        with self._lock:
+            self._pending.append(vote)
+            full = len(self._pending) >= self.max_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.max_delay, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Записывает накопленные голоса. Возвращает число сохраненных."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not batch:
+            return 0
+        # Сбросы не пересекаются, чтобы не держать две пишущие транзакции сразу
+        with self._flush_lock:
+            return self._write(batch)
+
+    def close(self):
+        """
+        Сброс при остановке: если поток таймера уже забрал пачку и пишет ее,
+        flush() увидит пустой буфер, поэтому дожидаемся и его записи.
+        """
+        saved = self.flush()
+        with self._flush_lock:
+            return saved
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Не удалось сбросить буфер голосов')
+        finally:
+            connection.close()
+
+    def _write(self, batch):
+        try:
+            with transaction.atomic():
+                Choice.objects.add_votes(Counter(vote.choice_id for vote in batch))
+                self._mark_single_answer(batch)
+                Vote.objects.bulk_create(batch)
+                self._committed(batch)
+            return len(batch)
+        except IntegrityError:
+            pass
+        # В пачке есть повторный голос: пишем по одному, пропуская дубликаты
+        saved = []
+        with transaction.atomic():
+            self._mark_single_answer(batch)
+            for vote in batch:
+                try:
+                    with transaction.atomic():
+                        vote.save(force_insert=True)
+                except IntegrityError:
+                    logger.info('Повторный голос %s за вариант %s отброшен', vote.user, vote.choice_id)
+                    continue
+                saved.append(vote)
+            Choice.objects.add_votes(Counter(vote.choice_id for vote in saved))
+            self._committed(saved)
+        return len(saved)
+
+    def _mark_single_answer(self, votes):
+        # Флаг из опроса в момент записи: за время в буфере опрос могли изменить
+        flags = Poll.objects.filter(pk__in={vote.poll_id for vote in votes}).single_answer_flags()
+        for vote in votes:
+            vote.single_answer = flags.get(vote.poll_id, False)
+
+    def _committed(self, votes):
+        publish_votes_on_commit(votes)
+        invalidate_polls({vote.poll_id for vote in votes})
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def ingest_mode():
+    return getattr(settings, 'POLLS_VOTE_INGEST', DIRECT)
+
+
+def get_vote_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = VoteBuffer(
+                max_size=getattr(settings, 'POLLS_VOTE_BUFFER_SIZE', 500),
+                max_delay=getattr(settings, 'POLLS_VOTE_BUFFER_DELAY', 0.5),
+            )
+        return _buffer
+
+
+def flush_vote_buffer():
+    if _buffer is not None:
+        return _buffer.flush()
+    return 0
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        if _buffer is not None:
+            _buffer.close()
+    except Exception:
+        logger.exception('Голоса из буфера не сохранены при остановке')
+
+
+@receiver(setting_changed)
+def _reset_buffer(setting, **kwargs):
+    global _buffer
+    if setting.startswith('POLLS_VOTE_'):
+        flush_vote_buffer()
+        _buffer = None
@@ -0,0 +1,95 @@
+"""
+Таблица лидеров теста.
+
+На каждого пользователя в тесте хранится одна строка LeaderboardEntry с его
+лучшей попыткой: больше баллов, при равенстве баллов - меньше время
+прохождения (TestAttempt.duration, polls/timing.py); попытки с неизвестным
+временем стоят после попыток с тем же баллом. record_attempt вызывается при проверке
+попытки и меняет строку, только если новая попытка лучше, поэтому
+таблица всегда отсортирована индексом leaderboard_rank_idx:
+
+* top(test_id, n) читает первые n записей индекса;
+* rank(test_id, user) - одна строка пользователя и подсчет тех, кто
+  строго лучше (одинаковый результат - одинаковое место).
+
+Ни один запрос не сортирует попытки. rebuild_leaderboard собирает
+таблицу заново из test_attempts (команда rebuild_leaderboard).
+"""
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import ANONYMOUS_USER, LeaderboardEntry, TestAttempt
+
+
+def _ranked(user):
+    # Без имени попытки в таблицу не попадают: все они слились бы в одну строку
+    return bool(user) and user != ANONYMOUS_USER
+
+
+def record_attempt(attempt):
+    if not _ranked(attempt.user):
+        return
+    score, duration = attempt.score_obtained, attempt.duration
+    # Не хуже новой: больше баллов или столько же и время не больше
+    # (без времени новая попытка не лучше ни одной с тем же баллом)
+    as_good = Q(score=score) if duration is None else Q(score=score, duration__lte=duration)
+    # Условный UPDATE атомарен: параллельная лучшая попытка не затрется
+    updated = LeaderboardEntry.objects.filter(test_id=attempt.test_id, user=attempt.user).exclude(
+        Q(score__gt=score) | as_good
+    ).update(score=score, duration=duration, attempt=attempt)
+    if not updated:
+        LeaderboardEntry.objects.bulk_create([
+            LeaderboardEntry(test_id=attempt.test_id, user=attempt.user, score=score, duration=duration,
+                             attempt=attempt)
+        ], ignore_conflicts=True)
+
+
+def _row(rank, entry):
+    duration = round(entry.duration, 3) if entry.duration is not None else None
+    return {'rank': rank, 'user': entry.user, 'score': entry.score, 'duration': duration}
+
+
+def top(test_id, n):
+    # Индекс отдает записи по баллам, досортировываются только равные по баллу
+    entries = LeaderboardEntry.objects.filter(test_id=test_id).order_by(
+        '-score', F('duration').asc(nulls_last=True), 'user')[:n]
+    rows, rank, previous = [], 0, None
+    for position, entry in enumerate(entries, start=1):
+        if (entry.score, entry.duration) != previous:
+            rank, previous = position, (entry.score, entry.duration)
+        rows.append(_row(rank, entry))
+    return rows
+
+
+def rank(test_id, user):
+    """Место пользователя или None, если у него нет завершенных попыток."""
+    entry = LeaderboardEntry.objects.filter(test_id=test_id, user=user).first()
+    if entry is None:
+        return None
+    # Как курсор в KeysetPagination: "score >= s" - граница диапазона индекса,
+    # равные по баллам, но не быстрее, отсекаются вторым условием
+    not_faster = Q(duration__isnull=True)
+    if entry.duration is not None:
+        not_faster |= Q(duration__gte=entry.duration)
+    ahead = LeaderboardEntry.objects.filter(test_id=test_id, score__gte=entry.score).exclude(
+        Q(score=entry.score) & not_faster).count()
+    return _row(ahead + 1, entry)
+
+
+@transaction.atomic
+def rebuild_leaderboard(test_id):
+    best = {}
+    for attempt_id, user, score, duration in TestAttempt.objects.filter(
+            test_id=test_id, completed_at__isnull=False).values_list(
+            'id', 'user', 'score_obtained', 'duration').iterator(chunk_size=5000):
+        if not _ranked(user):
+            continue
+        key = (-score, duration is None, duration or 0)
+        if user not in best or key < best[user][0]:
+            best[user] = (key, attempt_id, duration)
+    LeaderboardEntry.objects.filter(test_id=test_id).delete()
+    LeaderboardEntry.objects.bulk_create([
+        LeaderboardEntry(test_id=test_id, user=user, score=-key[0], duration=duration, attempt_id=attempt_id)
+        for user, (key, attempt_id, duration) in best.items()
+    ], batch_size=1000)
+    return len(best)
@@ -0,0 +1,87 @@
+"""
+Живые результаты опросов: pub/sub в памяти процесса.
+
+Пути записи голосов (голос, отмена, бюллетень, сброс буфера) после коммита
+публикуют изменения счетчиков {choice_id: +n/-n}. Подписчики - SSE-потоки
+из views.poll_events, каждый со своей asyncio-очередью. Изменения, пришедшие
+чаще POLLS_LIVE_MIN_INTERVAL, складываются и уходят клиенту одним событием,
+так что частота событий на опрос ограничена при любом потоке голосов.
+Внешний брокер (Redis и т.п.) не нужен, но и работает это в пределах
+одного процесса.
+"""
+import asyncio
+import threading
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+
+class Subscription:
+    def __init__(self, poll_id, loop):
+        self.poll_id = poll_id
+        self.loop = loop
+        self.pending = Counter()
+        self.ready = asyncio.Event()
+
+    def push(self, deltas):
+        # Вызывается только в цикле событий подписчика
+        self.pending.update(deltas)
+        self.ready.set()
+
+    def take(self):
+        deltas = {choice_id: n for choice_id, n in self.pending.items() if n}
+        self.pending.clear()
+        self.ready.clear()
+        return deltas
+
+
+class PollBroker:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, poll_id):
+        subscription = Subscription(poll_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers[poll_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.poll_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.poll_id]
+
+    def has_subscribers(self, poll_id):
+        return bool(self._subscribers.get(poll_id))
+
+    def publish(self, poll_id, deltas):
+        """Потокобезопасно: можно звать из синхронных views в любом потоке."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(poll_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push, dict(deltas))
+            except RuntimeError:
+                # Цикл событий подписчика уже закрыт
+                self.unsubscribe(subscription)
+
+
+broker = PollBroker()
+
+
+def publish_on_commit(poll_id, deltas):
+    """Публикует изменения счетчиков после коммита текущей транзакции."""
+    if deltas and broker.has_subscribers(poll_id):
+        transaction.on_commit(lambda: broker.publish(poll_id, deltas))
+
+
+def publish_votes_on_commit(votes, sign=1):
+    """То же для пачки голосов: группирует их по опросам и вариантам."""
+    per_poll = defaultdict(Counter)
+    for vote in votes:
+        per_poll[vote.poll_id][vote.choice_id] += sign
+    for poll_id, deltas in per_poll.items():
+        publish_on_commit(poll_id, deltas)
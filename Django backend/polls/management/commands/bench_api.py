@@ -0,0 +1,288 @@
+import json
+import platform
+import random
+import sqlite3
+import statistics
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from polls import urls as polls_urls
+from polls.bench import Stopwatch, percentile, seed_polls, seed_tests, temporary_database
+from polls.cache import get_cache
+from polls.grading import get_answer_key_cache
+from polls.models import Poll, Test, TestAttempt, Vote
+from polls.serializers import TestSerializer
+
+# Размеры данных: опросы x варианты x голоса, тесты x задания x попытки
+SCALES = {
+    'small': {'polls': 20, 'choices': 4, 'votes': 50, 'tests': 5, 'tasks': 10, 'attempts': 20},
+    'medium': {'polls': 200, 'choices': 6, 'votes': 500, 'tests': 20, 'tasks': 50, 'attempts': 200},
+    'large': {'polls': 500, 'choices': 8, 'votes': 2000, 'tests': 20, 'tasks': 100, 'attempts': 500},
+}
+
+# SSE-поток держит соединение до POLLS_LIVE_MAX_SECONDS, задержка запроса для него не имеет смысла
+SKIPPED_ROUTES = {'poll-events'}
+
+
+class Routes:
+    """Запросы ко всем маршрутам polls/urls.py на сгенерированных данных."""
+
+    def __init__(self, rnd, scale):
+        self.rnd = rnd
+        self.scale = scale
+        self.polls = list(Poll.objects.order_by('id').values_list('id', 'owner'))
+        self.tests = list(Test.objects.order_by('id').values_list('id', 'owner'))
+        self.choices = {}
+        for poll in Poll.objects.prefetch_related('choices'):
+            self.choices[poll.id] = [choice.id for choice in poll.choices.all()]
+        self.tasks = {}
+        for test in Test.objects.prefetch_related('tasks__options'):
+            self.tasks[test.id] = [
+                (task.id, task.task_type, task.correct_text, [o.id for o in task.options.all()])
+                for task in test.tasks.all()
+            ]
+        self.attempt_ids = list(TestAttempt.objects.values_list('id', flat=True))
+        self.counter = 0
+
+    def next(self):
+        self.counter += 1
+        return self.counter
+
+    def poll(self):
+        return self.rnd.choice(self.polls)
+
+    def test(self):
+        return self.rnd.choice(self.tests)
+
+    def answers(self, test_id):
+        answers = []
+        for task_id, task_type, correct_text, options in self.tasks[test_id]:
+            if task_type == 'text':
+                answers.append({'task': task_id, 'answer_text': self.rnd.choice([correct_text, 'не знаю'])})
+            else:
+                answers.append({'task': task_id, 'selected_options': [self.rnd.choice(options)]})
+        return answers
+
+    def all(self):
+        """
+        (название маршрута, подпись, build). build() готовит запрос вне замера
+        и возвращает (метод, url, данные, заголовки).
+        """
+        return [
+            ('api_csrf_set', 'GET csrf', lambda: ('get', reverse('api_csrf_set'), None, {})),
+            ('poll-list', 'GET poll list', lambda: ('get', reverse('poll-list'), None, {})),
+            ('poll-list', 'GET poll list page', lambda: ('get', reverse('poll-list'), {'page_size': 20}, {})),
+            ('poll-create', 'POST poll', self.create_poll),
+            ('poll-detail', 'GET poll', lambda: ('get', reverse('poll-detail', args=[self.poll()[0]]), None, {})),
+            ('poll-vote', 'POST vote', self.vote),
+            ('poll-unvote', 'POST unvote', self.unvote),
+            ('poll-ballot', 'POST ballot', self.ballot),
+            ('poll-export', 'GET poll export', self.export_poll),
+            ('import', 'POST import', self.import_ndjson),
+            ('test-list-create', 'GET test list', lambda: ('get', reverse('test-list-create'), None, {})),
+            ('test-list-create', 'POST test', self.create_test),
+            ('test-detail', 'GET test', lambda: ('get', reverse('test-detail', args=[self.test()[0]]), None, {})),
+            ('test-detail', 'PUT test', self.update_test),
+            ('test-submit', 'POST submit', self.submit),
+            ('test-attempt-detail', 'GET attempt', lambda: (
+                'get', reverse('test-attempt-detail', args=[self.rnd.choice(self.attempt_ids)]), None, {})),
+            ('test-attempts', 'GET attempts page', lambda: (
+                'get', reverse('test-attempts', args=[self.test()[0]]), None, {})),
+            ('test-stats', 'GET test stats', lambda: ('get', reverse('test-stats', args=[self.test()[0]]), None, {})),
+            ('test-leaderboard', 'GET leaderboard', lambda: (
+                'get', reverse('test-leaderboard', args=[self.test()[0]]), {'top': 10, 'user': 'student1'}, {})),
+            ('test-export', 'GET test export', self.export_test),
+        ]
+
+    def create_poll(self):
+        choices = [{'choice_text': f'Вариант {j}'} for j in range(self.scale['choices'])]
+        return 'post', reverse('poll-create'), {'title': 'bench', 'choices': choices}, {}
+
+    def vote(self):
+        poll_id, _ = self.poll()
+        data = {'choice_id': self.rnd.choice(self.choices[poll_id]), 'user': f'bench{self.next()}'}
+        return 'post', reverse('poll-vote', args=[poll_id]), data, {}
+
+    def unvote(self):
+        poll_id, _ = self.poll()
+        user = f'voter{self.rnd.randrange(self.scale["votes"])}' if self.scale['votes'] else 'nobody'
+        return 'post', reverse('poll-unvote', args=[poll_id]), {'user': user}, {}
+
+    def ballot(self):
+        votes = []
+        for _ in range(10):
+            poll_id, _ = self.poll()
+            votes.append({'poll_id': poll_id, 'choice_id': self.rnd.choice(self.choices[poll_id])})
+        return 'post', reverse('poll-ballot'), {'user': f'bench{self.next()}', 'votes': votes}, {}
+
+    def export_poll(self):
+        poll_id, owner = self.poll()
+        return 'get', reverse('poll-export', args=[poll_id]), None, {'HTTP_X_USER_ID': owner}
+
+    def import_ndjson(self):
+        test = {'type': 'test', **self.test_payload()}
+        poll = {'type': 'poll', 'title': 'bench', 'choices': [{'choice_text': 'да'}, {'choice_text': 'нет'}]}
+        body = '\n'.join(json.dumps(r, ensure_ascii=False) for r in (test, poll))
+        return 'ndjson', reverse('import'), body, {}
+
+    def test_payload(self):
+        return {
+            'title': 'bench',
+            'tasks': [
+                {'question': f'Вопрос {j}', 'task_type': 'single', 'score': 1,
+                 'options': [{'text': f'Ответ {k}', 'is_correct': k == 0} for k in range(4)]}
+                for j in range(self.scale['tasks'])
+            ],
+        }
+
+    def create_test(self):
+        return 'post', reverse('test-list-create'), self.test_payload(), {}
+
+    def update_test(self):
+        test_id, owner = self.test()
+        data = TestSerializer(Test.objects.get(pk=test_id)).data
+        data['title'] = f'bench {self.next()}'
+        data['tasks'][0]['score'] = self.rnd.randrange(1, 4)
+        return 'put', reverse('test-detail', args=[test_id]), data, {'HTTP_X_USER_ID': owner}
+
+    def submit(self):
+        test_id, _ = self.test()
+        data = {'test': test_id, 'user': f'bench{self.next()}', 'answers': self.answers(test_id)}
+        return 'post', reverse('test-submit'), data, {}
+
+    def export_test(self):
+        test_id, owner = self.test()
+        return 'get', reverse('test-export', args=[test_id]), None, {'HTTP_X_USER_ID': owner}
+
+
+def send(client, method, url, data, headers):
+    if method == 'get':
+        return client.get(url, data, **headers)
+    if method == 'ndjson':
+        return client.generic('POST', url, data, content_type='application/x-ndjson', **headers)
+    return getattr(client, method)(url, data, format='json', **headers)
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку и число SQL-запросов по всем маршрутам API на сгенерированных данных '
+        '(SQLite, временная база). --output пишет результаты в JSON, --baseline сравнивает с прошлым прогоном.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='small,medium', help=f'через запятую из: {", ".join(SCALES)}')
+        parser.add_argument('--repeat', type=int, default=20, help='запросов на маршрут')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='куда записать результаты (JSON)')
+        parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='допустимый рост p50 (доля), больше - регрессия')
+        parser.add_argument('--min-delta-ms', type=float, default=0.5,
+                            help='рост p50 меньше этого считается шумом')
+
+    def handle(self, *args, **options):
+        scales = [s.strip() for s in options['scales'].split(',') if s.strip()]
+        unknown = set(scales) - set(SCALES)
+        if unknown:
+            raise CommandError(f'Неизвестные размеры: {", ".join(sorted(unknown))}')
+
+        report = {
+            'meta': {
+                'seed': options['seed'],
+                'repeat': options['repeat'],
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'sqlite': sqlite3.sqlite_version,
+            },
+            'scales': {},
+        }
+        for scale in scales:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{scale}: {SCALES[scale]}'))
+            report['scales'][scale] = self.run_scale(scale, options)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Результаты записаны в {options['output']}")
+        if options['baseline']:
+            self.compare(report, options)
+
+    def run_scale(self, scale, options):
+        rnd = random.Random(options['seed'])
+        sizes = SCALES[scale]
+        results = {}
+        with temporary_database():
+            get_cache().clear()
+            get_answer_key_cache().clear()
+            seed_polls(rnd, sizes['polls'], sizes['choices'], sizes['votes'])
+            seed_tests(rnd, sizes['tests'], sizes['tasks'], sizes['attempts'])
+            routes = Routes(rnd, sizes)
+            client = APIClient(SERVER_NAME='localhost')
+            measured = set()
+            for name, label, build in routes.all():
+                measured.add(name)
+                send(client, *build())  # прогрев: кэши, ключи ответов
+                timings, queries, statuses = [], [], set()
+                for _ in range(options['repeat']):
+                    request = build()
+                    with CaptureQueriesContext(connection) as ctx, Stopwatch() as sw:
+                        response = send(client, *request)
+                        if response.streaming:
+                            for _ in response.streaming_content:
+                                pass
+                    timings.append(sw.elapsed * 1000)
+                    queries.append(len(ctx.captured_queries))
+                    statuses.add(response.status_code)
+                results[label] = {
+                    'route': name,
+                    'p50_ms': round(percentile(timings, 50), 3),
+                    'p95_ms': round(percentile(timings, 95), 3),
+                    'p99_ms': round(percentile(timings, 99), 3),
+                    'mean_ms': round(statistics.fmean(timings), 3),
+                    'queries': max(queries),
+                    'status': sorted(statuses),
+                }
+                row = results[label]
+                self.stdout.write(
+                    f"  {label:<20} p50 {row['p50_ms']:>9.2f} мс  p95 {row['p95_ms']:>9.2f} мс  "
+                    f"запросов {row['queries']:>4}  {row['status']}"
+                )
+            self.check_coverage(measured)
+            self.stdout.write(f'  голосов в базе: {Vote.objects.count()}')
+        return results
+
+    def check_coverage(self, measured):
+        # Новый маршрут в polls/urls.py без замера - ошибка, а не тихий пропуск
+        names = {pattern.name for pattern in polls_urls.urlpatterns if pattern.name}
+        missing = names - measured - SKIPPED_ROUTES
+        if missing:
+            raise CommandError(f'Маршруты без замеров: {", ".join(sorted(missing))}')
+
+    def compare(self, report, options):
+        with open(options['baseline'], encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = []
+        for scale, results in report['scales'].items():
+            for label, row in results.items():
+                old = baseline.get('scales', {}).get(scale, {}).get(label)
+                if old is None:
+                    continue
+                delta = row['p50_ms'] - old['p50_ms']
+                slower = delta > options['min_delta_ms'] and row['p50_ms'] > old['p50_ms'] * (1 + options['tolerance'])
+                more_queries = row['queries'] > old['queries']
+                mark = 'РЕГРЕССИЯ' if slower or more_queries else 'ok'
+                self.stdout.write(
+                    f"{scale:>7} {label:<20} p50 {old['p50_ms']:>9.2f} -> {row['p50_ms']:>9.2f} мс  "
+                    f"запросов {old['queries']:>4} -> {row['queries']:>4}  {mark}"
+                )
+                if mark != 'ok':
+                    regressions.append(f'{scale}/{label}')
+        if regressions:
+            raise CommandError(f'Регрессии относительно {options["baseline"]}: {", ".join(regressions)}')
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
+
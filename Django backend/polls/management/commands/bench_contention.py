@@ -0,0 +1,126 @@
+import json
+import logging
+import multiprocessing
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client
+from django.urls import reverse
+
+from polls.bench import Stopwatch, temporary_database
+from polls.models import Choice, Poll, Vote
+
+
+def vote_worker(poll_id, choice_ids, users, threads, results):
+    """
+    Процесс-голосующий: threads потоков отправляют POST /vote/ по всем users
+    через полный стек запроса. В results уходит Counter кодов ответа.
+    """
+    # Ошибки считаются по кодам ответа, трассировка на каждый 500 не нужна
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    statuses = Counter()
+    lock = threading.Lock()
+    # Компактный ответ: полный опрос в ответе растет с числом голосов и заслоняет запись
+    url = reverse('poll-vote', args=[poll_id]) + '?response=compact'
+
+    def run(part):
+        client = Client(SERVER_NAME='localhost', raise_request_exception=False)
+        local = Counter()
+        try:
+            for i, user in enumerate(part):
+                data = {'choice_id': choice_ids[i % len(choice_ids)], 'user': user}
+                local[client.post(url, data, content_type='application/json').status_code] += 1
+        finally:
+            connection.close()
+        with lock:
+            statuses.update(local)
+
+    pool = [threading.Thread(target=run, args=(users[n::threads],)) for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put(dict(statuses))
+
+
+class Command(BaseCommand):
+    help = 'Конкурентная запись голосов несколькими процессами: профили SQLite из POLLS_SQLITE_PROFILES.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default='default,production')
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--threads', type=int, default=4, help='потоков в каждом процессе')
+        parser.add_argument('--votes', type=int, default=2000, help='голосов всего')
+        parser.add_argument('--output', help='записать результаты в JSON')
+
+    def handle(self, *args, **options):
+        profiles = [name.strip() for name in options['profiles'].split(',') if name.strip()]
+        unknown = set(profiles) - set(settings.POLLS_SQLITE_PROFILES)
+        if unknown:
+            raise CommandError(f'Неизвестные профили: {", ".join(sorted(unknown))}')
+        results = {name: self.run_profile(name, options) for name in profiles}
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+
+    def run_profile(self, name, options):
+        profile = settings.POLLS_SQLITE_PROFILES[name]
+        saved = {key: connection.settings_dict[key] for key in ('OPTIONS', 'CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+        connection.close()
+        connection.settings_dict.update({'OPTIONS': {}, 'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, **profile})
+        try:
+            with temporary_database():
+                return self.run(name, options)
+        finally:
+            connection.close()
+            connection.settings_dict.update(saved)
+
+    def run(self, name, options):
+        poll = Poll.objects.create(title=f'bench {name}', multiple_answers=True)
+        Choice.objects.bulk_create([Choice(poll=poll, choice_text=str(i)) for i in range(4)])
+        choice_ids = list(poll.choices.values_list('id', flat=True))
+        votes, processes = options['votes'], options['processes']
+        users = [f'bench-{i}' for i in range(votes)]
+        # Процессы наследуют все через fork, открытое соединение им передавать нельзя
+        connection.close()
+
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        workers = [
+            context.Process(target=vote_worker, args=(poll.id, choice_ids, users[n::processes], options['threads'], results))
+            for n in range(processes)
+        ]
+        with Stopwatch() as sw:
+            for worker in workers:
+                worker.start()
+            statuses = Counter()
+            for _ in workers:
+                statuses.update(results.get())
+            for worker in workers:
+                worker.join()
+
+        stored = Vote.objects.filter(poll=poll).count()
+        counted = poll.choices.aggregate(total=Sum('votes_count'))['total'] or 0
+        created = statuses.get(201, 0)
+        result = {
+            'votes': votes,
+            'seconds': round(sw.elapsed, 3),
+            'votes_per_second': round(votes / sw.elapsed, 1),
+            'created': created,
+            'failed': votes - created,
+            'statuses': {str(code): count for code, count in sorted(statuses.items())},
+            'stored': stored,
+            'counted': counted,
+            # Ответ 201, а голоса в базе нет, или счетчик разошелся с голосами
+            'lost': max(created - stored, 0) + abs(stored - counted),
+        }
+        self.stdout.write(
+            f'{name:>10}: {votes} голосов, {processes} проц. x {options["threads"]} потоков за {sw.elapsed:.2f} с '
+            f'({result["votes_per_second"]:.0f}/с), ошибок {result["failed"]} {result["statuses"]}, '
+            f'записано {stored}, в счетчиках {counted}, потеряно {result["lost"]}'
+        )
+        return result
@@ -0,0 +1,65 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from polls.bench import Stopwatch, percentile, temporary_database
+from polls.models import Task, TaskOption, Test
+from polls.serializers import TestAttemptSerializer
+
+
+class Command(BaseCommand):
+    help = 'Замеряет проверку попытки теста (по умолчанию 200 вопросов).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=200)
+        parser.add_argument('--options', type=int, default=4)
+        parser.add_argument('--attempts', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        with temporary_database():
+            test = self.make_test(options['tasks'], options['options'])
+            key = list(test.tasks.order_by('id').prefetch_related('options'))
+            timings, queries = [], []
+            for _ in range(options['attempts']):
+                payload = {'test': test.id, 'user': 'bench', 'answers': self.make_answers(key, rnd)}
+                with CaptureQueriesContext(connection) as ctx, Stopwatch() as sw:
+                    serializer = TestAttemptSerializer(data=payload)
+                    serializer.is_valid(raise_exception=True)
+                    serializer.save()
+                timings.append(sw.elapsed * 1000)
+                queries.append(len(ctx.captured_queries))
+        self.stdout.write(
+            f"{options['tasks']} вопросов, {options['attempts']} попыток: "
+            f"p50 {percentile(timings, 50):.1f} мс, p95 {percentile(timings, 95):.1f} мс, "
+            f"запросов на попытку {max(queries)}"
+        )
+
+    def make_test(self, n_tasks, n_options):
+        test = Test.objects.create(title='bench')
+        types = ('single', 'multiple', 'text')
+        tasks = Task.objects.bulk_create([
+            Task(test=test, question=f'q{i}', task_type=types[i % 3], score=1 + i % 3, correct_text=f'answer {i}')
+            for i in range(n_tasks)
+        ])
+        TaskOption.objects.bulk_create([
+            TaskOption(task=task, text=f'o{j}', is_correct=j == 0 or (task.task_type == 'multiple' and j == 1))
+            for task in tasks if task.task_type != 'text'
+            for j in range(n_options)
+        ])
+        return test
+
+    def make_answers(self, tasks, rnd):
+        answers = []
+        for task in tasks:
+            option_ids = [o.id for o in task.options.all()]
+            if task.task_type == 'text':
+                answers.append({'task': task.id, 'answer_text': rnd.choice([task.correct_text.upper(), 'wrong'])})
+            elif task.task_type == 'single':
+                answers.append({'task': task.id, 'selected_options': [rnd.choice(option_ids)]})
+            else:
+                answers.append({'task': task.id, 'selected_options': rnd.sample(option_ids, 2)})
+        return answers
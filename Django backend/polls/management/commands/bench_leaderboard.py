@@ -0,0 +1,79 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from polls import leaderboard
+from polls.bench import Stopwatch, percentile, temporary_database
+from polls.models import Test, TestAttempt
+
+
+class Command(BaseCommand):
+    help = 'Замеряет таблицу лидеров на 100k попыток: обновление, top N и место пользователя.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--attempts', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        with temporary_database():
+            test = Test.objects.create(title='bench')
+            attempts = self.make_attempts(test, options, rnd)
+
+            with Stopwatch() as sw, transaction.atomic():
+                for attempt in attempts:
+                    leaderboard.record_attempt(attempt)
+            self.stdout.write(
+                f"обновление: {len(attempts)} попыток за {sw.elapsed:.2f} с "
+                f"({sw.elapsed / len(attempts) * 1e6:.0f} мкс на попытку)"
+            )
+
+            with Stopwatch() as sw:
+                users = leaderboard.rebuild_leaderboard(test.id)
+            self.stdout.write(f'пересборка: {users} участников за {sw.elapsed:.2f} с')
+
+            names = [f'user{rnd.randrange(options["users"])}' for _ in range(options['queries'])]
+            self.measure('top N', lambda name: leaderboard.top(test.id, options['top']), names)
+            self.measure('место пользователя', lambda name: leaderboard.rank(test.id, name), names)
+            # Для сравнения: то же место "в лоб" - сортировка всех попыток теста
+            self.measure('место по попыткам', lambda name: self.naive_rank(test.id, name), names[:20])
+
+    def make_attempts(self, test, options, rnd):
+        now = timezone.now()
+        rows = []
+        for _ in range(options['attempts']):
+            completed_at = now - timedelta(seconds=rnd.randrange(10 ** 6))
+            duration = rnd.uniform(30, 3600)
+            rows.append(TestAttempt(
+                test=test, user=f'user{rnd.randrange(options["users"])}',
+                score_obtained=rnd.randrange(101), total_score=100,
+                started_at=completed_at - timedelta(seconds=duration), submitted_at=completed_at,
+                completed_at=completed_at, duration=duration,
+            ))
+        return TestAttempt.objects.bulk_create(rows, batch_size=1000)
+
+    def naive_rank(self, test_id, user):
+        best = {}
+        for name, score, duration in TestAttempt.objects.filter(test_id=test_id).order_by(
+                '-score_obtained').values_list('user', 'score_obtained', 'duration'):
+            key = (-score, duration)
+            if name not in best or key < best[name]:
+                best[name] = key
+        ordered = sorted(best.values())
+        return ordered.index(best[user]) + 1 if user in best else None
+
+    def measure(self, label, query, names):
+        timings = []
+        for name in names:
+            with Stopwatch() as sw:
+                query(name)
+            timings.append(sw.elapsed * 1000)
+        self.stdout.write(
+            f'{label}: p50 {percentile(timings, 50):.2f} мс, p95 {percentile(timings, 95):.2f} мс'
+        )
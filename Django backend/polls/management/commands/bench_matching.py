@@ -0,0 +1,57 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from polls.bench import Stopwatch
+from polls.matching import BASIC, STANDARD, TextMatcher, normalize
+
+WORDS = ['москва', 'санкт-петербург', 'ёлка', 'фотосинтез', 'митохондрия', 'пифагор', 'электрон', 'квадрат']
+
+
+class Command(BaseCommand):
+    help = 'Замеряет проверку текстовых ответов (нормализация, принятые ответы, опечатки).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--answers', type=int, default=20000)
+        parser.add_argument('--accepted', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        accepted = [' '.join(rnd.sample(WORDS, 2)).title() for _ in range(options['accepted'])]
+        answers = [self.make_answer(rnd, rnd.choice(accepted)) for _ in range(options['answers'])]
+
+        # Как было до matcher: нормализация правильного ответа на каждую проверку
+        with Stopwatch() as sw:
+            correct = sum(a.strip().lower() == accepted[0].strip().lower() for a in answers)
+        self.report('strip/lower, один ответ', sw, correct, answers)
+
+        for profile, typos in ((BASIC, 0), (STANDARD, 0), (STANDARD, 1), (STANDARD, 2)):
+            matcher = TextMatcher(accepted, profile, typos)
+            with Stopwatch() as sw:
+                correct = sum(matcher.match(a) for a in answers)
+            self.report(f'{profile}, опечаток {typos}', sw, correct, answers)
+
+        # Повторная нормализация ключа на каждую проверку - то, от чего уходит TextMatcher
+        with Stopwatch() as sw:
+            correct = sum(normalize(a) in {normalize(t) for t in accepted} for a in answers)
+        self.report('standard, ключ на каждый ответ', sw, correct, answers)
+
+    def make_answer(self, rnd, text):
+        variant = rnd.randrange(5)
+        if variant == 1:
+            text = f'  {text.upper()}, '
+        elif variant == 2:
+            text = text.replace('е', 'ё').replace(' ', '   ')
+        elif variant == 3:
+            i = rnd.randrange(len(text))
+            text = text[:i] + 'x' + text[i + 1:]
+        elif variant == 4:
+            text = 'совсем другой ответ'
+        return text
+
+    def report(self, label, sw, correct, answers):
+        self.stdout.write(
+            f'{label:>32}: {len(answers) / sw.elapsed:>9.0f} ответов/с, '
+            f'{sw.elapsed / len(answers) * 1e6:.2f} мкс на ответ, засчитано {correct}'
+        )
@@ -0,0 +1,62 @@
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.test.utils import override_settings
+
+from polls.bench import Stopwatch, temporary_database
+from polls.ingest import BUFFERED, DIRECT, flush_vote_buffer
+from polls.models import Choice, Poll, Vote
+from polls.serializers import VoteSerializer
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пропускную способность записи голосов: direct против buffered.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--votes', type=int, default=2000)
+        parser.add_argument('--choices', type=int, default=4)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--buffer-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            for mode in (DIRECT, BUFFERED):
+                with override_settings(POLLS_VOTE_INGEST=mode, POLLS_VOTE_BUFFER_SIZE=options['buffer_size']):
+                    self.run(mode, options)
+
+    def run(self, mode, options):
+        poll = Poll.objects.create(title=f'bench {mode}', multiple_answers=True)
+        Choice.objects.bulk_create([Choice(poll=poll, choice_text=str(i)) for i in range(options['choices'])])
+        choice_ids = list(poll.choices.values_list('id', flat=True))
+        threads, votes = options['threads'], options['votes']
+        errors = []
+
+        def worker(n):
+            try:
+                for i in range(n, votes, threads):
+                    serializer = VoteSerializer(data={'choice_id': choice_ids[i % len(choice_ids)]})
+                    serializer.is_valid(raise_exception=True)
+                    try:
+                        serializer.save(user=f'bench-{i}', poll=poll)
+                    except OperationalError as exc:  # database is locked
+                        errors.append(exc)
+            finally:
+                connection.close()
+
+        with Stopwatch() as sw:
+            pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+            for t in pool:
+                t.start()
+            for t in pool:
+                t.join()
+            flush_vote_buffer()
+
+        stored = Vote.objects.filter(poll=poll).count()
+        counted = poll.choices.aggregate(total=Sum('votes_count'))['total']
+        self.stdout.write(
+            f'{mode:>8}: {votes} голосов за {sw.elapsed:.2f} с '
+            f'({votes / sw.elapsed:.0f} голосов/с), записано {stored}, '
+            f'в счетчиках {counted}, ошибок блокировки {len(errors)}'
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import TestAttempt
+from polls.submissions import grade_attempt
+
+
+class Command(BaseCommand):
+    help = 'Проверяет попытки, оставшиеся в статусе pending (например, после перезапуска).'
+
+    def handle(self, *args, **options):
+        pending = TestAttempt.objects.filter(status=TestAttempt.PENDING).order_by('id').values_list('id', flat=True)
+        graded = 0
+        for attempt_id in pending.iterator():
+            attempt = grade_attempt(attempt_id)
+            if attempt is not None and attempt.status == TestAttempt.COMPLETED:
+                graded += 1
+        self.stdout.write(self.style.SUCCESS(f'Проверено попыток: {graded}'))
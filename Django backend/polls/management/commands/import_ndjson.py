@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from polls.importer import Importer
+
+
+class Command(BaseCommand):
+    help = 'Импортирует опросы и тесты из NDJSON-файла (строка - объект с полем "type": "poll" или "test").'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='путь к файлу, "-" - стандартный ввод')
+        parser.add_argument('--owner', help='владелец для записей без owner')
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        importer = Importer(owner=options['owner'], batch_size=options['batch_size'])
+        # Строки читаются байтами: UTF-8 декодирует Importer, чтобы битая
+        # строка попала в отчет, а не оборвала импорт
+        if options['path'] == '-':
+            report = importer.run(sys.stdin.buffer)
+        else:
+            with open(options['path'], 'rb') as lines:
+                report = importer.run(lines)
+        for error in report['errors']:
+            self.stderr.write(f"строка {error['line']}: {error['errors']}")
+        if report['error_count'] > len(report['errors']):
+            self.stderr.write(f"... и еще {report['error_count'] - len(report['errors'])} ошибок")
+        created = report['created']
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано опросов: {created['polls']}, тестов: {created['tests']}, ошибок: {report['error_count']}"
+        ))
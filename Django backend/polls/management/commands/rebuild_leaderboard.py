@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from polls.leaderboard import rebuild_leaderboard
+from polls.models import Test
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает таблицы лидеров тестов по завершенным попыткам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('test_ids', nargs='*', type=int, help='id тестов (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        tests = Test.objects.order_by('id').values_list('id', flat=True)
+        if options['test_ids']:
+            tests = tests.filter(id__in=options['test_ids'])
+        total = 0
+        for test_id in tests.iterator():
+            users = rebuild_leaderboard(test_id)
+            total += 1
+            self.stdout.write(f'Тест {test_id}: {users} участников')
+        self.stdout.write(self.style.SUCCESS(f'Таблицы лидеров пересобраны для {total} тестов'))
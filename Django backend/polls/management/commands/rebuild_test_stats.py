@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import Test
+from polls.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает статистику тестов с нуля по сохраненным попыткам и ответам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('test_ids', nargs='*', type=int, help='id тестов (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        tests = Test.objects.order_by('id').values_list('id', flat=True)
+        if options['test_ids']:
+            tests = tests.filter(id__in=options['test_ids'])
+        total = 0
+        for test_id in tests.iterator():
+            attempts = rebuild_stats(test_id)
+            total += 1
+            self.stdout.write(f'Тест {test_id}: {attempts} попыток')
+        self.stdout.write(self.style.SUCCESS(f'Статистика пересобрана для {total} тестов'))
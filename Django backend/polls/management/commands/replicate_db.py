@@ -0,0 +1,55 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.bench import Stopwatch
+
+
+def replicate(source, target, timeout=20):
+    """
+    Копирует базу source в target через sqlite3 backup API. Все страницы
+    копируются за один шаг, так что копия согласованная, а читатели target
+    видят либо старое, либо новое состояние целиком.
+    """
+    src = sqlite3.connect(source, timeout=timeout)
+    dst = sqlite3.connect(target, timeout=timeout)
+    try:
+        src.backup(dst)
+        # Копия основной базы в WAL тоже в WAL, и читатели с mode=ro заводили бы
+        # рядом с ней -wal и -shm; реплику никто не пишет, ей хватает журнала отката
+        dst.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        dst.close()
+        src.close()
+
+
+class Command(BaseCommand):
+    help = 'Копирует основную базу SQLite в реплику (POLLS_DB_REPLICA) разово или с интервалом.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', help='по умолчанию DATABASES["default"]')
+        parser.add_argument('--target', help='по умолчанию база реплики')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='повторять каждые N секунд; должно быть меньше POLLS_DB_STICKY_SECONDS')
+
+    def handle(self, *args, **options):
+        source = options['source'] or settings.DATABASES['default']['NAME']
+        # В DATABASES у реплики URI только для чтения, путь к файлу - в POLLS_DB_REPLICA
+        target = options['target'] or getattr(settings, 'POLLS_DB_REPLICA', None)
+        if target is None:
+            raise CommandError('Реплика не настроена: задайте POLLS_DB_REPLICA или --target.')
+        if str(source) == str(target):
+            raise CommandError('Источник и реплика - один и тот же файл.')
+
+        while True:
+            with Stopwatch() as sw:
+                replicate(str(source), str(target))
+            self.stdout.write(f'{source} -> {target}: {sw.elapsed * 1000:.1f} мс')
+            if not options['interval']:
+                return
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                return
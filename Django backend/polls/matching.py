@@ -0,0 +1,141 @@
+"""
+Проверка текстовых ответов.
+
+У текстового задания может быть несколько принятых ответов (в correct_text
+по одному на строку, если включен Task.alternative_answers), профиль
+нормализации (Task.text_profile) и допуск опечаток (Task.max_typos -
+расстояние Левенштейна). Знаки числа (-5, +7, 3.14, 1,5) и C++/C#
+нормализация сохраняет, а ответ только из знаков (например, "?")
+сравнивается как есть.
+
+TextMatcher собирается вместе с ключом ответов (polls/grading.py), то есть
+один раз на версию теста: принятые ответы нормализуются заранее и лежат
+в множестве. На каждый ответ студента остается нормализовать его текст,
+проверить вхождение в множество и, только если допуск ненулевой и точного
+совпадения нет, посчитать расстояние в полосе ширины 2k+1 - O(n·k)
+вместо O(n·m) полной таблицы.
+"""
+import re
+import string
+import unicodedata
+
+BASIC = 'basic'
+STANDARD = 'standard'
+COMPACT = 'compact'
+
+PROFILE_CHOICES = [
+    (BASIC, 'Регистр и крайние пробелы'),
+    (STANDARD, 'Регистр, пробелы, знаки препинания, ё/е'),
+    (COMPACT, 'Как standard, но без пробелов вообще'),
+]
+
+# Знаки препинания ASCII и типографские кавычки/тире
+_PUNCTUATION = string.punctuation + '«»„“”‘’–—…№'
+# Регулярное выражение здесь быстрее str.translate: таблица для кириллицы
+# смотрится в dict на каждый символ. Первая группа - то, что остается:
+# знак или разделитель перед цифрой и + или # в конце слова
+_PUNCTUATION_RE = re.compile(rf'([-+.,](?=\d)|(?<=\w)[+#]+(?!\w))|[{re.escape(_PUNCTUATION)}]')
+
+
+def _strip_punctuation(match):
+    return match.group(1) or ' '
+
+
+def _basic(text):
+    return text.strip().lower()
+
+
+def _standard(text):
+    # "й"/"ё" могут прийти как буква + комбинирующий знак; проверка дешевле приведения
+    if not unicodedata.is_normalized('NFC', text):
+        text = unicodedata.normalize('NFC', text)
+    return ' '.join(_PUNCTUATION_RE.sub(_strip_punctuation, text.lower()).replace('ё', 'е').split())
+
+
+def _compact(text):
+    return _standard(text).replace(' ', '')
+
+
+NORMALIZERS = {
+    BASIC: _basic,
+    STANDARD: _standard,
+    COMPACT: _compact,
+}
+
+
+def normalize(text, profile=STANDARD):
+    # Если от текста ничего не осталось, он сравнивается как есть (без крайних пробелов)
+    return NORMALIZERS[profile](text) or text.strip()
+
+
+def accepted_answers(correct_text, alternatives=False):
+    """
+    Принятые ответы задания: весь correct_text или, если alternatives,
+    каждая его непустая строка.
+    """
+    if not correct_text or not correct_text.strip():
+        return []
+    if not alternatives:
+        return [correct_text]
+    return [line for line in correct_text.splitlines() if line.strip()]
+
+
+def within_distance(a, b, k):
+    """
+    True, если расстояние Левенштейна между a и b не больше k.
+    Считается только полоса |i - j| <= k таблицы: O(len(a)·k).
+    """
+    if a == b:
+        return True
+    n, m = len(a), len(b)
+    if k <= 0 or abs(n - m) > k:
+        return False
+    too_far = k + 1
+    width = 2 * k + 1
+    # row[d] - расстояние для префиксов a[:i] и b[:j], где j = i - k + d
+    prev = [d - k if k <= d <= k + m else too_far for d in range(width)]
+    for i in range(1, n + 1):
+        row = [too_far] * width
+        ai = a[i - 1]
+        best = too_far
+        for d in range(width):
+            j = i - k + d
+            if j < 0 or j > m:
+                continue
+            if j == 0:
+                value = i
+            else:
+                value = prev[d] + (ai != b[j - 1])
+                if d + 1 < width and prev[d + 1] + 1 < value:
+                    value = prev[d + 1] + 1
+                if d > 0 and row[d - 1] + 1 < value:
+                    value = row[d - 1] + 1
+            row[d] = value if value < too_far else too_far
+            if row[d] < best:
+                best = row[d]
+        if best > k:
+            return False
+        prev = row
+    return prev[m - n + k] <= k
+
+
+class TextMatcher:
+    __slots__ = ('profile', 'accepted', 'max_typos')
+
+    def __init__(self, accepted, profile=STANDARD, max_typos=0):
+        self.profile = profile
+        self.max_typos = max_typos
+        self.accepted = frozenset(filter(None, (normalize(text, profile) for text in accepted)))
+
+    def __bool__(self):
+        return bool(self.accepted)
+
+    def match(self, text):
+        if not text or not self.accepted:
+            return False
+        answer = normalize(text, self.profile)
+        if answer in self.accepted:
+            return True
+        if self.max_typos:
+            return any(within_distance(answer, accepted, self.max_typos) for accepted in self.accepted)
+        return False
@@ -0,0 +1,247 @@
+"""
+Метрики запросов по маршрутам и их выдача в формате Prometheus.
+
+MetricsMiddleware (включается POLLS_METRICS) на каждый запрос пишет в
+registry, с ключом по имени маршрута (resolver_match.view_name):
+число запросов по методу и коду ответа, гистограмму времени ответа,
+число и суммарное время SQL-запросов (connection.execute_wrapper на всех
+соединениях) и размер тела ответа. /api/metrics/ отдает это текстом для
+Prometheus.
+
+Если запрос дольше POLLS_METRICS_SLOW_MS, в лог polls.metrics уходит
+предупреждение с самыми долгими SQL-запросами.
+
+Метрики живут в памяти процесса: при нескольких процессах сервера каждый
+отдает свои. У потоковых ответов (выгрузки, SSE) время и SQL считаются до
+начала отдачи тела, размер - по мере отдачи.
+
+При POLLS_METRICS = False middleware снимается с цепочки при загрузке
+(MiddlewareNotUsed) и ничего не стоит.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограммы времени ответа, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Маршрут не найден (404 до view) - все такие запросы в одну строку
+UNRESOLVED = '<unresolved>'
+
+
+def metrics_enabled():
+    return getattr(settings, 'POLLS_METRICS', False)
+
+
+class EndpointMetrics:
+    __slots__ = ('requests', 'buckets', 'duration_sum', 'queries', 'query_seconds', 'response_bytes')
+
+    def __init__(self, bucket_count):
+        self.requests = {}          # (метод, код) -> число
+        self.buckets = [0] * (bucket_count + 1)  # последний - +Inf
+        self.duration_sum = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.response_bytes = 0
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bucket_bounds = tuple(buckets)
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def _get(self, endpoint):
+        metrics = self._endpoints.get(endpoint)
+        if metrics is None:
+            metrics = self._endpoints[endpoint] = EndpointMetrics(len(self.bucket_bounds))
+        return metrics
+
+    def observe(self, endpoint, method, status, duration, queries, query_seconds, size=0):
+        index = bisect.bisect_left(self.bucket_bounds, duration)
+        with self._lock:
+            metrics = self._get(endpoint)
+            key = (method, status)
+            metrics.requests[key] = metrics.requests.get(key, 0) + 1
+            metrics.buckets[index] += 1
+            metrics.duration_sum += duration
+            metrics.queries += queries
+            metrics.query_seconds += query_seconds
+            metrics.response_bytes += size
+
+    def add_bytes(self, endpoint, size):
+        with self._lock:
+            self._get(endpoint).response_bytes += size
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    'requests': dict(m.requests),
+                    'buckets': list(m.buckets),
+                    'duration_sum': m.duration_sum,
+                    'queries': m.queries,
+                    'query_seconds': m.query_seconds,
+                    'response_bytes': m.response_bytes,
+                }
+                for endpoint, m in self._endpoints.items()
+            }
+
+    def render(self):
+        """Текстовый формат Prometheus (version 0.0.4)."""
+        data = sorted(self.snapshot().items())
+        lines = [
+            '# HELP polls_http_requests_total Запросы по маршруту, методу и коду ответа.',
+            '# TYPE polls_http_requests_total counter',
+        ]
+        for endpoint, m in data:
+            for (method, status), count in sorted(m['requests'].items()):
+                lines.append(
+                    f'polls_http_requests_total{{endpoint="{_escape(endpoint)}",method="{method}",status="{status}"}} {count}'
+                )
+        lines += [
+            '# HELP polls_http_request_duration_seconds Время ответа.',
+            '# TYPE polls_http_request_duration_seconds histogram',
+        ]
+        for endpoint, m in data:
+            label = f'endpoint="{_escape(endpoint)}"'
+            total = 0
+            for bound, count in zip(self.bucket_bounds + ('+Inf',), m['buckets']):
+                total += count
+                lines.append(f'polls_http_request_duration_seconds_bucket{{{label},le="{bound}"}} {total}')
+            lines.append(f'polls_http_request_duration_seconds_sum{{{label}}} {m["duration_sum"]:.6f}')
+            lines.append(f'polls_http_request_duration_seconds_count{{{label}}} {total}')
+        for name, key, kind, help_text, fmt in (
+            ('polls_db_queries_total', 'queries', 'counter', 'SQL-запросы.', '{}'),
+            ('polls_db_query_duration_seconds_total', 'query_seconds', 'counter', 'Время SQL-запросов.', '{:.6f}'),
+            ('polls_http_response_size_bytes_total', 'response_bytes', 'counter', 'Размер тел ответов.', '{}'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for endpoint, m in data:
+                lines.append(f'{name}{{endpoint="{_escape(endpoint)}"}} ' + fmt.format(m[key]))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry(getattr(settings, 'POLLS_METRICS_BUCKETS', DEFAULT_BUCKETS))
+
+
+class QueryRecorder:
+    """execute_wrapper: число и время SQL-запросов, для медленного лога - по тексту."""
+
+    def __init__(self, keep_sql):
+        self.count = 0
+        self.seconds = 0.0
+        self.keep_sql = keep_sql
+        self.statements = {}  # sql -> [число, время]
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            if self.keep_sql:
+                entry = self.statements.setdefault(sql, [0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def top(self, n):
+        return sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:n]
+
+
+def _counted(content, endpoint):
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        registry.add_bytes(endpoint, size)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        slow_ms = getattr(settings, 'POLLS_METRICS_SLOW_MS', None)
+        self.slow_seconds = slow_ms / 1000 if slow_ms is not None else None
+        self.slow_top_sql = getattr(settings, 'POLLS_METRICS_SLOW_TOP_SQL', 5)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder(keep_sql=self.slow_seconds is not None)
+        start = time.perf_counter()
+        with self.attach(recorder):
+            response = self.get_response(request)
+        return self.observe(request, response, time.perf_counter() - start, recorder)
+
+    async def __acall__(self, request):
+        # Под ASGI цепочка остается асинхронной: иначе поток SSE (poll_events)
+        # шел бы через async_to_sync и держал поток на все время соединения.
+        # Подключения к базе у каждого потока свои, поэтому счетчик ставится и
+        # снимается в том потоке, где sync_to_async выполняет код этого запроса
+        recorder = QueryRecorder(keep_sql=self.slow_seconds is not None)
+        start = time.perf_counter()
+        stack = await sync_to_async(self.attach)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.observe(request, response, time.perf_counter() - start, recorder)
+
+    def attach(self, recorder):
+        stack = ExitStack()
+        for conn in connections.all():
+            stack.enter_context(conn.execute_wrapper(recorder))
+        return stack
+
+    def observe(self, request, response, duration, recorder):
+        match = request.resolver_match
+        endpoint = match.view_name if match and match.view_name else UNRESOLVED
+        size = 0
+        if response.streaming:
+            if not response.is_async:
+                response.streaming_content = _counted(response.streaming_content, endpoint)
+        else:
+            size = len(response.content)
+        registry.observe(endpoint, request.method, response.status_code, duration,
+                         recorder.count, recorder.seconds, size)
+
+        if self.slow_seconds is not None and duration >= self.slow_seconds:
+            self.log_slow(request, endpoint, response, duration, recorder)
+        return response
+
+    def log_slow(self, request, endpoint, response, duration, recorder):
+        top = '\n'.join(
+            f'  {seconds * 1000:8.2f} мс x{count}: {sql}' for sql, (count, seconds) in recorder.top(self.slow_top_sql)
+        )
+        logger.warning(
+            'Медленный запрос %s %s (%s): %d, %.1f мс, SQL: %d за %.1f мс%s',
+            request.method, request.path, endpoint, response.status_code, duration * 1000,
+            recorder.count, recorder.seconds * 1000, '\n' + top if top else '',
+        )
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:11
+
+from django.db import migrations, models
+
+
+def drop_duplicate_votes(apps, schema_editor):
+    # Перед уникальным ограничением убираем повторные голоса пользователя
+    # за один и тот же вариант (оставляем самый ранний) и правим счетчики
+    Vote = apps.get_model('polls', 'Vote')
+    Choice = apps.get_model('polls', 'Choice')
+    duplicates = (
+        Vote.objects.exclude(user__isnull=True).exclude(user='Anonymous')
+        .values('choice_id', 'user')
+        .annotate(first_id=models.Min('id'), n=models.Count('id'))
+        .filter(n__gt=1)
+    )
+    for row in duplicates:
+        Vote.objects.filter(choice_id=row['choice_id'], user=row['user']).exclude(id=row['first_id']).delete()
+        Choice.objects.filter(id=row['choice_id']).update(votes_count=models.F('votes_count') - (row['n'] - 1))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='poll',
+            index=models.Index(condition=models.Q(('active', True)), fields=['created_at', 'id'], name='polls_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(fields=['created_at', 'id'], name='tests_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='testattempt',
+            index=models.Index(fields=['test', 'completed_at'], name='attempts_test_completed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['poll', 'user'], name='votes_poll_user_idx'),
+        ),
+        migrations.RunPython(drop_duplicate_votes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False), models.Q(('user', 'Anonymous'), _negated=True)), fields=('choice', 'user'), name='votes_unique_choice_user'),
+        ),
+    ]
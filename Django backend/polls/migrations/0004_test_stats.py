@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_attempt_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskStats',
+            fields=[
+                ('task', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='polls.task')),
+                ('answers_count', models.IntegerField(default=0)),
+                ('correct_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'task_stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='TestStats',
+            fields=[
+                ('test', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='polls.test')),
+                ('attempts_count', models.IntegerField(default=0)),
+                ('score_sum', models.BigIntegerField(default=0)),
+                ('duration_sum', models.FloatField(default=0)),
+            ],
+            options={
+                'db_table': 'test_stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='ScoreBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='score_buckets', to='polls.test')),
+            ],
+            options={
+                'db_table': 'test_score_buckets',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='scorebucket',
+            constraint=models.UniqueConstraint(fields=('test', 'score'), name='score_buckets_unique_test_score'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0004_test_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.CharField(max_length=150)),
+                ('score', models.IntegerField()),
+                ('duration', models.FloatField(verbose_name='Время прохождения, с')),
+                ('attempt', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='polls.testattempt')),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard', to='polls.test')),
+            ],
+            options={
+                'db_table': 'leaderboard_entries',
+                'indexes': [models.Index(fields=['test', '-score', 'duration', 'user'], name='leaderboard_rank_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardentry',
+            constraint=models.UniqueConstraint(fields=('test', 'user'), name='leaderboard_unique_test_user'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_leaderboard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testattempt',
+            name='raw_answers',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='testattempt',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает проверки'), ('completed', 'Проверена'), ('failed', 'Ошибка проверки')], default='completed', max_length=10),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:36
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_attempt_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='max_typos',
+            field=models.PositiveSmallIntegerField(default=0, validators=[django.core.validators.MaxValueValidator(3)], verbose_name='Допустимо опечаток'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='text_profile',
+            field=models.CharField(choices=[('basic', 'Регистр и крайние пробелы'), ('standard', 'Регистр, пробелы, знаки препинания, ё/е'), ('compact', 'Как standard, но без пробелов вообще')], default='standard', max_length=10, verbose_name='Нормализация ответа'),
+        ),
+    ]
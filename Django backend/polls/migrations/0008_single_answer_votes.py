@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:08
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def mark_single_answer_votes(apps, schema_editor):
+    # В опросах с одним ответом оставляем самый ранний голос пользователя,
+    # правим счетчики вариантов и ставим голосам флаг для ограничения
+    Vote = apps.get_model('polls', 'Vote')
+    Choice = apps.get_model('polls', 'Choice')
+    single = Vote.objects.filter(poll__multiple_answers=False)
+    duplicates = (
+        single.exclude(user__isnull=True).exclude(user='Anonymous')
+        .values('poll_id', 'user')
+        .annotate(first_id=models.Min('id'), n=models.Count('id'))
+        .filter(n__gt=1)
+    )
+    for row in duplicates:
+        extra = Vote.objects.filter(poll_id=row['poll_id'], user=row['user']).exclude(id=row['first_id'])
+        removed = Counter(extra.values_list('choice_id', flat=True))
+        extra.delete()
+        for choice_id, n in removed.items():
+            Choice.objects.filter(id=choice_id).update(votes_count=models.F('votes_count') - n)
+    single.update(single_answer=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_text_matching'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='single_answer',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_single_answer_votes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(condition=models.Q(('single_answer', True), ('user__isnull', False), models.Q(('user', 'Anonymous'), _negated=True)), fields=('poll', 'user'), name='votes_unique_poll_user_single'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_single_answer_votes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='test',
+            name='key_version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:24
+
+from django.db import migrations, models
+
+
+def create_collection_versions(apps, schema_editor):
+    CollectionVersion = apps.get_model('polls', 'CollectionVersion')
+    CollectionVersion.objects.bulk_create([CollectionVersion(kind=kind) for kind in ('poll', 'test')])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_test_key_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionVersion',
+            fields=[
+                ('kind', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('version', models.PositiveIntegerField(default=1)),
+            ],
+            options={
+                'db_table': 'collection_versions',
+            },
+        ),
+        migrations.RunPython(create_collection_versions, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='poll',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='test',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='poll',
+            index=models.Index(condition=models.Q(('end_date__isnull', False)), fields=['end_date'], name='polls_end_date_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:34
+
+from django.db import migrations, models
+
+
+def keep_old_matching(apps, schema_editor):
+    # До 0007 ответ сравнивался без учета регистра и крайних пробелов, то есть
+    # как в профиле basic. 0007 молча поставила существующим заданиям standard,
+    # который убирает знаки ("-5" совпадал с "5"); standard остается
+    # только для новых заданий
+    Task = apps.get_model('polls', 'Task')
+    Task.objects.filter(text_profile='standard').update(text_profile='basic')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='alternative_answers',
+            field=models.BooleanField(default=False, verbose_name='Каждая строка - отдельный ответ'),
+        ),
+        migrations.RunPython(keep_old_matching, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 22:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def copy_started_at(apps, schema_editor):
+    # До этой миграции started_at ставился при создании попытки, то есть в
+    # момент сдачи - для старых (в т.ч. еще pending) попыток это время сдачи
+    TestAttempt = apps.get_model('polls', 'TestAttempt')
+    TestAttempt.objects.update(submitted_at=models.F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0012_text_matching_defaults'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testattempt',
+            name='submitted_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunPython(copy_started_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 22:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def forget_server_durations(apps, schema_editor):
+    # Старое "время" в таблице лидеров - это completed_at - started_at, где обе
+    # отметки ставил сервер при сдаче, то есть время проверки, а не прохождения
+    LeaderboardEntry = apps.get_model('polls', 'LeaderboardEntry')
+    LeaderboardEntry.objects.update(duration=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0013_attempt_submitted_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testattempt',
+            name='duration',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Время прохождения, с'),
+        ),
+        migrations.AlterField(
+            model_name='leaderboardentry',
+            name='duration',
+            field=models.FloatField(null=True, verbose_name='Время прохождения, с'),
+        ),
+        migrations.AlterField(
+            model_name='testattempt',
+            name='started_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunPython(forget_server_durations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 22:35
+
+from django.db import migrations, models
+
+
+def forget_server_durations(apps, schema_editor):
+    # Накопленное время - это время проверки на сервере, а не прохождения
+    # (см. 0014); среднее время копится заново по попыткам со start_token
+    TestStats = apps.get_model('polls', 'TestStats')
+    TestStats.objects.update(duration_sum=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0014_attempt_start_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teststats',
+            name='timed_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(forget_server_durations, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,61 @@
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import MaxValueValidator
 from django.db import models
 from django.utils import timezone
-from django.db.models import Sum
+from django.db.models import Case, F, OuterRef, Prefetch, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .matching import PROFILE_CHOICES, STANDARD
+
+# Имя, под которым views сохраняют голоса и попытки без указанного пользователя
+ANONYMOUS_USER = 'Anonymous'
+
+
+class PollQuerySet(models.QuerySet):
+    def with_results(self):
+        # Всё, что нужно PollDetailSerializer, за фиксированное число запросов:
+        # сумма голосов считается подзапросом в основном запросе (без GROUP BY,
+        # чтобы сортировка по-прежнему шла по индексу), варианты и голоса
+        # подгружаются двумя запросами на всю выборку.
+        choices_total = (
+            Choice.objects.filter(poll=OuterRef('pk'))
+            .values('poll')
+            .annotate(total=Sum('votes_count'))
+            .values('total')
+        )
+        return self.annotate(
+            votes_total=Coalesce(Subquery(choices_total), 0),
+        ).prefetch_related(
+            Prefetch('choices', queryset=Choice.objects.order_by('id')),
+            Prefetch('votes', queryset=Vote.objects.order_by('id')),
+        )
+
+    def single_answer_flags(self):
+        # {poll_id: значение Vote.single_answer для новых голосов}. Читать внутри
+        # транзакции записи голосов, после первой записи (или под select_for_update
+        # там, где он есть): флаг берется из текущего multiple_answers, а не из
+        # опроса, загруженного до транзакции и, возможно, уже измененного
+        return {
+            poll_id: not multiple
+            for poll_id, multiple in self.select_for_update().values_list('id', 'multiple_answers')
+        }
+
+
+class ChoiceQuerySet(models.QuerySet):
+    def add_votes(self, deltas):
+        # deltas: {choice_id: +n / -n}. Все счетчики меняются одним UPDATE
+        # с CASE по id, сколько бы вариантов ни затронула операция.
+        deltas = {choice_id: n for choice_id, n in deltas.items() if n}
+        if not deltas:
+            return 0
+        delta = Case(
+            *[When(id=choice_id, then=Value(n)) for choice_id, n in deltas.items()],
+            default=Value(0),
+            output_field=models.IntegerField(),
+        )
+        return self.filter(id__in=deltas).update(votes_count=F('votes_count') + delta)
+
 
 class Poll(models.Model):
     # ИСПРАВЛЕНИЕ 1: Добавлено max_length=150
@@ -13,15 +67,29 @@ class Poll(models.Model):
     is_anonymous = models.BooleanField(default=False, verbose_name="Анонимный опрос")
     multiple_answers = models.BooleanField(default=False, verbose_name="Множественный выбор")
     end_date = models.DateTimeField(null=True, blank=True, verbose_name="Дата окончания")
+    # Версия для ETag и кэша ответов (polls/cache.py), растет при каждом изменении опроса
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = PollQuerySet.as_manager()
 
     class Meta:
         db_table = 'polls'
+        indexes = [
+            # Список активных опросов и курсорная пагинация по (created_at, id)
+            # (частичный индекс: Django пишет фильтр как WHERE "active" без "= 1")
+            models.Index(fields=['created_at', 'id'], condition=models.Q(active=True), name='polls_active_created_idx'),
+            # Последний истекший опрос для ETag списка (polls/cache.py)
+            models.Index(fields=['end_date'], condition=models.Q(end_date__isnull=False), name='polls_end_date_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
     @property
     def total_votes(self):
+        # Если опрос получен через with_results(), сумма уже посчитана
+        if hasattr(self, 'votes_total'):
+            return self.votes_total
         return self.choices.aggregate(total=Sum('votes_count'))['total'] or 0
 
     def user_can_vote(self, user):
@@ -38,6 +106,8 @@ class Choice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ChoiceQuerySet.as_manager()
+
     class Meta:
         db_table = 'choices'
 
@@ -50,14 +120,49 @@ class Vote(models.Model):
     # ИСПРАВЛЕНИЕ 2: Добавлено max_length=150
     user = models.CharField(max_length=150, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Копия not poll.multiple_answers: условие ограничения не может смотреть
+    # в другую таблицу. Ставится при записи голоса и при смене multiple_answers
+    single_answer = models.BooleanField(default=False, editable=False)
 
     class Meta:
         db_table = 'votes'
+        indexes = [
+            # user_can_vote, отмена голоса и проверка повтора: filter(poll=..., user=...)
+            models.Index(fields=['poll', 'user'], name='votes_poll_user_idx'),
+        ]
+        constraints = [
+            # Один и тот же пользователь не может дважды отдать голос за один вариант
+            models.UniqueConstraint(
+                fields=['choice', 'user'],
+                condition=models.Q(user__isnull=False) & ~models.Q(user=ANONYMOUS_USER),
+                name='votes_unique_choice_user',
+            ),
+            # В опросе с одним ответом - один голос на пользователя, без проверки запросом
+            models.UniqueConstraint(
+                fields=['poll', 'user'],
+                condition=models.Q(single_answer=True, user__isnull=False) & ~models.Q(user=ANONYMOUS_USER),
+                name='votes_unique_poll_user_single',
+            ),
+        ]
 
     def __str__(self):
         user_name = self.user if self.user else "Аноним"
         return f"{user_name} проголосовал в {self.poll.title}"
 
+class TestQuerySet(models.QuerySet):
+    def with_attempts_summary(self, user=None):
+        # Сводка по попыткам подзапросами в основном запросе (без GROUP BY,
+        # чтобы не ломать порядок по индексу) + попытки самого пользователя
+        completed = TestAttempt.objects.filter(test=OuterRef('pk'), completed_at__isnull=False).values('test')
+        queryset = self.annotate(
+            attempts_count=Coalesce(Subquery(completed.annotate(n=models.Count('id')).values('n')), 0),
+            attempts_mean=Subquery(completed.annotate(avg=models.Avg('score_obtained')).values('avg')),
+            attempts_best=Subquery(completed.annotate(best=models.Max('score_obtained')).values('best')),
+        )
+        own = TestAttempt.objects.filter(user=user).order_by('-started_at', '-id') if user else TestAttempt.objects.none()
+        return queryset.prefetch_related(Prefetch('attempts', queryset=own, to_attr='my_attempts'))
+
+
 class Test(models.Model):
     # ИСПРАВЛЕНИЕ 3 (Ваша текущая ошибка): Добавлено max_length=150
     owner = models.CharField(max_length=150, null=True, blank=True, verbose_name="ID создателя")
@@ -66,9 +171,18 @@ class Test(models.Model):
     completion_time = models.IntegerField(null=True, blank=True, verbose_name="Время на прохождение (мин)")
     attempt_number = models.IntegerField(default=1, verbose_name="Кол-во попыток")
     end_date = models.DateTimeField(null=True, blank=True, verbose_name="Дата и время окончания")
+    # Версия ключа ответов (polls/grading.py), растет при каждой правке теста
+    key_version = models.PositiveIntegerField(default=1, editable=False)
+    # Версия для ETag (polls/cache.py): меняется и от новых попыток
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = TestQuerySet.as_manager()
 
     class Meta:
         db_table = 'tests'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='tests_created_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -84,6 +198,13 @@ class Task(models.Model):
     score = models.IntegerField(default=1, verbose_name="Баллы за ответ")
     # ИСПРАВЛЕНИЕ 4: Добавлено поле для правильного текстового ответа
     correct_text = models.TextField(null=True, blank=True, verbose_name="Правильный ответ (текст)")
+    # Проверка текстовых ответов (polls/matching.py): несколько принятых ответов
+    # в correct_text по одному на строку, профиль нормализации и допуск опечаток
+    alternative_answers = models.BooleanField(default=False, verbose_name="Каждая строка - отдельный ответ")
+    text_profile = models.CharField(max_length=10, choices=PROFILE_CHOICES, default=STANDARD,
+                                    verbose_name="Нормализация ответа")
+    max_typos = models.PositiveSmallIntegerField(default=0, validators=[MaxValueValidator(3)],
+                                                 verbose_name="Допустимо опечаток")
 
     class Meta:
         db_table = 'tasks'
@@ -103,16 +224,42 @@ class TaskOption(models.Model):
         return self.text
 
 class TestAttempt(models.Model):
+    PENDING = 'pending'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
     test = models.ForeignKey(Test, related_name='attempts', on_delete=models.CASCADE)
     # ИСПРАВЛЕНИЕ 5: Добавлено max_length=150
     user = models.CharField(max_length=150, null=True, blank=True)
     score_obtained = models.IntegerField(default=0, verbose_name="Набрано баллов")
     total_score = models.IntegerField(default=0, verbose_name="Всего в тесте")
-    started_at = models.DateTimeField(auto_now_add=True)
+    # Начало прохождения из start_token (polls/timing.py), без токена - время сдачи
+    started_at = models.DateTimeField(default=timezone.now, editable=False)
+    # Когда пришел запрос на сдачу. Это и есть completed_at: при асинхронной
+    # проверке (polls/submissions.py) он не сдвигается на время ожидания в очереди
+    submitted_at = models.DateTimeField(default=timezone.now, editable=False)
+    # submitted_at - started_at в секундах; None - клиент не прислал start_token
+    duration = models.FloatField(null=True, blank=True, editable=False, verbose_name="Время прохождения, с")
     completed_at = models.DateTimeField(null=True, blank=True)
+    # Асинхронная проверка (polls/submissions.py): попытка ждет в статусе pending,
+    # ответы до проверки лежат в raw_answers как пришли в запросе
+    status = models.CharField(
+        max_length=10,
+        choices=[(PENDING, 'Ожидает проверки'), (COMPLETED, 'Проверена'), (FAILED, 'Ошибка проверки')],
+        default=COMPLETED,
+    )
+    raw_answers = models.JSONField(null=True, blank=True)
 
     class Meta:
         db_table = 'test_attempts'
+        indexes = [
+            # Попытки теста в порядке завершения (TestSerializer.get_all_attempts)
+            # и сводка по завершенным попыткам
+            models.Index(fields=['test', 'completed_at'], name='attempts_test_completed_idx'),
+            # Постраничный список попыток /tests/<pk>/attempts/ (в т.ч. с ?user=)
+            models.Index(fields=['test', 'started_at', 'id'], name='attempts_test_started_idx'),
+            models.Index(fields=['test', 'user', 'started_at', 'id'], name='attempts_test_user_idx'),
+        ]
 
 class TaskAnswer(models.Model):
     attempt = models.ForeignKey(TestAttempt, related_name='answers', on_delete=models.CASCADE)
@@ -121,4 +268,113 @@ class TaskAnswer(models.Model):
     selected_options = models.ManyToManyField(TaskOption, blank=True)
 
     class Meta:
-        db_table = 'task_answers'
\ No newline at end of file
+        db_table = 'task_answers'
+
+# --- Статистика тестов ---
+# Таблицы ниже обновляются приращениями при каждой проверке попытки
+# (polls/stats.py) и пересобираются командой rebuild_test_stats.
+# Читать статистику можно, не трогая task_answers и test_attempts.
+
+class TestStats(models.Model):
+    test = models.OneToOneField(Test, primary_key=True, related_name='stats', on_delete=models.CASCADE)
+    attempts_count = models.IntegerField(default=0)
+    score_sum = models.BigIntegerField(default=0)
+    # Попытки с известным временем прохождения (TestAttempt.duration) и сумма их времени, с
+    timed_count = models.IntegerField(default=0)
+    duration_sum = models.FloatField(default=0)
+
+    class Meta:
+        db_table = 'test_stats'
+
+
+class ScoreBucket(models.Model):
+    # Гистограмма набранных баллов: сколько попыток набрало ровно score
+    test = models.ForeignKey(Test, related_name='score_buckets', on_delete=models.CASCADE)
+    score = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'test_score_buckets'
+        constraints = [
+            models.UniqueConstraint(fields=['test', 'score'], name='score_buckets_unique_test_score'),
+        ]
+
+
+class TaskStatsQuerySet(models.QuerySet):
+    def add_results(self, answered, correct):
+        # answered/correct: {task_id: n}. Как Choice.objects.add_votes - один
+        # UPDATE с CASE по id на все задания попытки
+        if not answered:
+            return 0
+
+        def delta(counts):
+            # Задания группируются по величине приращения (обычно это 1 и 0):
+            # несколько WHEN ... IN (...) вместо WHEN на каждое задание, которые
+            # на больших тестах дорого собирать в SQL
+            by_value = {}
+            for task_id, n in counts.items():
+                if n:
+                    by_value.setdefault(n, []).append(task_id)
+            return Case(
+                *[When(task_id__in=ids, then=Value(n)) for n, ids in by_value.items()],
+                default=Value(0),
+                output_field=models.IntegerField(),
+            )
+        return self.filter(task_id__in=answered).update(
+            answers_count=F('answers_count') + delta(answered),
+            correct_count=F('correct_count') + delta(correct),
+        )
+
+
+class TaskStats(models.Model):
+    task = models.OneToOneField(Task, primary_key=True, related_name='stats', on_delete=models.CASCADE)
+    answers_count = models.IntegerField(default=0)
+    correct_count = models.IntegerField(default=0)
+
+    objects = TaskStatsQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'task_stats'
+
+
+class LeaderboardEntry(models.Model):
+    # Лучший результат пользователя в тесте (polls/leaderboard.py): больше баллов,
+    # при равенстве - меньше время прохождения
+    test = models.ForeignKey(Test, related_name='leaderboard', on_delete=models.CASCADE)
+    user = models.CharField(max_length=150)
+    score = models.IntegerField()
+    # None - время попытки неизвестно, такие записи идут после записей с тем же баллом
+    duration = models.FloatField(null=True, verbose_name="Время прохождения, с")
+    attempt = models.ForeignKey(TestAttempt, null=True, on_delete=models.SET_NULL, related_name='+')
+
+    class Meta:
+        db_table = 'leaderboard_entries'
+        constraints = [
+            models.UniqueConstraint(fields=['test', 'user'], name='leaderboard_unique_test_user'),
+        ]
+        indexes = [
+            # Порядок таблицы: top N - это чтение начала индекса,
+            # место пользователя - подсчет записей до него
+            models.Index(fields=['test', '-score', 'duration', 'user'], name='leaderboard_rank_idx'),
+        ]
+
+
+class CollectionVersion(models.Model):
+    # Версия списка объектов одного вида ('poll', 'test') для ETag списков (polls/cache.py)
+    kind = models.CharField(max_length=20, primary_key=True)
+    version = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        db_table = 'collection_versions'
+
+
+class IdempotencyKey(models.Model):
+    # Запрос с заголовком Idempotency-Key и ответ на него (polls/idempotency.py)
+    key = models.CharField(max_length=64, primary_key=True, verbose_name="sha256 пути и ключа")
+    fingerprint = models.CharField(max_length=64, verbose_name="sha256 тела запроса")
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'idempotency_keys'
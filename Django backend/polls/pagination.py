@@ -0,0 +1,116 @@
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная пагинация по паре (дата, id) в порядке убывания.
+
+    Курсор - это непрозрачная base64-строка с ключом последней записи страницы,
+    поэтому следующая страница выбирается условием по индексу, а не OFFSET,
+    и стоит одинаково на любой глубине.
+    Если клиент не передал ни cursor, ни page_size, список отдается целиком,
+    как раньше - старые клиенты продолжают работать без изменений
+    (для новых списков это отключается через optional = False).
+    """
+    ordering = ('created_at', 'id')
+    optional = True
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Некорректный курсор.'
+
+    def get_page_size(self, request):
+        default = getattr(settings, 'POLLS_PAGE_SIZE', 50)
+        maximum = getattr(settings, 'POLLS_MAX_PAGE_SIZE', 500)
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, default))
+        except (TypeError, ValueError):
+            size = default
+        return max(1, min(size, maximum))
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def encode_cursor(self, obj):
+        date_field, id_field = self.ordering
+        key = [getattr(obj, date_field).isoformat(), getattr(obj, id_field)]
+        return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+    def decode_cursor(self, request):
+        raw = request.query_params.get(self.cursor_query_param)
+        if not raw:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(raw.encode()))
+            return datetime.fromisoformat(value), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def page_queryset(self, queryset, request):
+        """
+        Еще не выполненная выборка страницы (с лишней записью для has_next);
+        без пагинации - весь queryset. По ней же строится ETag списка.
+        """
+        if self.optional and not self.is_requested(request):
+            return queryset
+        date_field, id_field = self.ordering
+
+        queryset = queryset.order_by(f'-{date_field}', f'-{id_field}')
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            value, pk = cursor
+            # "date <= X" дает индексу границу диапазона, хвост с той же датой
+            # и большим id отсекается вторым условием
+            queryset = queryset.filter(
+                Q(**{f'{date_field}__lte': value})
+                & ~Q(**{date_field: value, f'{id_field}__gte': pk})
+            )
+        return queryset[:self.get_page_size(request) + 1]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.optional and not self.is_requested(request):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        page = list(self.page_queryset(queryset, request))
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.next_cursor = self.encode_cursor(page[-1]) if self.has_next else None
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class AttemptPagination(KeysetPagination):
+    ordering = ('started_at', 'id')
+    optional = False
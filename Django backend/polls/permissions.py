@@ -1,14 +1,22 @@
 from rest_framework import permissions
 
 
+def is_owner(request, obj):
+    client_user_id = request.headers.get('X-User-ID')
+
+    if client_user_id:
+        return str(obj.owner) == str(client_user_id)
+    # Сравниваем две строки (имя владельца и имя текущего юзера)
+    return str(obj.owner) == str(request.user.username)
+
+
 class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
+        return is_owner(request, obj)
 
-        client_user_id = request.headers.get('X-User-ID')
-
-        if client_user_id:
-            return str(obj.owner) == str(client_user_id)
-        # Сравниваем две строки (имя владельца и имя текущего юзера)
-        return str(obj.owner) == str(request.user.username)
\ No newline at end of file
+class IsOwner(permissions.BasePermission):
+    """Только владелец, в том числе на чтение (выгрузки сырых данных)."""
+    def has_object_permission(self, request, view, obj):
+        return is_owner(request, obj)
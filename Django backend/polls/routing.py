@@ -0,0 +1,113 @@
+"""
+Чтение с реплики, запись в основную базу.
+
+Если задан POLLS_DB_REPLICA_ALIAS, ReplicaRoutingMiddleware отправляет
+чтения приложения polls в безопасных запросах (GET, HEAD, OPTIONS) на
+реплику, а PrimaryReplicaRouter все записи - в default. Все остальное
+(запросы на запись, команды, фоновые потоки проверки) читает из default:
+реплика отстает, и читать с нее можно только там, где это явно разрешено.
+
+Чтобы клиент видел свои записи, после успешного запроса на запись ему
+ставится cookie на POLLS_DB_STICKY_SECONDS, и пока она есть, его чтения
+тоже идут в default. Остальные клиенты в это окно могут получить с
+реплики прежнее состояние, но с прежней же версией: версия для ETag и
+кэша читается из той же базы, что и тело (polls/cache.py).
+
+Реплика для локальной проверки - второй файл SQLite, его обновляет
+команда replicate_db (sqlite3 backup API). Интервал копирования должен
+быть меньше POLLS_DB_STICKY_SECONDS.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+STICKY_COOKIE = 'polls_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_use_replica = ContextVar('polls_use_replica', default=False)
+
+
+def replica_alias():
+    return getattr(settings, 'POLLS_DB_REPLICA_ALIAS', None)
+
+
+def sticky_seconds():
+    return getattr(settings, 'POLLS_DB_STICKY_SECONDS', 5)
+
+
+def reading_from_replica():
+    return _use_replica.get() and replica_alias() is not None
+
+
+@contextmanager
+def read_from_replica(enabled=True):
+    token = _use_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'polls':
+            return None
+        # default явно: иначе связанные объекты читались бы из базы, откуда пришел исходный
+        return replica_alias() if reading_from_replica() else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != 'polls':
+            return None
+        # Даже для объекта, прочитанного с реплики
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплика получает схему вместе с данными от replicate_db
+        if db != DEFAULT_DB_ALIAS and db == replica_alias():
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if replica_alias() is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with read_from_replica(self.replica_allowed(request)):
+            response = self.get_response(request)
+        return self.stick(request, response)
+
+    async def __acall__(self, request):
+        # ContextVar переходит в sync_to_async вместе с контекстом, поэтому
+        # синхронные представления за асинхронной цепочкой видят тот же выбор базы
+        with read_from_replica(self.replica_allowed(request)):
+            response = await self.get_response(request)
+        return self.stick(request, response)
+
+    def replica_allowed(self, request):
+        return request.method in SAFE_METHODS and STICKY_COOKIE not in request.COOKIES
+
+    def stick(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=sticky_seconds(), httponly=True, samesite='Lax')
+        return response
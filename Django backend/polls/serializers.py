@@ -1,7 +1,18 @@
+from collections import Counter
+
+from django.conf import settings
 from rest_framework import serializers
-from rest_framework.exceptions import ValidationError
-from django.db import transaction, models
+from rest_framework.exceptions import Throttled, ValidationError
+from django.db import IntegrityError, transaction, models
+from django.db.models import prefetch_related_objects
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .cache import invalidate_poll, invalidate_polls
+from .grading import get_answer_key, invalidate_answer_key
+from .ingest import BUFFERED, get_vote_buffer, ingest_mode
+from .live import publish_on_commit, publish_votes_on_commit
+from .submissions import ASYNC, finalize_attempt, get_grading_pool, grading_mode
+from .timing import attempt_timing, read_start_token
 from .models import (
     Poll, Choice, Vote,
     Test, Task, TaskOption, TestAttempt, TaskAnswer
@@ -16,6 +27,17 @@ class ChoiceDetailSerializer(serializers.ModelSerializer):
         fields = ('id', 'choice_text', 'votes_count')
 
 
+def refresh_is_active(payload):
+    """
+    is_active в готовом ответе из кэша: запись в кэше живет до следующего
+    изменения опроса, а опрос перестает быть активным просто со временем.
+    """
+    end_date = payload.get('end_date')
+    if payload.get('is_active') and end_date and parse_datetime(end_date) <= timezone.now():
+        return {**payload, 'is_active': False}
+    return payload
+
+
 class PollDetailSerializer(serializers.ModelSerializer):
     choices = ChoiceDetailSerializer(many=True, read_only=True)
     total_votes = serializers.IntegerField(read_only=True)
@@ -32,21 +54,48 @@ class PollDetailSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ['id', 'created_at', 'total_votes']
 
+    def update(self, instance, validated_data):
+        was_multiple = instance.multiple_answers
+        with transaction.atomic():
+            poll = super().update(instance, validated_data)
+            if poll.multiple_answers != was_multiple:
+                # Флаг голосов для ограничения votes_unique_poll_user_single
+                try:
+                    with transaction.atomic():
+                        Vote.objects.filter(poll=poll).update(single_answer=not poll.multiple_answers)
+                except IntegrityError:
+                    raise ValidationError(
+                        {"multiple_answers": "Некоторые пользователи уже выбрали несколько вариантов."})
+        return poll
+
     def get_is_active(self, obj):
         return obj.active and (obj.end_date is None or obj.end_date > timezone.now())
     
     # Метод для получения списка имен/ID пользователей
     def get_voted_users(self, obj):
-        # Получаем все уникальные значения из поля user модели Vote, относящиеся к этому опросу
-        return list(Vote.objects.filter(choice__poll=obj).values_list('user', flat=True).distinct())
+        # Уникальные значения поля user среди голосов опроса (порядок первого голоса).
+        # При выборке через Poll.objects.with_results() голоса уже подгружены
+        return list(dict.fromkeys(vote.user for vote in obj.votes.all()))
 
     def get_all_votes(self, obj):
-        # 1. Находим все голоса, которые относятся к вариантам этого опроса
-        # 2. Используем .select_related() не нужно, так как мы берем данные только из Vote
-        votes_queryset = Vote.objects.filter(choice__poll=obj)
-        
-        # 3. Возвращаем сериализованные данные
-        return VoteSerializer(votes_queryset, many=True).data
+        # obj.votes.all() берется из prefetch-кэша, отдельного запроса нет
+        return VoteSerializer(obj.votes.all(), many=True).data
+
+
+def compact_poll_results(poll_id, user=None):
+    # Компактный ответ на голос/отмену: только счетчики вариантов, сумма
+    # и голоса самого пользователя. Два индексных запроса вместо полной
+    # сериализации опроса со списком всех голосов.
+    choices = list(Choice.objects.filter(poll_id=poll_id).order_by('id').values('id', 'votes_count'))
+    user_votes = []
+    if user:
+        user_votes = list(Vote.objects.filter(poll_id=poll_id, user=user).order_by('id').values_list('choice_id', flat=True))
+    return {
+        'id': poll_id,
+        'choices': choices,
+        'total_votes': sum(c['votes_count'] for c in choices),
+        'user_votes': user_votes,
+    }
 
 
 class ChoiceCreateSerializer(serializers.ModelSerializer):
@@ -64,11 +113,23 @@ class PollCreateSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
     def create(self, validated_data):
-        choices_data = validated_data.pop('choices')
         with transaction.atomic():
-            poll = Poll.objects.create(**validated_data)
-            Choice.objects.bulk_create([Choice(poll=poll, **c) for c in choices_data])
-            return poll
+            return self.create_many([validated_data])[0]
+
+    @staticmethod
+    def create_many(records):
+        """
+        Опросы с вариантами по проверенным данным: два INSERT на любое число
+        опросов (тот же путь у импорта, polls/importer.py).
+        """
+        polls = [Poll(**{k: v for k, v in data.items() if k != 'choices'}) for data in records]
+        Poll.objects.bulk_create(polls)
+        Choice.objects.bulk_create([
+            Choice(poll=poll, **choice)
+            for poll, data in zip(polls, records)
+            for choice in data['choices']
+        ])
+        return polls
 
 
 class VoteSerializer(serializers.ModelSerializer):
@@ -90,136 +151,384 @@ class VoteSerializer(serializers.ModelSerializer):
         except Choice.DoesNotExist:
             raise ValidationError({"choice_id": "Вариант не найден."})
 
-        # Простая проверка на повтор (если нужно)
-        if user and not poll.multiple_answers and Vote.objects.filter(user=user, poll=poll).exists():
-            # Можно раскомментировать, если хочешь запретить накрутку
-            # raise ValidationError("Вы уже голосовали.")
-            pass
+        # Повторы отсекают ограничения базы (votes_unique_choice_user и, в опросе
+        # с одним ответом, votes_unique_poll_user_single), без проверки запросом
+        vote = Vote(user=user, poll=poll, choice=choice)
 
-        with transaction.atomic():
-            vote = Vote.objects.create(user=user, poll=poll, choice=choice)
-            Choice.objects.filter(id=choice.id).update(votes_count=models.F('votes_count') + 1)
+        if ingest_mode() == BUFFERED:
+            # Голос будет записан пачкой при сбросе буфера (см. polls/ingest.py)
+            get_vote_buffer().add(vote)
             return vote
 
+        try:
+            with transaction.atomic():
+                # Счетчик первым: UPDATE берет блокировку записи, и флаг опроса
+                # читается уже под ней
+                Choice.objects.filter(id=choice.id).update(votes_count=models.F('votes_count') + 1)
+                flags = Poll.objects.filter(pk=poll.id).single_answer_flags()
+                vote.single_answer = flags.get(poll.id, not poll.multiple_answers)
+                vote.save()
+                publish_on_commit(poll.id, {choice.id: 1})
+                invalidate_poll(poll.id)
+                return vote
+        except IntegrityError:
+            if not vote.single_answer:
+                raise ValidationError({"choice_id": "Вы уже голосовали за этот вариант."})
+            raise ValidationError({"choice_id": "В этом опросе можно выбрать только один вариант."})
+
+
+class BallotItemSerializer(serializers.Serializer):
+    poll_id = serializers.IntegerField()
+    choice_id = serializers.IntegerField()
+
+
+class BallotSerializer(serializers.Serializer):
+    """
+    Бюллетень: много пар (poll_id, choice_id) от одного пользователя за один запрос.
+    Проверка идет по одной предвыборке вариантов и уже отданных голосов,
+    запись - один bulk_create и один сгруппированный UPDATE счетчиков.
+    Каждая пара получает свой результат: created или error с причиной.
+    """
+    user = serializers.CharField()
+    votes = BallotItemSerializer(many=True, allow_empty=False)
+
+    def validate_votes(self, value):
+        limit = getattr(settings, 'POLLS_BALLOT_MAX_ITEMS', 100)
+        if len(value) > limit:
+            raise ValidationError(f"Не больше {limit} голосов за один бюллетень.")
+        return value
+
+    def create(self, validated_data):
+        user = validated_data['user']
+        items = validated_data['votes']
+
+        choice_ids = {item['choice_id'] for item in items}
+        choices = {c.id: c for c in Choice.objects.filter(id__in=choice_ids).select_related('poll')}
+        poll_ids = {c.poll_id for c in choices.values()}
+        # Что пользователь уже выбрал в затронутых опросах
+        taken = set(Vote.objects.filter(user=user, poll_id__in=poll_ids).values_list('poll_id', 'choice_id'))
+        voted_polls = {poll_id for poll_id, _ in taken}
+
+        results, new_votes = [], []
+        for item in items:
+            poll_id, choice_id = item['poll_id'], item['choice_id']
+            choice = choices.get(choice_id)
+            error = None
+            if choice is None or choice.poll_id != poll_id:
+                error = "Вариант не найден."
+            elif (poll_id, choice_id) in taken:
+                error = "Вы уже голосовали за этот вариант."
+            elif not choice.poll.multiple_answers and poll_id in voted_polls:
+                error = "В этом опросе можно выбрать только один вариант."
+
+            if error:
+                results.append({'poll_id': poll_id, 'choice_id': choice_id, 'status': 'error', 'error': error})
+                continue
+            taken.add((poll_id, choice_id))
+            voted_polls.add(poll_id)
+            new_votes.append(Vote(user=user, poll_id=poll_id, choice_id=choice_id))
+            results.append({'poll_id': poll_id, 'choice_id': choice_id, 'status': 'created'})
+
+        if new_votes:
+            try:
+                with transaction.atomic():
+                    # Счетчики первыми, флаги опросов - уже под блокировкой записи
+                    Choice.objects.add_votes(Counter(vote.choice_id for vote in new_votes))
+                    flags = Poll.objects.filter(pk__in={vote.poll_id for vote in new_votes}).single_answer_flags()
+                    for vote in new_votes:
+                        vote.single_answer = flags.get(vote.poll_id, False)
+                    Vote.objects.bulk_create(new_votes)
+                    publish_votes_on_commit(new_votes)
+                    invalidate_polls({vote.poll_id for vote in new_votes})
+            except IntegrityError:
+                # Параллельный запрос успел записать тот же голос
+                raise ValidationError({"votes": "Бюллетень конфликтует с другим голосованием, повторите запрос."})
+        return results
+
 
 # --- 2. ТЕСТЫ (TESTS) ---
 
+def request_user(request):
+    # Кто спрашивает: ?user=... или заголовок X-User-ID (как в IsOwnerOrReadOnly)
+    if request is None:
+        return None
+    return request.query_params.get('user') or request.headers.get('X-User-ID') or None
+
+
+def embed_attempts(request):
+    if getattr(settings, 'POLLS_EMBED_ATTEMPTS', False):
+        return True
+    return request is not None and request.query_params.get('include_attempts') in ('1', 'true')
+
+
 class TaskOptionSerializer(serializers.ModelSerializer):
+    # id принимается на запись: по нему update сопоставляет существующие варианты
+    id = serializers.IntegerField(required=False)
+
     class Meta:
         model = TaskOption
         fields = ['id', 'text', 'is_correct']
 
 
 class TaskSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
     options = TaskOptionSerializer(many=True, required=False)
 
     # ВОТ ЭТО ИСПРАВЛЯЕТ ОШИБКУ СОХРАНЕНИЯ:
     # Связываем фронтенд (type) с бэкендом (task_type)
     task_type = serializers.CharField()
     # Связываем фронтенд (correctText) с бэкендом (correct_text)
-    correct_text = serializers.CharField(required=False, allow_blank=True)
+    # null принимается, чтобы тест из GET можно было отправить обратно в PUT
+    correct_text = serializers.CharField(required=False, allow_blank=True, allow_null=True)
 
     class Meta:
         model = Task
-        fields = ('id', 'question', 'task_type', 'score', 'options', 'correct_text')
+        fields = (
+            'id', 'question', 'task_type', 'score', 'options', 'correct_text', 'alternative_answers', 'text_profile',
+            'max_typos',
+        )
+
+
+TASK_FIELDS = ('question', 'task_type', 'score', 'correct_text', 'alternative_answers', 'text_profile', 'max_typos')
+OPTION_FIELDS = ('text', 'is_correct')
+
+
+def _apply_changes(obj, data, fields):
+    """Переносит значения из data в obj; True, если что-то поменялось."""
+    changed = False
+    for field in fields:
+        if field in data and getattr(obj, field) != data[field]:
+            setattr(obj, field, data[field])
+            changed = True
+    return changed
 
 
 class TestSerializer(serializers.ModelSerializer):
     tasks = TaskSerializer(many=True)
-    # owner должен быть доступен для записи
-    owner = serializers.CharField(required=False, allow_blank=True)
-    all_attempts = serializers.SerializerMethodField() # все предыдущие попытки теста
+    # owner должен быть доступен для записи (null - как в GET у теста без владельца)
+    owner = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    all_attempts = serializers.SerializerMethodField() # все предыдущие попытки теста (режим совместимости)
+    attempts_summary = serializers.SerializerMethodField()
 
     class Meta:
         model = Test
-        fields = ('id', 'title', 'owner', 'tasks', 'all_attempts', 'completion_time', 'attempt_number', 'end_date')
+        fields = (
+            'id', 'title', 'owner', 'tasks', 'all_attempts', 'attempts_summary',
+            'completion_time', 'attempt_number', 'end_date',
+        )
         read_only_fields = ['id', 'created_at']
 
+    def get_fields(self):
+        fields = super().get_fields()
+        # Полный список попыток растет с каждым студентом - отдаем его только
+        # старым клиентам по ?include_attempts=1 или POLLS_EMBED_ATTEMPTS = True.
+        # Остальные получают сводку и листают /tests/<pk>/attempts/
+        if not embed_attempts(self.context.get('request')):
+            fields.pop('all_attempts')
+        return fields
+
+    def to_representation(self, instance):
+        # Задания с вариантами читаются двумя запросами на весь тест, а не по
+        # запросу на задание (в т.ч. в ответах на POST/PUT после записи)
+        if 'tasks' not in getattr(instance, '_prefetched_objects_cache', {}):
+            prefetch_related_objects([instance], 'tasks__options')
+        return super().to_representation(instance)
+
     def get_all_attempts(self, obj):
         attempts = TestAttempt.objects.filter(test=obj).order_by('-completed_at')
         return TestAttemptSerializer(attempts, many=True).data
 
+    def get_attempts_summary(self, obj):
+        # Числа уже посчитаны, если тест получен через Test.objects.with_attempts_summary()
+        if not hasattr(obj, 'attempts_count'):
+            obj = Test.objects.with_attempts_summary(request_user(self.context.get('request'))).get(pk=obj.pk)
+        mean = obj.attempts_mean
+        return {
+            'count': obj.attempts_count,
+            'mean_score': round(mean, 2) if mean is not None else None,
+            'best_score': obj.attempts_best,
+            'my_attempts': TestAttemptSerializer(obj.my_attempts, many=True).data,
+        }
+
     @transaction.atomic
     def create(self, validated_data):
         tasks_data = validated_data.pop('tasks')
         test = Test.objects.create(**validated_data)
+        self._create_tasks([(test, tasks_data)])
+        return test
 
-        for t_data in tasks_data:
-            opts_data = t_data.pop('options', [])
-            task = Task.objects.create(test=test, **t_data)
+    @classmethod
+    def create_many(cls, records):
+        """
+        Тесты с заданиями и вариантами по проверенным данным: три INSERT на
+        любое число тестов (тот же путь у импорта, polls/importer.py).
+        """
+        tests = [Test(**{k: v for k, v in data.items() if k != 'tasks'}) for data in records]
+        Test.objects.bulk_create(tests)
+        cls._create_tasks(zip(tests, (data['tasks'] for data in records)))
+        return tests
+
+    @classmethod
+    def _create_tasks(cls, tests_with_tasks):
+        # Два INSERT на все тесты: все задания, все варианты.
+        # bulk_create в SQLite/PostgreSQL возвращает id, так что варианты
+        # можно сразу привязать к созданным заданиям
+        tasks, options = [], []
+        for test, tasks_data in tests_with_tasks:
+            for t_data in tasks_data:
+                fields = {k: v for k, v in t_data.items() if k not in ('id', 'options')}
+                tasks.append(Task(test=test, **fields))
+                options.append(t_data.get('options', []))
+        Task.objects.bulk_create(tasks)
+        cls._create_options(zip(tasks, options))
+        return tasks
+
+    @staticmethod
+    def _create_options(tasks_with_options):
+        # Создаем варианты ответов
+        options = [
+            TaskOption(task=task, **{k: v for k, v in o.items() if k != 'id'})
+            for task, opts_data in tasks_with_options
+            for o in opts_data
+        ]
+        TaskOption.objects.bulk_create(options)
 
-            # Создаем варианты ответов
-            for o in opts_data:
-                TaskOption.objects.create(task=task, **o)
-        return test
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        tasks_data = validated_data.pop('tasks', None)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save()
+        if tasks_data is not None:
+            self._sync_tasks(instance, tasks_data)
+            # bulk_update/bulk_create не шлют сигналы - сбрасываем ключ ответов сами
+            invalidate_answer_key(instance.pk)
+        return instance
+
+    def _sync_tasks(self, test, tasks_data):
+        """
+        Вложенное обновление по разнице: задания и варианты сопоставляются по id,
+        измененные обновляются через bulk_update, новые создаются через bulk_create,
+        пропавшие из запроса удаляются. Число запросов не зависит от размера теста.
+        Если у задания не передан список options, его варианты не трогаются.
+        """
+        tasks = {task.id: task for task in test.tasks.all()}
+        options = {option.id: option for option in TaskOption.objects.filter(task__test=test)}
+
+        changed_tasks, new_tasks, changed_options = [], [], []
+        new_options = []  # (задание, данные варианта)
+        kept_tasks, kept_options, synced_tasks = set(), set(), set()
 
+        for t_data in tasks_data:
+            task_id = t_data.get('id')
+            opts_data = t_data.get('options')
+            if task_id is None:
+                new_tasks.append((Task(test=test, **{k: v for k, v in t_data.items() if k not in ('id', 'options')}), opts_data or []))
+                continue
+            task = tasks.get(task_id)
+            if task is None:
+                raise ValidationError({"tasks": f"Задание {task_id} не относится к этому тесту."})
+            kept_tasks.add(task_id)
+            if _apply_changes(task, t_data, TASK_FIELDS):
+                changed_tasks.append(task)
+            if opts_data is None:
+                continue
+            synced_tasks.add(task_id)
+            for o_data in opts_data:
+                option = options.get(o_data.get('id'))
+                if option is None or option.task_id != task_id:
+                    if 'id' in o_data:
+                        raise ValidationError({"tasks": f"Вариант {o_data['id']} не относится к заданию {task_id}."})
+                    new_options.append((task, o_data))
+                    continue
+                kept_options.add(option.id)
+                if _apply_changes(option, o_data, OPTION_FIELDS):
+                    changed_options.append(option)
+
+        removed_tasks = set(tasks) - kept_tasks
+        removed_options = {
+            option_id for option_id, option in options.items()
+            if option.task_id in synced_tasks and option_id not in kept_options
+        }
+        if removed_tasks:
+            Task.objects.filter(id__in=removed_tasks).delete()
+        if removed_options:
+            TaskOption.objects.filter(id__in=removed_options).delete()
+        if changed_tasks:
+            Task.objects.bulk_update(changed_tasks, TASK_FIELDS)
+        if changed_options:
+            TaskOption.objects.bulk_update(changed_options, OPTION_FIELDS)
+        if new_tasks:
+            Task.objects.bulk_create([task for task, _ in new_tasks])
+        self._create_options(
+            [(task, opts) for task, opts in new_tasks]
+            + [(task, [o_data]) for task, o_data in new_options]
+        )
 
-class TaskAnswerSerializer(serializers.ModelSerializer):
-    # Принимаем ID выбранных опций
-    selected_options = serializers.PrimaryKeyRelatedField(
-        queryset=TaskOption.objects.all(),
-        many=True,
-        required=False
-    )
 
-    class Meta:
-        model = TaskAnswer
-        fields = ['task', 'answer_text', 'selected_options']
+class TaskAnswerSerializer(serializers.Serializer):
+    # Задание и выбранные опции приходят как id; их принадлежность тесту
+    # проверяется по ключу ответов одним махом (polls/grading.py),
+    # а не отдельным запросом на каждый id
+    task = serializers.IntegerField()
+    answer_text = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    selected_options = serializers.ListField(child=serializers.IntegerField(), required=False)
 
 
 class TestAttemptSerializer(serializers.ModelSerializer):
     answers = TaskAnswerSerializer(many=True, write_only=True)
     user = serializers.CharField(required=False, allow_blank=True)
+    # Выдан /tests/<pk>/start/ при начале прохождения (polls/timing.py)
+    start_token = serializers.CharField(required=False, write_only=True)
 
     class Meta:
         model = TestAttempt
-        fields = ['id', 'test', 'user', 'score_obtained', 'total_score', 'started_at', 'completed_at', 'answers']
-        read_only_fields = ['score_obtained', 'total_score', 'completed_at']
+        fields = [
+            'id', 'test', 'user', 'score_obtained', 'total_score', 'started_at', 'completed_at', 'duration',
+            'status', 'answers', 'start_token',
+        ]
+        read_only_fields = ['score_obtained', 'total_score', 'completed_at', 'status']
+
+    def validate(self, attrs):
+        token = attrs.pop('start_token', None)
+        self.started_at = None
+        if token is not None:
+            self.started_at = read_start_token(token, attrs['test'].id)
+            if self.started_at is None:
+                raise ValidationError({'start_token': 'Токен начала попытки поврежден или выдан для другого теста.'})
+        self.answer_key = get_answer_key(attrs['test'].id, attrs['test'].key_version)
+        errors = self.answer_key.validate(attrs.get('answers', []))
+        if errors:
+            raise ValidationError({'answers': errors})
+        return attrs
 
-    @transaction.atomic
     def create(self, validated_data):
         answers_data = validated_data.pop('answers', [])
         test = validated_data['test']
         user = validated_data.get('user', 'Anonymous')
+        if grading_mode() == ASYNC:
+            return self.create_pending(test, user, answers_data)
 
-        attempt = TestAttempt.objects.create(user=user, test=test)
-        total_score, obtained_score = 0, 0
-
-        for ans in answers_data:
-            task = ans['task']
-            sel_options = ans.get('selected_options', [])
-            text_ans = ans.get('answer_text', '')
-
-            # Сохраняем ответ в базу
-            ans_obj = TaskAnswer.objects.create(attempt=attempt, task=task, answer_text=text_ans)
-            if sel_options:
-                ans_obj.selected_options.set(sel_options)
-
-            # --- ЛОГИКА ПОДСЧЕТА БАЛЛОВ ---
-            total_score += task.score
-
-            if task.task_type == 'text':
-                # Сравниваем текст (игнорируем регистр)
-                if text_ans and task.correct_text and text_ans.strip().lower() == task.correct_text.strip().lower():
-                    obtained_score += task.score
-
-            elif task.task_type == 'single':
-                # Если выбран ровно 1 вариант и он верный
-                if len(sel_options) == 1 and sel_options[0].is_correct:
-                    obtained_score += task.score
-
-            elif task.task_type == 'multiple':
-                # Получаем ID правильных ответов
-                correct_ids = set(task.options.filter(is_correct=True).values_list('id', flat=True))
-                # Получаем ID выбранных
-                selected_ids = set([opt.id for opt in sel_options])
-
-                # Полное совпадение
-                if correct_ids == selected_ids and len(correct_ids) > 0:
-                    obtained_score += task.score
-
-        attempt.total_score = total_score
-        attempt.score_obtained = obtained_score
-        attempt.completed_at = timezone.now()
-        attempt.save()
-        return attempt
\ No newline at end of file
+        with transaction.atomic():
+            attempt = TestAttempt.objects.create(
+                user=user, test=test, status=TestAttempt.PENDING, **attempt_timing(self.started_at))
+            # --- ЛОГИКА ПОДСЧЕТА БАЛЛОВ --- (polls/grading.py, polls/submissions.py)
+            finalize_attempt(attempt, answers_data, self.answer_key.grade(answers_data))
+        return attempt
+
+    def create_pending(self, test, user, answers_data):
+        # Попытка только сохраняется, проверят ее фоновые потоки (polls/submissions.py)
+        pool = get_grading_pool()
+        if not pool.reserve():
+            raise Throttled(wait=1, detail='Очередь проверки переполнена, повторите отправку позже.')
+        try:
+            with transaction.atomic():
+                attempt = TestAttempt.objects.create(
+                    user=user, test=test, status=TestAttempt.PENDING, raw_answers=answers_data,
+                    **attempt_timing(self.started_at),
+                )
+                transaction.on_commit(lambda: pool.submit(attempt.id))
+        except Exception:
+            pool.release()
+            raise
+        return attempt
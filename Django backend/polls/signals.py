@@ -0,0 +1,32 @@
+"""
+Сброс кэшированного ключа ответов при изменении теста через модели
+(админка, shell, save()/delete() в коде). Пакетные операции bulk_* сигналов
+не шлют - там версия меняется явно (см. TestSerializer.update).
+
+На удаление заданий и вариантов приемников нет намеренно: любой приемник
+post_delete выключает быстрое удаление, и каскад шлет сигнал (и запросы) на
+каждую строку. Ключ сбрасывается один раз на тест - в TestSerializer.update
+или приемником удаления самого теста.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .grading import invalidate_answer_key
+from .models import Task, TaskOption, Test
+
+
+@receiver([post_save, post_delete], sender=Test)
+def test_changed(sender, instance, **kwargs):
+    invalidate_answer_key(instance.pk)
+
+
+@receiver(post_save, sender=Task)
+def task_changed(sender, instance, **kwargs):
+    invalidate_answer_key(instance.test_id)
+
+
+@receiver(post_save, sender=TaskOption)
+def option_changed(sender, instance, **kwargs):
+    test_id = Task.objects.filter(id=instance.task_id).values_list('test_id', flat=True).first()
+    if test_id is not None:
+        invalidate_answer_key(test_id)
@@ -0,0 +1,116 @@
+"""
+Бэкенд SQLite с настройками для конкурентной записи.
+
+Подключается как ENGINE = 'polls.sqlite' и понимает в OPTIONS, кроме
+обычных параметров sqlite3.connect (timeout и т.д.):
+
+    'pragmas': {'journal_mode': 'wal', 'synchronous': 'normal', ...}
+        выполняются на каждом новом соединении;
+    'transaction_mode': 'IMMEDIATE'
+        atomic() начинается с BEGIN IMMEDIATE: блокировка на запись берется
+        сразу, с ожиданием по busy_timeout. С обычным BEGIN транзакция,
+        которая сначала читала, при попытке записи под конкуренцией падает
+        с "database is locked" без всякого ожидания;
+    'write_gate': True
+        транзакции потоков одного процесса к одной базе идут по очереди
+        через общий замок (WriteGate), а не выясняют это через блокировки
+        SQLite с опросом по busy_timeout. Между процессами по-прежнему
+        ждет busy_timeout.
+
+Без этих ключей бэкенд ведет себя как стандартный django.db.backends.sqlite3.
+
+transaction_mode и write_gate действуют только на транзакции atomic().
+Запись в режиме autocommit (одиночный save(), update() или delete() вне
+atomic()) идет мимо очереди и без BEGIN IMMEDIATE: SQLite выполняет такой
+оператор в своей неявной транзакции и ждет блокировку по busy_timeout.
+Для одного оператора это безопасно - он не читает ничего до записи в
+отдельной транзакции, - но такие записи не выстраиваются в очередь с
+остальными потоками процесса. Голоса и правки в polls пишутся внутри
+atomic(); вне его остаются короткие одиночные операторы вроде увеличения
+версии после создания объекта (polls/cache.py).
+"""
+import threading
+
+from django.db import OperationalError
+from django.db.backends.sqlite3 import base
+
+OWN_OPTIONS = ('pragmas', 'transaction_mode', 'write_gate')
+
+
+class WriteGate:
+    """Очередь пишущих транзакций к одному файлу базы внутри процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        if not self._lock.acquire(timeout=timeout):
+            raise OperationalError('database is locked (write gate timeout)')
+
+    def release(self):
+        self._lock.release()
+
+
+_gates = {}
+_gates_lock = threading.Lock()
+
+
+def get_write_gate(name):
+    with _gates_lock:
+        gate = _gates.get(name)
+        if gate is None:
+            gate = _gates[name] = WriteGate()
+        return gate
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._gate = None
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for key in OWN_OPTIONS:
+            params.pop(key, None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        options = self.settings_dict['OPTIONS']
+        if options.get('write_gate'):
+            gate = get_write_gate(str(self.settings_dict['NAME']))
+            gate.acquire(timeout=options.get('timeout', 5))
+            self._gate = gate
+        try:
+            self.cursor().execute(f"BEGIN {options.get('transaction_mode', '')}".rstrip())
+        except Exception:
+            self._release_gate()
+            raise
+
+    def _release_gate(self):
+        gate, self._gate = self._gate, None
+        if gate is not None:
+            gate.release()
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            self._release_gate()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self._release_gate()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self._release_gate()
@@ -0,0 +1,135 @@
+"""
+Статистика тестов: итоги по тесту, гистограмма баллов и доля верных
+ответов по каждому заданию.
+
+record_attempt вызывается из TestAttemptSerializer.create в той же
+транзакции, что и запись попытки, и меняет счетчики через F() - без
+чтения и без пересчета по task_answers, так что параллельные сдачи не
+теряют приращений. Строка статистики заводится при первой попытке.
+rebuild_stats пересчитывает все с нуля (команда rebuild_test_stats):
+баллы и время берутся из сохраненных попыток, верность ответов на
+задания - повторной проверкой по текущему ключу ответов.
+
+Среднее время прохождения считается только по попыткам с известным
+временем (TestAttempt.duration, polls/timing.py): у сданных без
+start_token оно неизвестно.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+from .grading import AnswerKey
+from .models import ScoreBucket, Task, TaskAnswer, TaskStats, TestAttempt, TestStats
+
+
+def _increment(model, key, **deltas):
+    # Обычно это один UPDATE; строка создается, только если ее еще нет
+    changes = {field: F(field) + value for field, value in deltas.items()}
+    if not model.objects.filter(**key).update(**changes):
+        model.objects.bulk_create([model(**key)], ignore_conflicts=True)
+        model.objects.filter(**key).update(**changes)
+
+
+def record_attempt(attempt, answers, result):
+    """Добавляет проверенную попытку (GradeResult из AnswerKey.grade) в статистику."""
+    timed = {'timed_count': 1, 'duration_sum': attempt.duration} if attempt.duration is not None else {}
+    _increment(TestStats, {'test_id': attempt.test_id},
+               attempts_count=1, score_sum=result.score_obtained, **timed)
+    _increment(ScoreBucket, {'test_id': attempt.test_id, 'score': result.score_obtained}, count=1)
+
+    answered, correct = Counter(), Counter()
+    for answer, ok in zip(answers, result.correct):
+        answered[answer['task']] += 1
+        correct[answer['task']] += ok
+    # Как _increment, но для всех заданий попытки сразу: строки заводятся
+    # только для заданий, на которые еще никто не отвечал
+    if TaskStats.objects.add_results(answered, correct) < len(answered):
+        existing = set(TaskStats.objects.filter(task_id__in=answered).values_list('task_id', flat=True))
+        missing = [task_id for task_id in answered if task_id not in existing]
+        TaskStats.objects.bulk_create([TaskStats(task_id=task_id) for task_id in missing], ignore_conflicts=True)
+        TaskStats.objects.add_results(
+            {task_id: answered[task_id] for task_id in missing},
+            {task_id: correct[task_id] for task_id in missing},
+        )
+
+
+def _stored_answers(test_id):
+    """Сохраненные ответы теста в том виде, в каком их принимает AnswerKey."""
+    Through = TaskAnswer.selected_options.through
+    selected = defaultdict(list)
+    for answer_id, option_id in Through.objects.filter(taskanswer__task__test_id=test_id).values_list(
+            'taskanswer_id', 'taskoption_id').iterator(chunk_size=5000):
+        selected[answer_id].append(option_id)
+    for answer_id, task_id, text in TaskAnswer.objects.filter(task__test_id=test_id).values_list(
+            'id', 'task_id', 'answer_text').iterator(chunk_size=5000):
+        yield {'task': task_id, 'answer_text': text or '', 'selected_options': selected.get(answer_id, [])}
+
+
+@transaction.atomic
+def rebuild_stats(test_id):
+    TestStats.objects.filter(test_id=test_id).delete()
+    ScoreBucket.objects.filter(test_id=test_id).delete()
+    TaskStats.objects.filter(task__test_id=test_id).delete()
+
+    attempts, score_sum, timed, duration_sum = 0, 0, 0, 0.0
+    buckets = Counter()
+    for score, duration in TestAttempt.objects.filter(
+            test_id=test_id, completed_at__isnull=False).values_list(
+            'score_obtained', 'duration').iterator(chunk_size=5000):
+        attempts += 1
+        score_sum += score
+        if duration is not None:
+            timed += 1
+            duration_sum += duration
+        buckets[score] += 1
+    if attempts:
+        TestStats.objects.create(test_id=test_id, attempts_count=attempts, score_sum=score_sum,
+                                 timed_count=timed, duration_sum=duration_sum)
+        ScoreBucket.objects.bulk_create([
+            ScoreBucket(test_id=test_id, score=score, count=count) for score, count in buckets.items()
+        ])
+
+    key = AnswerKey.load(test_id)
+    answered, correct = Counter(), Counter()
+    for answer in _stored_answers(test_id):
+        task = key.tasks.get(answer['task'])
+        if task is None:
+            continue
+        answered[answer['task']] += 1
+        correct[answer['task']] += key.is_correct(task, answer)
+    TaskStats.objects.bulk_create([
+        TaskStats(task_id=task_id, answers_count=n, correct_count=correct[task_id])
+        for task_id, n in answered.items()
+    ])
+    return attempts
+
+
+def get_test_stats(test_id):
+    """Статистика теста тремя запросами: итоги, гистограмма и задания."""
+    totals = TestStats.objects.filter(test_id=test_id).values(
+        'attempts_count', 'score_sum', 'timed_count', 'duration_sum').first()
+    count = totals['attempts_count'] if totals else 0
+    timed = totals['timed_count'] if totals else 0
+    histogram = [
+        {'score': score, 'count': n}
+        for score, n in ScoreBucket.objects.filter(test_id=test_id).order_by('score').values_list('score', 'count')
+    ]
+    tasks = []
+    for task_id, answers, correct in Task.objects.filter(test_id=test_id).order_by('id').values_list(
+            'id', 'stats__answers_count', 'stats__correct_count'):
+        answers, correct = answers or 0, correct or 0
+        tasks.append({
+            'task': task_id,
+            'answers': answers,
+            'correct': correct,
+            'correct_rate': round(correct / answers, 4) if answers else None,
+        })
+    return {
+        'test': test_id,
+        'attempts_count': count,
+        'mean_score': round(totals['score_sum'] / count, 2) if count else None,
+        'mean_duration': round(totals['duration_sum'] / timed, 3) if timed else None,
+        'histogram': histogram,
+        'tasks': tasks,
+    }
@@ -0,0 +1,204 @@
+"""
+Проверка сданных попыток: сразу в запросе или в фоне.
+
+POLLS_GRADING_MODE = 'sync' - попытка проверяется и записывается в
+запросе (TestAttemptSerializer.create), ответ 201 с баллами.
+
+POLLS_GRADING_MODE = 'async' - запрос только сверяет ответы с ключом
+(он в кэше, polls/grading.py), сохраняет попытку со статусом pending и
+ответами в raw_answers и сразу отвечает 202. Проверяют попытки
+POLLS_GRADING_WORKERS фоновых потоков, результат отдает
+/api/tests/attempts/<id>/. В очереди и в работе одновременно не больше
+POLLS_GRADING_QUEUE_SIZE попыток: сверх этого запрос получает 429 с
+Retry-After, а не копится в памяти.
+
+Очередь живет в памяти процесса. При штатной остановке потоки дорабатывают
+очередь (atexit); попытки, оставшиеся pending после аварийного
+перезапуска, проверяет команда grade_pending.
+"""
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+
+from . import leaderboard, stats
+from .cache import invalidate_test
+from .grading import get_answer_key, save_answers
+from .models import TestAttempt
+
+logger = logging.getLogger(__name__)
+
+SYNC = 'sync'
+ASYNC = 'async'
+
+
+def grading_mode():
+    return getattr(settings, 'POLLS_GRADING_MODE', SYNC)
+
+
+def finalize_attempt(attempt, answers, result):
+    """
+    Записывает итог попытки в статусе pending (GradeResult из AnswerKey.grade),
+    ее ответы и статистику. False - попытку уже проверил кто-то другой.
+    """
+    attempt.total_score = result.total_score
+    attempt.score_obtained = result.score_obtained
+    # Время сдачи, а не проверки: очередь не должна удлинять попытку
+    attempt.completed_at = attempt.submitted_at
+    attempt.status = TestAttempt.COMPLETED
+    attempt.raw_answers = None
+    # Условный UPDATE идет первым: он же отсекает повторную проверку, и транзакция
+    # сразу берет блокировку на запись (в SQLite переход от чтения к записи
+    # внутри транзакции при конкуренции падает с "database is locked" без ожидания)
+    if not TestAttempt.objects.filter(pk=attempt.pk, status=TestAttempt.PENDING).update(
+            total_score=attempt.total_score, score_obtained=attempt.score_obtained,
+            completed_at=attempt.completed_at, status=attempt.status, raw_answers=None):
+        return False
+    save_answers(attempt, answers)
+    # Статистика и таблица лидеров обновляются приращениями в той же транзакции
+    stats.record_attempt(attempt, answers, result)
+    leaderboard.record_attempt(attempt)
+    return True
+
+
+# Потоки пула проверяют попытки параллельно, а пишут по одному: SQLite все
+# равно допускает одного писателя, и так они не ждут друг друга на блокировке
+_write_lock = threading.Lock()
+
+
+def grade_attempt(attempt_id):
+    """Проверяет отложенную попытку. Уже проверенные пропускаются."""
+    attempt = TestAttempt.objects.filter(pk=attempt_id, status=TestAttempt.PENDING).first()
+    if attempt is None:
+        return None
+    key = get_answer_key(attempt.test_id)
+    answers = attempt.raw_answers or []
+    if key.validate(answers):
+        # Тест успели изменить после сдачи: части заданий или вариантов больше нет
+        logger.warning('Попытка %s не соответствует текущему тесту %s', attempt_id, attempt.test_id)
+        TestAttempt.objects.filter(pk=attempt_id, status=TestAttempt.PENDING).update(status=TestAttempt.FAILED)
+        attempt.status = TestAttempt.FAILED
+    else:
+        result = key.grade(answers)
+        with _write_lock, transaction.atomic():
+            if not finalize_attempt(attempt, answers, result):
+                return None
+    invalidate_test(attempt.test_id)
+    return attempt
+
+
+class GradingPool:
+    def __init__(self, workers=2, max_pending=1000):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def __len__(self):
+        return self._pending
+
+    def reserve(self):
+        """Занимает место под попытку; False - очередь полна."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return False
+            self._pending += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, attempt_id):
+        # Место должно быть занято через reserve() до записи попытки
+        self._start()
+        self._queue.put(attempt_id)
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'grading-{n}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            attempt_id = self._queue.get()
+            if attempt_id is None:
+                return
+            try:
+                self._process(attempt_id)
+            finally:
+                # Как после запроса: закрывается только устаревшее (CONN_MAX_AGE)
+                close_old_connections()
+
+    def _process(self, attempt_id):
+        try:
+            grade_attempt(attempt_id)
+        except Exception:
+            logger.exception('Не удалось проверить попытку %s', attempt_id)
+            TestAttempt.objects.filter(pk=attempt_id, status=TestAttempt.PENDING).update(status=TestAttempt.FAILED)
+        finally:
+            self.release()
+
+    def drain(self):
+        """
+        Проверяет очередь в текущем потоке. Нужно при POLLS_GRADING_WORKERS = 0,
+        когда фоновых потоков нет (тесты, внешний планировщик).
+        """
+        done = 0
+        while True:
+            try:
+                attempt_id = self._queue.get_nowait()
+            except queue.Empty:
+                return done
+            self._process(attempt_id)
+            done += 1
+
+    def stop(self, timeout=None):
+        """Дает потокам доработать очередь и останавливает их."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_grading_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = GradingPool(
+                workers=getattr(settings, 'POLLS_GRADING_WORKERS', 2),
+                max_pending=getattr(settings, 'POLLS_GRADING_QUEUE_SIZE', 1000),
+            )
+        return _pool
+
+
+@atexit.register
+def _stop_on_exit():
+    if _pool is not None:
+        _pool.stop(timeout=30)
+
+
+@receiver(setting_changed)
+def _reset_pool(setting, **kwargs):
+    global _pool
+    if setting.startswith('POLLS_GRADING_'):
+        if _pool is not None:
+            _pool.stop()
+        _pool = None
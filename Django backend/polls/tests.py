@@ -1,3 +1,1568 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import request_finished, request_started
+from django.db import DatabaseError, OperationalError, close_old_connections, connections, transaction
+from django.http import JsonResponse
+
+from django.db import connection
+from django.conf import settings
+from django.core.management import call_command
+from django.db.models import F, Q
+from django.test import RequestFactory, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from .cache import cache_stats, get_cache, get_version, invalidate_poll
+from .grading import AnswerKeyCache, get_answer_key_cache
+from .ingest import VoteBuffer, flush_vote_buffer
+from . import leaderboard
+from .live import broker
+from .matching import TextMatcher, accepted_answers, within_distance
+from .metrics import MetricsMiddleware, registry
+from . import routing
+from .models import (
+    ANONYMOUS_USER, Choice, IdempotencyKey, LeaderboardEntry, Poll, Task, TaskOption, TaskStats, Test, TestAttempt,
+    TestStats, Vote,
+)
+from .sqlite.base import DatabaseWrapper
+from .stats import get_test_stats
+from .submissions import get_grading_pool
+from .views import poll_events
+from quiz_project import settings as project_settings
+
+
+def make_poll(title='Опрос', choices=3, votes=0, **kwargs):
+    poll = Poll.objects.create(title=title, owner='owner', **kwargs)
+    Choice.objects.bulk_create([Choice(poll=poll, choice_text=f'Вариант {i}') for i in range(choices)])
+    poll_choices = list(poll.choices.order_by('id'))
+    for i in range(votes):
+        choice = poll_choices[i % len(poll_choices)]
+        Vote.objects.create(poll=poll, choice=choice, user=f'user{i}', single_answer=not poll.multiple_answers)
+        Choice.objects.filter(id=choice.id).update(votes_count=F('votes_count') + 1)
+    return poll
+
+
+def test_payload(tasks=3, options=4):
+    return {
+        'title': 'Тест',
+        'tasks': [
+            {
+                'question': f'Вопрос {i}', 'task_type': 'single', 'score': 1,
+                'options': [{'text': f'Ответ {j}', 'is_correct': j == 0} for j in range(options)],
+            }
+            for i in range(tasks)
+        ],
+    }
+
+
+class PollsTestCase(APITestCase):
+    def setUp(self):
+        # id в SQLite переиспользуются между тестами, а кэши живут весь прогон
+        get_cache().clear()
+        get_answer_key_cache().clear()
+
+
+class PollQueryCountTests(PollsTestCase):
+    def list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('poll-list'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.data
+
+    def test_list_uses_constant_number_of_queries(self):
+        make_poll(votes=4)
+        small, _ = self.list_queries()
+        for i in range(10):
+            make_poll(title=f'Опрос {i}', votes=i)
+        large, data = self.list_queries()
+        self.assertEqual(small, large)
+        self.assertEqual(len(data), 11)
+
+    def test_detail_payload(self):
+        poll = make_poll(votes=5)
+        Vote.objects.create(poll=poll, choice=poll.choices.order_by('id').last(), user='user0')
+        with self.assertNumQueries(4):  # версия и три запроса на сам опрос
+            response = self.client.get(reverse('poll-detail', args=[poll.pk]))
+        self.assertEqual(response.data['total_votes'], 5)
+        self.assertEqual(response.data['voted_users'], [f'user{i}' for i in range(5)])
+        self.assertEqual(len(response.data['all_votes']), 6)
+        self.assertEqual([c['votes_count'] for c in response.data['choices']], [2, 2, 1])
+
+
+class KeysetPaginationTests(PollsTestCase):
+    def collect(self, url, page_size):
+        ids, pages, next_url = [], 0, f'{url}?page_size={page_size}'
+        while next_url:
+            response = self.client.get(next_url)
+            self.assertEqual(response.status_code, 200)
+            ids += [item['id'] for item in response.data['results']]
+            next_url = response.data['next']
+            pages += 1
+        return ids, pages
+
+    def test_polls_walk_all_pages_in_order(self):
+        polls = [make_poll(title=f'Опрос {i}') for i in range(7)]
+        # Одинаковая дата у части записей проверяет разрешение ничьих по id
+        Poll.objects.filter(pk__in=[p.pk for p in polls[2:5]]).update(created_at=polls[2].created_at)
+        ids, pages = self.collect(reverse('poll-list'), 2)
+        expected = list(Poll.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 4)
+
+    def test_tests_paginated(self):
+        for i in range(5):
+            Test.objects.create(title=f'Тест {i}')
+        ids, _ = self.collect(reverse('test-list-create'), 3)
+        self.assertEqual(ids, list(Test.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_without_cursor_returns_plain_list(self):
+        make_poll()
+        response = self.client.get(reverse('poll-list'))
+        self.assertIsInstance(response.data, list)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('poll-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryPlanTests(PollsTestCase):
+    """Горячие запросы не должны скатываться в полный просмотр таблицы (SQLite)."""
+    full_scan = re.compile(r'^SCAN \S+$')
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertUsesIndexes(self, queryset, ordered=False):
+        plan = self.plan(queryset)
+        self.assertFalse([line for line in plan if self.full_scan.match(line)], plan)
+        if ordered:
+            self.assertFalse([line for line in plan if 'TEMP B-TREE' in line], plan)
+
+    def test_hot_queries(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN есть только в SQLite')
+        poll = make_poll(votes=3)
+        test = Test.objects.create(title='Тест')
+        first = Poll.objects.order_by('created_at').first()
+        after_first = Q(created_at__lte=first.created_at) & ~Q(created_at=first.created_at, id__gte=first.id)
+
+        self.assertUsesIndexes(poll.votes.filter(user='user0'))
+        self.assertUsesIndexes(Vote.objects.filter(poll=poll, user='user0'))
+        self.assertUsesIndexes(Vote.objects.filter(choice__poll=poll))
+        self.assertUsesIndexes(TestAttempt.objects.filter(test=test).order_by('-completed_at'), ordered=True)
+        self.assertUsesIndexes(
+            Poll.objects.filter(active=True).with_results().order_by('-created_at', '-id'), ordered=True)
+        self.assertUsesIndexes(
+            Poll.objects.filter(active=True).filter(after_first).order_by('-created_at', '-id'), ordered=True)
+        self.assertUsesIndexes(Test.objects.filter(after_first).order_by('-created_at', '-id'), ordered=True)
+
+
+class VoteConstraintTests(PollsTestCase):
+    def test_same_choice_twice_is_rejected(self):
+        poll = make_poll(multiple_answers=True)
+        choice = poll.choices.first()
+        url = reverse('poll-vote', args=[poll.pk])
+        self.assertEqual(self.client.post(url, {'choice_id': choice.id, 'user': 'u1'}).status_code, 201)
+        self.assertEqual(self.client.post(url, {'choice_id': choice.id, 'user': 'u1'}).status_code, 400)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes_count, 1)
+
+    def test_single_answer_poll_takes_one_vote_without_precheck(self):
+        poll = make_poll()
+        first, second = poll.choices.order_by('id')[:2]
+        url = reverse('poll-vote', args=[poll.pk]) + '?response=compact'
+        self.assertEqual(self.client.post(url, {'choice_id': first.id, 'user': 'u1'}).status_code, 201)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, {'choice_id': second.id, 'user': 'u1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse([q for q in ctx.captured_queries if 'SELECT 1 AS "a"' in q['sql']])
+        self.assertEqual(list(poll.choices.order_by('id').values_list('votes_count', flat=True)), [1, 0, 0])
+        # Анонимные голоса ограничение не трогает
+        for _ in range(2):
+            self.assertEqual(self.client.post(url, {'choice_id': second.id, 'user': ANONYMOUS_USER}).status_code, 201)
+
+    def test_switching_to_single_answer_checks_existing_votes(self):
+        poll = make_poll(multiple_answers=True)
+        first, second = poll.choices.order_by('id')[:2]
+        url = reverse('poll-vote', args=[poll.pk])
+        self.client.post(url, {'choice_id': first.id, 'user': 'u1'})
+        self.client.post(url, {'choice_id': second.id, 'user': 'u1'})
+        detail = reverse('poll-detail', args=[poll.pk])
+        response = self.client.patch(detail, {'multiple_answers': False}, HTTP_X_USER_ID='owner')
+        self.assertEqual(response.status_code, 400)
+        poll.refresh_from_db()
+        self.assertTrue(poll.multiple_answers)
+
+        Vote.objects.filter(choice=second).delete()
+        response = self.client.patch(detail, {'multiple_answers': False}, HTTP_X_USER_ID='owner')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Vote.objects.get().single_answer)
+
+    def test_single_answer_flag_is_read_inside_transaction(self):
+        poll = make_poll(multiple_answers=True)
+        first, second = poll.choices.order_by('id')[:2]
+        url = reverse('poll-vote', args=[poll.pk])
+        # Опрос загружен до того, как параллельный PATCH сделал его одиночным
+        stale = Poll.objects.get(pk=poll.pk)
+        stale_choices = list(Choice.objects.filter(poll=poll).select_related('poll'))
+        Poll.objects.filter(pk=poll.pk).update(multiple_answers=False)
+        with mock.patch('polls.views.get_object_or_404', return_value=stale):
+            self.assertEqual(self.client.post(url, {'choice_id': first.id, 'user': 'u1'}).status_code, 201)
+            response = self.client.post(url, {'choice_id': second.id, 'user': 'u1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Vote.objects.get().single_answer)
+
+        stale_query = mock.Mock(**{'select_related.return_value': stale_choices})
+        with mock.patch('polls.serializers.Choice.objects.filter', return_value=stale_query):
+            response = self.client.post(reverse('poll-ballot'), {'user': 'u2', 'votes': [
+                {'poll_id': poll.pk, 'choice_id': first.id}, {'poll_id': poll.pk, 'choice_id': second.id},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Vote.objects.filter(user='u2').count(), 0)
+
+
+class ChoiceCountersTests(PollsTestCase):
+    def test_add_votes_is_one_statement(self):
+        poll = make_poll()
+        a, b, c = poll.choices.order_by('id')
+        with self.assertNumQueries(1):
+            Choice.objects.add_votes({a.id: 3, b.id: -1, c.id: 0})
+        self.assertEqual(list(poll.choices.order_by('id').values_list('votes_count', flat=True)), [3, -1, 0])
+
+
+@override_settings(POLLS_VOTE_INGEST='buffered', POLLS_VOTE_BUFFER_SIZE=3, POLLS_VOTE_BUFFER_DELAY=60)
+class BufferedVoteTests(PollsTestCase):
+    def vote(self, poll, choice, user):
+        return self.client.post(reverse('poll-vote', args=[poll.pk]), {'choice_id': choice.id, 'user': user})
+
+    def test_votes_are_flushed_by_size(self):
+        poll = make_poll(multiple_answers=True)
+        first, second = poll.choices.order_by('id')[:2]
+        self.assertEqual(self.vote(poll, first, 'u1').status_code, 202)
+        self.vote(poll, second, 'u2')
+        self.assertEqual(Vote.objects.count(), 0)
+        self.vote(poll, first, 'u3')
+        self.assertEqual(Vote.objects.count(), 3)
+        self.assertEqual(list(poll.choices.order_by('id').values_list('votes_count', flat=True)), [2, 1, 0])
+
+    def test_duplicates_in_batch_are_dropped(self):
+        poll = make_poll(multiple_answers=True)
+        choice = poll.choices.first()
+        self.vote(poll, choice, 'u1')
+        self.vote(poll, choice, 'u1')
+        self.assertEqual(flush_vote_buffer(), 1)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes_count, 1)
+
+    def test_close_waits_for_flush_in_progress(self):
+        buffer = VoteBuffer()
+        # Поток таймера уже забрал пачку и пишет ее
+        buffer._flush_lock.acquire()
+        done = threading.Event()
+        closer = threading.Thread(target=lambda: (buffer.close(), done.set()))
+        closer.start()
+        self.assertFalse(done.wait(0.1))
+        buffer._flush_lock.release()
+        closer.join(1)
+        self.assertTrue(done.is_set())
+
+
+class CompactVoteResponseTests(PollsTestCase):
+    def test_vote_and_unvote_compact(self):
+        poll = make_poll(votes=30, multiple_answers=True)
+        choice = poll.choices.order_by('id').last()
+        url = reverse('poll-vote', args=[poll.pk])
+        with self.assertNumQueries(12):  # не зависит от числа голосов в опросе
+            response = self.client.post(f'{url}?response=compact', {'choice_id': choice.id, 'user': 'me'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['total_votes'], 31)
+        self.assertEqual(response.data['user_votes'], [choice.id])
+        self.assertNotIn('all_votes', response.data)
+
+        response = self.client.post(
+            reverse('poll-unvote', args=[poll.pk]), {'user': 'me'}, HTTP_X_RESPONSE_MODE='compact')
+        self.assertEqual(response.data['total_votes'], 30)
+        self.assertEqual(response.data['user_votes'], [])
+        self.assertEqual(response.data['choices'][-1], {'id': choice.id, 'votes_count': 10})
+
+
+class VoteCancelTests(PollsTestCase):
+    def setUp(self):
+        self.poll = make_poll(choices=4, votes=4, multiple_answers=True)
+        self.choices = list(self.poll.choices.order_by('id'))
+        for choice in self.choices[:3]:
+            Vote.objects.create(poll=self.poll, choice=choice, user='me')
+        Choice.objects.add_votes({choice.id: 1 for choice in self.choices[:3]})
+        self.url = reverse('poll-unvote', args=[self.poll.pk])
+
+    def counts(self):
+        return list(self.poll.choices.order_by('id').values_list('votes_count', flat=True))
+
+    def test_cancel_all_in_constant_statements(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(f'{self.url}?response=compact', {'user': 'me'})
+        self.assertEqual(response.status_code, 200)
+        writes = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith(('UPDATE', 'DELETE'))]
+        # Счетчики, голоса и версия опроса (общая версия списка не трогается)
+        self.assertEqual(len(writes), 3)
+        self.assertEqual(self.counts(), [1, 1, 1, 1])
+
+    def test_cancel_single_choice(self):
+        response = self.client.post(self.url, {'user': 'me', 'choice_id': self.choices[1].id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counts(), [2, 1, 2, 1])
+        self.assertEqual(Vote.objects.filter(user='me').count(), 2)
+
+    def test_nothing_to_cancel(self):
+        response = self.client.post(self.url, {'user': 'me', 'choice_id': self.choices[3].id})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.counts(), [2, 2, 2, 1])
+
+
+class BallotTests(PollsTestCase):
+    def test_ballot_across_polls(self):
+        multi = make_poll(multiple_answers=True)
+        single = make_poll()
+        m1, m2, m3 = multi.choices.order_by('id')
+        s1, s2, _ = single.choices.order_by('id')
+        Vote.objects.create(poll=multi, choice=m3, user='me')
+        items = [
+            {'poll_id': multi.id, 'choice_id': m1.id},
+            {'poll_id': multi.id, 'choice_id': m2.id},
+            {'poll_id': multi.id, 'choice_id': m3.id},   # уже голосовал
+            {'poll_id': single.id, 'choice_id': s1.id},
+            {'poll_id': single.id, 'choice_id': s2.id},  # второй ответ в одиночном опросе
+            {'poll_id': single.id, 'choice_id': m1.id},  # чужой вариант
+        ]
+        with self.assertNumQueries(8):  # вместе с флагами и версиями опросов
+            response = self.client.post(reverse('poll-ballot'), {'user': 'me', 'votes': items}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [r['status'] for r in response.data['results']],
+            ['created', 'created', 'error', 'created', 'error', 'error'],
+        )
+        self.assertEqual(list(multi.choices.order_by('id').values_list('votes_count', flat=True)), [1, 1, 0])
+        self.assertEqual(list(single.choices.order_by('id').values_list('votes_count', flat=True)), [1, 0, 0])
+        self.assertEqual(Vote.objects.filter(user='me').count(), 4)
+
+    def test_empty_ballot(self):
+        response = self.client.post(reverse('poll-ballot'), {'user': 'me', 'votes': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class AsgiStream:
+    """Минимальный ASGI-клиент: отправляет GET и отдает куски тела по мере прихода."""
+    def __init__(self, path):
+        self.scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': b'', 'root_path': '', 'headers': [(b'host', b'testserver')],
+            'client': ('127.0.0.1', 1234), 'server': ('testserver', 80),
+        }
+        self.messages = asyncio.Queue()
+
+    async def receive(self):
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(self, message):
+        await self.messages.put(message)
+
+    async def __aenter__(self):
+        # Как и тестовый клиент Django: не закрываем соединение посреди транзакции теста
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        self.task = asyncio.ensure_future(ASGIHandler()(self.scope, self.receive, self.send))
+        self.start = await asyncio.wait_for(self.messages.get(), 5)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        request_started.connect(close_old_connections)
+        request_finished.connect(close_old_connections)
+
+    async def event(self):
+        message = await asyncio.wait_for(self.messages.get(), 5)
+        name, data = message['body'].decode().strip().split('\n')
+        return name.removeprefix('event: '), json.loads(data.removeprefix('data: '))
+
+
+@override_settings(POLLS_LIVE_MIN_INTERVAL=0.05)
+class LiveResultsTests(PollsTestCase):
+    async def test_stream_pushes_coalesced_deltas(self):
+        poll = await sync_to_async(make_poll)(votes=2)
+        first, second, _ = await sync_to_async(lambda: list(poll.choices.order_by('id')))()
+
+        async with AsgiStream(f'/api/polls/{poll.pk}/events/') as stream:
+            self.assertEqual(stream.start['status'], 200)
+            name, snapshot = await stream.event()
+            self.assertEqual(name, 'snapshot')
+            self.assertEqual(snapshot['total_votes'], 2)
+
+            # Два изменения подряд приходят одним событием
+            broker.publish(poll.pk, {first.id: 1})
+            broker.publish(poll.pk, {first.id: 2, second.id: -1})
+            name, delta = await stream.event()
+            self.assertEqual(name, 'delta')
+            self.assertEqual(delta['choices'], [{'id': first.id, 'delta': 3}, {'id': second.id, 'delta': -1}])
+        self.assertFalse(broker.has_subscribers(poll.pk))
+
+    def test_vote_publishes_after_commit(self):
+        poll = make_poll()
+        choice = poll.choices.first()
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def subscribe():
+            return broker.subscribe(poll.pk)
+
+        subscription = loop.run_until_complete(subscribe())
+        self.addCleanup(broker.unsubscribe, subscription)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('poll-vote', args=[poll.pk]), {'choice_id': choice.id, 'user': 'u1'})
+        loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(subscription.take(), {choice.id: 1})
+
+
+class ResultCacheTests(PollsTestCase):
+    def test_detail_is_cached_until_vote(self):
+        poll = make_poll(votes=1)
+        url = reverse('poll-detail', args=[poll.pk])
+        before = cache_stats()
+        self.client.get(url)
+        with self.assertNumQueries(1):  # только версия
+            cached = self.client.get(url)
+        self.assertEqual(cached.data['total_votes'], 1)
+        self.assertEqual(cache_stats()['hits'] - before['hits'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('poll-vote', args=[poll.pk]), {'choice_id': poll.choices.last().id, 'user': 'u9'})
+        self.assertEqual(self.client.get(url).data['total_votes'], 2)
+
+    def test_update_and_delete_invalidate(self):
+        poll = make_poll()
+        url = reverse('poll-detail', args=[poll.pk])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'title': 'Новое'}, HTTP_X_USER_ID='owner')
+        self.assertEqual(self.client.get(url).data['title'], 'Новое')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(url, HTTP_X_USER_ID='owner')
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_cached_poll_expires_by_end_date(self):
+        poll = make_poll(end_date=timezone.now() + timedelta(hours=1))
+        url = reverse('poll-detail', args=[poll.pk])
+        self.assertTrue(self.client.get(url).data['is_active'])
+        later = timezone.now() + timedelta(hours=2)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertFalse(self.client.get(url).data['is_active'])
+
+    @override_settings(POLLS_RESULT_CACHE=False)
+    def test_can_be_disabled(self):
+        poll = make_poll()
+        url = reverse('poll-detail', args=[poll.pk])
+        self.client.get(url)
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+
+class ConditionalRequestTests(PollsTestCase):
+    def test_not_modified_reads_only_version(self):
+        test = Test.objects.create(title='Тест')
+        url = reverse('test-detail', args=[test.pk])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('X-User-ID', response['Vary'])
+
+    def test_etag_is_shared_between_processes(self):
+        poll = make_poll()
+        url = reverse('poll-detail', args=[poll.pk])
+        etag = self.client.get(url)['ETag']
+        # Кэш процесса пуст, как в другом воркере: версия берется из базы
+        get_cache().clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.patch(url, {'title': 'Правка'}, HTTP_X_USER_ID='owner', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_match_rejects_stale_edit(self):
+        poll = make_poll()
+        url = reverse('poll-detail', args=[poll.pk])
+        etag = self.client.get(url)['ETag']
+        response = self.client.patch(url, {'title': 'Первая правка'}, HTTP_X_USER_ID='owner', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.client.get(url)['ETag'], etag)
+        self.assertEqual(response['ETag'], self.client.get(url)['ETag'])
+        response = self.client.patch(url, {'title': 'Вторая правка'}, HTTP_X_USER_ID='owner', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        poll.refresh_from_db()
+        self.assertEqual(poll.title, 'Первая правка')
+
+    def test_rejected_edit_keeps_version(self):
+        poll = make_poll()
+        url = reverse('poll-detail', args=[poll.pk])
+        etag = self.client.get(url)['ETag']
+        # Проверка прав падает после условного UPDATE - он откатывается вместе с правкой
+        response = self.client.patch(url, {'title': 'Чужая правка'}, HTTP_X_USER_ID='stranger', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_etag_changes_when_poll_expires(self):
+        poll = make_poll(end_date=timezone.now() + timedelta(hours=1))
+        detail, listing = reverse('poll-detail', args=[poll.pk]), reverse('poll-list')
+        etags = [self.client.get(url)['ETag'] for url in (detail, listing)]
+        later = timezone.now() + timedelta(hours=2)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            for url, etag in zip((detail, listing), etags):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+            self.assertFalse(self.client.get(detail).data['is_active'])
+
+    def test_collection_etag_changes_on_create(self):
+        url = reverse('poll-list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.post(reverse('poll-create'), {'title': 'Новый', 'choices': [{'choice_text': 'a'}]}, format='json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_etag_follows_page_rows(self):
+        oldest, middle, newest = [make_poll() for _ in range(3)]
+        Poll.objects.filter(pk=oldest.pk).update(created_at=timezone.now() - timedelta(days=2))
+        Poll.objects.filter(pk=middle.pk).update(created_at=timezone.now() - timedelta(days=1))
+        url = reverse('poll-list') + '?page_size=1'
+        etag = self.client.get(url)['ETag']
+        # Голос меняет только версию своего опроса, общая строка списка не пишется
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse('poll-vote', args=[oldest.pk]), {'choice_id': oldest.choices.first().id, 'user': 'u'})
+        self.assertFalse([q for q in ctx.captured_queries if 'collection_versions' in q['sql']])
+        # Опроса нет на странице - ETag страницы тот же
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.post(reverse('poll-vote', args=[newest.pk]), {'choice_id': newest.choices.first().id, 'user': 'u'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['total_votes'], 1)
+
+    def test_version_follows_write_transaction(self):
+        poll = make_poll()
+        before = get_version('poll', poll.pk)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            invalidate_poll(poll.pk)
+            raise RuntimeError
+        self.assertEqual(get_version('poll', poll.pk), before)
+
+
+class NestedTestWriteTests(PollsTestCase):
+    def create(self, tasks):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('test-list-create'), test_payload(tasks), format='json')
+        self.assertEqual(response.status_code, 201)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]
+        return response.data, len(inserts)
+
+    def test_create_uses_bulk_inserts(self):
+        data, inserts = self.create(100)
+        # тест, задания и 400 вариантов (SQLite режет вставку на пачки по 999 параметров)
+        self.assertEqual(inserts, 4)
+        self.assertEqual(TaskOption.objects.filter(task__test_id=data['id']).count(), 400)
+
+    def edit(self, data):
+        tasks = data['tasks']
+        tasks[0]['question'] = 'Изменен'
+        tasks[0]['options'][1]['is_correct'] = True
+        del tasks[0]['options'][2]
+        tasks[0]['options'].append({'text': 'Новый', 'is_correct': False})
+        del tasks[1]
+        tasks.append({'question': 'Новый вопрос', 'task_type': 'text', 'score': 2, 'correct_text': 'да'})
+        url = reverse('test-detail', args=[data['id']])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.put(url, data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data, len(ctx.captured_queries)
+
+    def test_nested_update_by_diff(self):
+        data, _ = self.create(3)
+        kept_option_id = data['tasks'][0]['options'][0]['id']
+        updated, _ = self.edit(data)
+        self.assertEqual([t['question'] for t in updated['tasks']], ['Изменен', 'Вопрос 2', 'Новый вопрос'])
+        first = updated['tasks'][0]
+        self.assertEqual(first['options'][0]['id'], kept_option_id)
+        self.assertEqual([(o['text'], o['is_correct']) for o in first['options']],
+                         [('Ответ 0', True), ('Ответ 1', True), ('Ответ 3', False), ('Новый', False)])
+        self.assertEqual(Task.objects.filter(test_id=data['id']).count(), 3)
+
+    def test_update_query_count_is_bounded(self):
+        small, _ = self.create(3)
+        large, _ = self.create(60)
+        _, small_queries = self.edit(small)
+        _, large_queries = self.edit(large)
+        self.assertEqual(small_queries, large_queries)
+        # Удаление многих заданий и вариантов тоже не зависит от их числа:
+        # каскад идет быстрым удалением, без сигнала на каждую строку.
+        # Разница только в том, что DELETE по списку id Django режет на пачки
+        # по 100 строк: у большого теста вариантов ~240, это 3 пачки вместо одной
+        self.assertEqual(self.prune(large), self.prune(small) + 2)
+        self.assertEqual(self.destroy(self.create(60)[0]), self.destroy(self.create(3)[0]) + 2)
+
+    def prune(self, data):
+        # Оставляем первое задание с одним вариантом, остальное удаляется
+        data = self.client.get(reverse('test-detail', args=[data['id']])).data
+        kept = dict(data['tasks'][0], options=data['tasks'][0]['options'][:1])
+        url = reverse('test-detail', args=[data['id']])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.put(url, dict(data, tasks=[kept]), format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(len(response.data['tasks']), 1)
+        return len(ctx.captured_queries)
+
+    def destroy(self, data):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.delete(reverse('test-detail', args=[data['id']]))
+        self.assertEqual(response.status_code, 204)
+        return len(ctx.captured_queries)
+
+    def test_foreign_task_id_rejected(self):
+        first, _ = self.create(1)
+        second, _ = self.create(1)
+        first['tasks'][0]['id'] = second['tasks'][0]['id']
+        response = self.client.put(reverse('test-detail', args=[first['id']]), first, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+def make_test(tasks=3, options=4):
+    test = Test.objects.create(title='Тест')
+    created = Task.objects.bulk_create([
+        Task(test=test, question=f'Вопрос {i}', task_type=('single', 'multiple', 'text')[i % 3], score=i % 3 + 1,
+             correct_text='Москва' if i % 3 == 2 else None)
+        for i in range(tasks)
+    ])
+    TaskOption.objects.bulk_create([
+        TaskOption(task=task, text=f'Ответ {j}', is_correct=j < (2 if task.task_type == 'multiple' else 1))
+        for task in created if task.task_type != 'text'
+        for j in range(options)
+    ])
+    return test
+
+
+class GradingTests(PollsTestCase):
+    def submit(self, test, answers, user='student'):
+        return self.client.post(reverse('test-submit'), {'test': test.id, 'user': user, 'answers': answers},
+                                format='json')
+
+    def test_scoring_rules(self):
+        test = make_test(tasks=3)
+        single, multiple, text = test.tasks.order_by('id')
+        s = list(single.options.order_by('id').values_list('id', flat=True))
+        m = list(multiple.options.order_by('id').values_list('id', flat=True))
+        cases = [
+            ([{'task': single.id, 'selected_options': [s[0]]}], 1),
+            ([{'task': single.id, 'selected_options': [s[1]]}], 0),
+            ([{'task': single.id, 'selected_options': [s[0], s[1]]}], 0),
+            ([{'task': multiple.id, 'selected_options': [m[1], m[0]]}], 2),
+            ([{'task': multiple.id, 'selected_options': [m[0]]}], 0),
+            ([{'task': text.id, 'answer_text': '  мосКВА '}], 3),
+            ([{'task': text.id, 'answer_text': 'Питер'}], 0),
+            ([{'task': text.id}], 0),
+            # Повтор задания учитывается дважды, как и раньше
+            ([{'task': single.id, 'selected_options': [s[0]]}] * 2, 2),
+        ]
+        for answers, expected in cases:
+            response = self.submit(test, answers)
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(response.data['score_obtained'], expected, answers)
+        self.assertEqual(response.data['total_score'], 2)
+
+    def test_answers_are_stored_in_bulk(self):
+        test = make_test(tasks=60)
+        answers = [
+            {'task': t.id, 'selected_options': list(t.options.values_list('id', flat=True)[:1]), 'answer_text': 'москва'}
+            for t in test.tasks.order_by('id')
+        ]
+        # Первая попытка заводит строки статистики теста, меряем обычную
+        self.submit(test, answers, user='first')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.submit(test, answers)
+        self.assertEqual(response.data['score_obtained'], 20 * 1 + 20 * 3)
+        # Число запросов не зависит от числа вопросов
+        self.assertLess(len(ctx.captured_queries), 20)
+        attempt = TestAttempt.objects.get(pk=response.data['id'])
+        self.assertEqual(attempt.answers.count(), 60)
+        self.assertEqual(TaskOption.objects.filter(taskanswer__attempt=attempt).count(), 40)
+
+    def test_foreign_ids_rejected(self):
+        test, other = make_test(), make_test()
+        foreign_task = other.tasks.first()
+        response = self.submit(test, [{'task': foreign_task.id, 'selected_options': []}])
+        self.assertEqual(response.status_code, 400)
+        task = test.tasks.order_by('id').first()
+        response = self.submit(test, [{'task': task.id, 'selected_options': [foreign_task.options.first().id]}])
+        self.assertEqual(response.status_code, 400)
+
+
+class AnswerKeyCacheTests(PollsTestCase):
+    def submit(self, test, answers):
+        return self.client.post(reverse('test-submit'), {'test': test.id, 'user': 'u', 'answers': answers},
+                                format='json')
+
+    def test_key_is_reused_between_submissions(self):
+        test = make_test(tasks=3)
+        task = test.tasks.order_by('id').first()
+        answer = [{'task': task.id, 'selected_options': [task.options.order_by('id').first().id]}]
+        self.submit(test, answer)
+        before = get_answer_key_cache().stats()
+        self.assertEqual(self.submit(test, answer).data['score_obtained'], 1)
+        after = get_answer_key_cache().stats()
+        self.assertGreater(after['hits'], before['hits'])
+        self.assertEqual(after['misses'], before['misses'])
+
+    def test_edits_invalidate_key(self):
+        test = make_test(tasks=3)
+        task = test.tasks.order_by('id').first()
+        first, second = task.options.order_by('id')[:2]
+        answer = [{'task': task.id, 'selected_options': [second.id]}]
+        self.assertEqual(self.submit(test, answer).data['score_obtained'], 0)
+
+        # Правка через модель (как из админки) - сигнал меняет версию ключа
+        with self.captureOnCommitCallbacks(execute=True):
+            TaskOption.objects.filter(pk=first.pk).update(is_correct=False)
+            second.is_correct = True
+            second.save()
+        self.assertEqual(self.submit(test, answer).data['score_obtained'], 1)
+
+        # Правка через API
+        data = self.client.get(reverse('test-detail', args=[test.pk])).data
+        data['tasks'][0]['score'] = 5
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(reverse('test-detail', args=[test.pk]), data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.submit(test, answer).data['score_obtained'], 5)
+
+    def test_edit_in_other_process_invalidates_key(self):
+        test = make_test(tasks=3)
+        task = test.tasks.order_by('id').first()
+        first, second = task.options.order_by('id')[:2]
+        answer = [{'task': task.id, 'selected_options': [second.id]}]
+        self.assertEqual(self.submit(test, answer).data['score_obtained'], 0)
+
+        # Другой процесс правит тест: до кэша этого процесса доходит только версия в базе
+        TaskOption.objects.filter(pk=first.pk).update(is_correct=False)
+        TaskOption.objects.filter(pk=second.pk).update(is_correct=True)
+        Test.objects.filter(pk=test.pk).update(key_version=F('key_version') + 1)
+        self.assertEqual(self.submit(test, answer).data['score_obtained'], 1)
+
+    def test_rolled_back_edit_keeps_version(self):
+        test = make_test(tasks=1)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            test.tasks.first().save()
+            raise RuntimeError
+        test.refresh_from_db()
+        self.assertEqual(test.key_version, 2)
+
+    def test_bounded_by_total_tasks(self):
+        cache = AnswerKeyCache(max_tasks=5)
+        tests = [make_test(tasks=2) for _ in range(3)]
+        for test in tests:
+            cache.get(test.id)
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertEqual(cache.stats()['tasks'], 4)
+        cache.get(tests[0].id)
+        self.assertEqual(cache.stats()['misses'], 4)
+
+
+class AttemptListTests(PollsTestCase):
+    def add_attempts(self, test, users):
+        return TestAttempt.objects.bulk_create([
+            TestAttempt(test=test, user=user, score_obtained=i, total_score=10, completed_at=timezone.now())
+            for i, user in enumerate(users)
+        ])
+
+    def test_detail_has_constant_size_summary(self):
+        test = make_test()
+        self.add_attempts(test, ['a', 'b', 'a', 'c'])
+        response = self.client.get(reverse('test-detail', args=[test.pk]), {'user': 'a'})
+        self.assertNotIn('all_attempts', response.data)
+        summary = response.data['attempts_summary']
+        self.assertEqual((summary['count'], summary['mean_score'], summary['best_score']), (4, 1.5, 3))
+        self.assertEqual([a['score_obtained'] for a in summary['my_attempts']], [2, 0])
+
+        response = self.client.get(reverse('test-detail', args=[test.pk]), {'include_attempts': 1})
+        self.assertEqual(len(response.data['all_attempts']), 4)
+
+    def test_list_queries_do_not_grow_with_attempts(self):
+        tests = [make_test(tasks=2) for _ in range(3)]
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(reverse('test-list-create'), {'user': 'a'})
+        for test in tests:
+            self.add_attempts(test, ['a', 'b'] * 10)
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(reverse('test-list-create'), {'user': 'a'})
+        self.assertEqual(len(before.captured_queries), len(after.captured_queries))
+
+    def test_attempts_are_paginated(self):
+        test = make_test()
+        self.add_attempts(test, [f'u{i % 3}' for i in range(7)])
+        url = reverse('test-attempts', args=[test.pk])
+        page = self.client.get(url, {'page_size': 3}).data
+        self.assertEqual(len(page['results']), 3)
+        rest = self.client.get(page['next']).data
+        self.assertEqual(len(rest['results']), 3)
+        self.assertTrue(set(a['id'] for a in page['results']).isdisjoint(a['id'] for a in rest['results']))
+        self.assertEqual(len(self.client.get(url, {'user': 'u0'}).data['results']), 3)
+        self.assertEqual(self.client.get(reverse('test-attempts', args=[999])).status_code, 404)
+
+    def test_etag_depends_on_user(self):
+        test = make_test()
+        url = reverse('test-detail', args=[test.pk])
+        etag = self.client.get(url, {'user': 'a'})['ETag']
+        self.assertNotEqual(etag, self.client.get(url, {'user': 'b'})['ETag'])
+        self.assertEqual(self.client.get(url, {'user': 'a'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class TestStatsTests(PollsTestCase):
+    def submit(self, test, answers, user='u'):
+        return self.client.post(reverse('test-submit'), {'test': test.id, 'user': user, 'answers': answers},
+                                format='json')
+
+    def setUp(self):
+        super().setUp()
+        self.test = make_test(tasks=3)
+        self.single, self.multiple, self.text = self.test.tasks.order_by('id')
+        right = self.single.options.order_by('id').first().id
+        wrong = self.single.options.order_by('id').last().id
+        self.submit(self.test, [{'task': self.single.id, 'selected_options': [right]},
+                                {'task': self.text.id, 'answer_text': 'москва'}])
+        self.submit(self.test, [{'task': self.single.id, 'selected_options': [wrong]}])
+        self.submit(self.test, [{'task': self.single.id, 'selected_options': [right]}])
+
+    def test_incremental_stats(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('test-stats', args=[self.test.pk]))
+        data = response.data
+        self.assertEqual(data['attempts_count'], 3)
+        self.assertEqual(data['mean_score'], round((4 + 0 + 1) / 3, 2))
+        self.assertEqual(data['histogram'], [{'score': 0, 'count': 1}, {'score': 1, 'count': 1},
+                                             {'score': 4, 'count': 1}])
+        tasks = {t['task']: t for t in data['tasks']}
+        self.assertEqual((tasks[self.single.id]['answers'], tasks[self.single.id]['correct']), (3, 2))
+        self.assertEqual(tasks[self.text.id]['correct_rate'], 1)
+        self.assertIsNone(tasks[self.multiple.id]['correct_rate'])
+        # Ни одна попытка не начата через /start/ - время прохождения неизвестно
+        self.assertIsNone(data['mean_duration'])
+
+    def test_mean_duration_counts_timed_attempts_only(self):
+        earlier = timezone.now() - timedelta(minutes=10)
+        with mock.patch('django.utils.timezone.now', return_value=earlier):
+            token = self.client.post(reverse('test-start', args=[self.test.pk])).data['start_token']
+        self.client.post(reverse('test-submit'), {
+            'test': self.test.id, 'user': 'u', 'start_token': token,
+            'answers': [{'task': self.single.id, 'selected_options': []}],
+        }, format='json')
+        data = self.client.get(reverse('test-stats', args=[self.test.pk])).data
+        self.assertEqual(data['attempts_count'], 4)
+        self.assertGreaterEqual(data['mean_duration'], 600)
+        self.assertLess(data['mean_duration'], 660)
+
+    def test_rebuild_matches_incremental(self):
+        expected = get_test_stats(self.test.pk)
+        TestStats.objects.all().delete()
+        TaskStats.objects.all().update(answers_count=0, correct_count=0)
+        call_command('rebuild_test_stats', stdout=open(os.devnull, 'w'))
+        rebuilt = get_test_stats(self.test.pk)
+        # Время попытки берется из того же TestAttempt.duration, поэтому совпадает
+        self.assertEqual(rebuilt, expected)
+
+
+class LeaderboardTests(PollsTestCase):
+    def finish(self, test, user, score, seconds):
+        attempt = TestAttempt.objects.create(test=test, user=user, score_obtained=score, total_score=10,
+                                             completed_at=timezone.now(), duration=seconds)
+        leaderboard.record_attempt(attempt)
+        return attempt
+
+    def test_best_attempt_and_ties(self):
+        test = make_test()
+        self.finish(test, 'a', 5, 60)
+        self.finish(test, 'a', 7, 90)   # лучше по баллам
+        self.finish(test, 'a', 7, 120)  # хуже по времени
+        self.finish(test, 'b', 7, 30)
+        self.finish(test, 'c', 7, 90)
+        self.finish(test, 'd', 2, 10)
+        self.finish(test, ANONYMOUS_USER, 10, 1)
+
+        url = reverse('test-leaderboard', args=[test.pk])
+        with self.assertNumQueries(4):
+            data = self.client.get(url, {'top': 3, 'user': 'd'}).data
+        self.assertEqual([(r['rank'], r['user'], r['score']) for r in data['top']],
+                         [(1, 'b', 7), (2, 'a', 7), (2, 'c', 7)])
+        self.assertEqual(data['user']['rank'], 4)
+        self.assertIsNone(self.client.get(url, {'user': 'nobody'}).data['user'])
+
+    def test_duration_from_start_token(self):
+        test = make_test(tasks=3)
+        task = test.tasks.order_by('id').first()
+        answers = [{'task': task.id, 'selected_options': [task.options.order_by('id').first().id]}]
+        submit = lambda user, **extra: self.client.post(reverse('test-submit'), {
+            'test': test.id, 'user': user, 'answers': answers, **extra}, format='json')
+
+        earlier = timezone.now() - timedelta(minutes=5)
+        with mock.patch('django.utils.timezone.now', return_value=earlier):
+            token = self.client.post(reverse('test-start', args=[test.pk])).data['start_token']
+        self.assertEqual(submit('slow', start_token=token).status_code, 201)
+        token = self.client.post(reverse('test-start', args=[test.pk])).data['start_token']
+        response = submit('fast', start_token=token)
+        self.assertLess(response.data['duration'], 60)
+        # Без токена время неизвестно - после всех с тем же баллом
+        self.assertIsNone(submit('old-client').data['duration'])
+        self.assertEqual([(r['rank'], r['user']) for r in leaderboard.top(test.id, 10)],
+                         [(1, 'fast'), (2, 'slow'), (3, 'old-client')])
+        self.assertGreaterEqual(leaderboard.rank(test.id, 'slow')['duration'], 300)
+        self.assertEqual(leaderboard.rank(test.id, 'old-client')['rank'], 3)
+
+        other = make_test(tasks=1)
+        token = self.client.post(reverse('test-start', args=[other.pk])).data['start_token']
+        self.assertEqual(submit('u', start_token=token).status_code, 400)
+        self.assertEqual(submit('u', start_token=token[:-2] + 'xx').status_code, 400)
+
+    def test_submit_updates_and_rebuild(self):
+        test = make_test(tasks=3)
+        task = test.tasks.order_by('id').first()
+        right = task.options.order_by('id').first().id
+        self.client.post(reverse('test-submit'), {
+            'test': test.id, 'user': 'a', 'answers': [{'task': task.id, 'selected_options': [right]}],
+        }, format='json')
+        self.assertEqual(leaderboard.rank(test.id, 'a')['score'], 1)
+
+        self.finish(test, 'b', 3, 5)
+        expected = leaderboard.top(test.id, 10)
+        LeaderboardEntry.objects.all().delete()
+        call_command('rebuild_leaderboard', stdout=open(os.devnull, 'w'))
+        self.assertEqual(leaderboard.top(test.id, 10), expected)
+
+
+@override_settings(POLLS_GRADING_MODE='async', POLLS_GRADING_WORKERS=0, POLLS_GRADING_QUEUE_SIZE=2)
+class AsyncGradingTests(PollsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.test = make_test(tasks=3)
+        task = self.test.tasks.order_by('id').first()
+        self.answers = [{'task': task.id, 'selected_options': [task.options.order_by('id').first().id]}]
+        # Пул один на весь класс: очередь не должна переходить в следующий тест
+        self.addCleanup(get_grading_pool().drain)
+
+    def submit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('test-submit'), {'test': self.test.id, 'user': 'u', 'answers': self.answers},
+                                    format='json')
+
+    def test_pending_then_graded(self):
+        response = self.submit()
+        self.assertEqual(response.status_code, 202, response.data)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertFalse(TestAttempt.objects.get(pk=response.data['id']).answers.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(get_grading_pool().drain(), 1)
+        data = self.client.get(response['Location']).data
+        self.assertEqual((data['status'], data['score_obtained'], data['total_score']), ('completed', 1, 1))
+        self.assertEqual(leaderboard.rank(self.test.id, 'u')['score'], 1)
+        self.assertEqual(get_test_stats(self.test.id)['attempts_count'], 1)
+
+    def test_completed_at_is_submission_time(self):
+        response = self.submit()
+        submitted_at = TestAttempt.objects.get(pk=response.data['id']).submitted_at
+        # Проверка дошла до попытки через час: время в очереди в попытку не входит
+        later = timezone.now() + timedelta(hours=1)
+        with mock.patch('django.utils.timezone.now', return_value=later), \
+                self.captureOnCommitCallbacks(execute=True):
+            get_grading_pool().drain()
+        self.assertEqual(TestAttempt.objects.get(pk=response.data['id']).completed_at, submitted_at)
+
+    def test_back_pressure(self):
+        self.assertEqual(self.submit().status_code, 202)
+        self.assertEqual(self.submit().status_code, 202)
+        response = self.submit()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(TestAttempt.objects.count(), 2)
+        get_grading_pool().drain()
+        self.assertEqual(self.submit().status_code, 202)
+
+    def test_invalid_answers_rejected_before_queueing(self):
+        self.answers[0]['task'] = 999
+        self.assertEqual(self.submit().status_code, 400)
+        self.assertEqual(len(get_grading_pool()), 0)
+
+
+class TextMatchingTests(PollsTestCase):
+    def test_within_distance(self):
+        cases = [
+            ('москва', 'москва', 0, True),
+            ('москва', 'масква', 1, True),
+            ('москва', 'моск', 1, False),
+            ('москва', 'моск', 2, True),
+            ('', 'аб', 2, True),
+            ('фотосинтез', 'фотосинтэс', 1, False),
+            ('фотосинтез', 'фотосинтэс', 2, True),
+        ]
+        for a, b, k, expected in cases:
+            self.assertEqual(within_distance(a, b, k), expected, (a, b, k))
+            self.assertEqual(within_distance(b, a, k), expected, (b, a, k))
+
+    def test_profiles_and_accepted_answers(self):
+        matcher = TextMatcher(['Санкт-Петербург', 'Питер'])
+        self.assertTrue(matcher.match('  санкт  петербург!'))
+        self.assertTrue(matcher.match('ПИТЕР.'))
+        self.assertFalse(matcher.match('Москва'))
+        self.assertTrue(TextMatcher(['Ёлка']).match('елка'))
+        self.assertFalse(TextMatcher(['Ёлка'], profile='basic').match('елка'))
+        self.assertTrue(TextMatcher(['1 000 000'], profile='compact').match('1000000'))
+        self.assertFalse(TextMatcher([]).match('что угодно'))
+
+    def test_signs_and_punctuation_only_answers(self):
+        for key, answer, expected in (
+            ('-5', '5', False), ('-5', ' -5 ', True), ('+7', '7', False), ('3.14', '3,14', False),
+            ('3.14', '3.14.', True), ('C++', 'C', False), ('C#', 'c#', True), ('северо-запад', 'Северо запад', True),
+            ('?', '?', True), ('?', '!', False), ('?', '', False),
+        ):
+            self.assertEqual(TextMatcher([key]).match(answer), expected, (key, answer))
+
+    def test_lines_are_alternatives_only_on_request(self):
+        self.assertEqual(accepted_answers('Москва\nMoscow'), ['Москва\nMoscow'])
+        self.assertEqual(accepted_answers('Москва\n\nMoscow', alternatives=True), ['Москва', 'Moscow'])
+        self.assertEqual(accepted_answers('  \n'), [])
+
+    def test_grading_uses_task_settings(self):
+        test = make_test(tasks=3)
+        text = test.tasks.get(task_type='text')
+        with self.captureOnCommitCallbacks(execute=True):
+            Task.objects.filter(pk=text.pk).update(correct_text='Москва\nMoscow', alternative_answers=True, max_typos=1)
+            text.refresh_from_db()
+            text.save()
+        for answer, expected in (('москва', 3), ('Moscow!', 3), ('Мосвка', 0), ('Масква', 3), ('Киев', 0)):
+            response = self.client.post(reverse('test-submit'), {
+                'test': test.id, 'user': 'u', 'answers': [{'task': text.id, 'answer_text': answer}],
+            }, format='json')
+            self.assertEqual(response.data['score_obtained'], expected, answer)
+
+    def test_max_typos_is_limited(self):
+        payload = test_payload(tasks=1)
+        payload['tasks'][0].update(task_type='text', correct_text='да', max_typos=5)
+        self.assertEqual(self.client.post(reverse('test-list-create'), payload, format='json').status_code, 400)
+
+
+class ExportTests(PollsTestCase):
+    def read(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_votes_csv_and_ndjson(self):
+        poll = make_poll(votes=3)
+        url = reverse('poll-export', args=[poll.pk])
+        self.assertEqual(self.client.get(url).status_code, 403)
+        rows = list(csv.DictReader(io.StringIO(self.read(self.client.get(url, HTTP_X_USER_ID='owner')))))
+        self.assertEqual([r['user'] for r in rows], ['user0', 'user1', 'user2'])
+        self.assertEqual(rows[0]['choice_text'], 'Вариант 0')
+
+        lines = self.read(self.client.get(url, {'output': 'ndjson'}, HTTP_X_USER_ID='owner')).splitlines()
+        self.assertEqual(json.loads(lines[2])['choice_text'], 'Вариант 2')
+        self.assertEqual(self.client.get(url, {'output': 'xml'}, HTTP_X_USER_ID='owner').status_code, 400)
+
+    @override_settings(POLLS_EXPORT_CHUNK_SIZE=10)
+    def test_attempts_with_answers_without_n_plus_one(self):
+        test = make_test(tasks=3)
+        Test.objects.filter(pk=test.pk).update(owner='owner')
+        tasks = list(test.tasks.order_by('id').prefetch_related('options'))
+        answers = [{'task': t.id, 'selected_options': [o.id for o in t.options.all()][:2], 'answer_text': 'x'}
+                   for t in tasks]
+        for i in range(25):
+            self.client.post(reverse('test-submit'), {'test': test.id, 'user': f'u{i}', 'answers': answers},
+                             format='json')
+        url = reverse('test-export', args=[test.pk])
+        with CaptureQueriesContext(connection) as ctx:
+            lines = self.read(self.client.get(url, {'output': 'ndjson'}, HTTP_X_USER_ID='owner')).splitlines()
+        # 3 пачки по 10 попыток, на пачку: попытки, ответы, варианты
+        self.assertLessEqual(len(ctx.captured_queries), 1 + 3 * 3)
+        first = json.loads(lines[0])
+        self.assertEqual(len(lines), 25)
+        self.assertEqual(first['answers'][0]['selected_options'], answers[0]['selected_options'])
+
+        rows = list(csv.DictReader(io.StringIO(self.read(self.client.get(url, HTTP_X_USER_ID='owner')))))
+        self.assertEqual(len(rows), 25 * 3)
+        self.assertEqual(rows[0]['selected_options'], ';'.join(map(str, answers[0]['selected_options'])))
+
+    @tag('slow')
+    @skipUnless(os.environ.get('POLLS_SLOW_TESTS'), 'долгий тест (около минуты): POLLS_SLOW_TESTS=1')
+    def test_million_votes_in_constant_memory(self):
+        poll = make_poll(choices=4)
+        Poll.objects.filter(pk=poll.pk).update(owner='owner')
+        first_choice = poll.choices.order_by('id').first().id
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000000) '
+                'INSERT INTO votes (poll_id, choice_id, user, created_at, single_answer) '
+                'SELECT %s, %s + i %% 4, \'user\' || i, %s, 1 FROM n',
+                [poll.pk, first_choice, timezone.now()],
+            )
+        response = self.client.get(reverse('poll-export', args=[poll.pk]), HTTP_X_USER_ID='owner')
+        tracemalloc.start()
+        try:
+            lines = size = 0
+            for chunk in response.streaming_content:
+                lines += chunk.count(b'\n')
+                size += len(chunk)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(lines, 1000001)
+        # Весь CSV - десятки мегабайт, а в памяти одновременно только пачка строк
+        self.assertGreater(size, 30 * 2 ** 20)
+        self.assertLess(peak, 8 * 2 ** 20)
+
+
+class ImportTests(PollsTestCase):
+    def ndjson(self, *records):
+        return '\n'.join(r if isinstance(r, str) else json.dumps(r, ensure_ascii=False) for r in records) + '\n'
+
+    def test_import_endpoint_reports_bad_lines(self):
+        poll = {'type': 'poll', 'title': 'Импорт', 'choices': [{'choice_text': 'да'}, {'choice_text': 'нет'}]}
+        body = self.ndjson(
+            poll,
+            {'type': 'test', **test_payload(tasks=2)},
+            '{не json',
+            {'type': 'test', 'title': 'Без заданий'},
+            {'type': 'survey'},
+            {'type': 'poll', **{k: v for k, v in poll.items() if k != 'type'}, 'owner': 'other'},
+        )
+        response = self.client.generic('POST', reverse('import'), body, content_type='application/x-ndjson',
+                                       HTTP_X_USER_ID='importer')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['created'], {'polls': 2, 'tests': 1})
+        self.assertEqual([e['line'] for e in response.data['errors']], [3, 4, 5])
+        self.assertIn('tasks', response.data['errors'][1]['errors'])
+        self.assertEqual(sorted(Poll.objects.values_list('owner', flat=True)), ['importer', 'other'])
+        test = Test.objects.get()
+        self.assertEqual(test.tasks.count(), 2)
+        self.assertEqual(TaskOption.objects.filter(task__test=test).count(), 8)
+
+    def test_invalid_utf8_line_is_reported(self):
+        poll = {'type': 'poll', 'title': 'Импорт', 'choices': [{'choice_text': 'да'}]}
+        body = self.ndjson(poll).encode() + b'{"type": "poll", "title": "\xff\xfe"}\n' + self.ndjson(poll).encode()
+        response = self.client.generic('POST', reverse('import'), body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['created'], {'polls': 2, 'tests': 0})
+        self.assertEqual([(e['line'], list(e['errors'])) for e in response.data['errors']], [(2, ['encoding'])])
+
+        with tempfile.NamedTemporaryFile('wb', suffix='.ndjson', delete=False) as f:
+            f.write(body)
+        self.addCleanup(os.remove, f.name)
+        err = io.StringIO()
+        call_command('import_ndjson', f.name, stdout=io.StringIO(), stderr=err)
+        self.assertIn('строка 2', err.getvalue())
+        self.assertEqual(Poll.objects.count(), 4)
+
+    def test_command_writes_in_batches(self):
+        records = [{'type': 'test', **test_payload(tasks=3)} for _ in range(7)]
+        records += [{'type': 'poll', 'title': f'Опрос {i}', 'choices': [{'choice_text': 'а'}]} for i in range(5)]
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', encoding='utf-8', delete=False) as f:
+            f.write(self.ndjson(*records))
+        self.addCleanup(os.remove, f.name)
+        out = io.StringIO()
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('import_ndjson', f.name, '--batch-size', '3', stdout=out)
+        self.assertIn('тестов: 7', out.getvalue())
+        self.assertEqual(Task.objects.count(), 21)
+        self.assertEqual(Choice.objects.count(), 5)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "tasks"')]
+        # Задания пишутся одним INSERT на пачку, а не по одному
+        self.assertEqual(len(inserts), 3)
+
+
+@override_settings(POLLS_METRICS=True, POLLS_METRICS_SLOW_MS=None)
+class MetricsTests(PollsTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+
+    def test_requests_are_recorded_per_route(self):
+        poll = make_poll(votes=2)
+        for _ in range(3):
+            self.client.get(reverse('poll-detail', args=[poll.id]))
+        self.client.get('/api/polls/nowhere/')
+        data = registry.snapshot()
+        detail = data['poll-detail']
+        self.assertEqual(detail['requests'], {('GET', 200): 3})
+        self.assertEqual(sum(detail['buckets']), 3)
+        self.assertGreater(detail['queries'], 0)
+        self.assertGreater(detail['response_bytes'], 0)
+        self.assertEqual(data['<unresolved>']['requests'], {('GET', 404): 1})
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('polls_http_requests_total{endpoint="poll-detail",method="GET",status="200"} 3', text)
+        self.assertIn('polls_http_request_duration_seconds_bucket{endpoint="poll-detail",le="+Inf"} 3', text)
+        self.assertIn('polls_db_queries_total{endpoint="poll-detail"}', text)
+
+    def test_streamed_size_is_counted(self):
+        poll = make_poll(votes=5)
+        response = self.client.get(reverse('poll-export', args=[poll.id]), HTTP_X_USER_ID='owner')
+        body = b''.join(response.streaming_content)
+        self.assertEqual(registry.snapshot()['poll-export']['response_bytes'], len(body))
+
+    async def test_async_requests_are_recorded(self):
+        poll = await sync_to_async(make_poll)()
+        response = await self.async_client.get(reverse('poll-detail', args=[poll.id]))
+        self.assertEqual(response.status_code, 200)
+        detail = registry.snapshot()['poll-detail']
+        self.assertEqual(detail['requests'], {('GET', 200): 1})
+        # Запросы синхронного представления за sync_to_async тоже посчитаны
+        self.assertGreater(detail['queries'], 0)
+
+    @override_settings(DEBUG=True)
+    def test_async_chain_is_not_adapted(self):
+        # Под ASGI middleware не оборачивается в async_to_sync: иначе каждый
+        # открытый поток poll_events держал бы поток из пула
+        with self.assertLogs('django.request', 'DEBUG') as logs:
+            ASGIHandler()
+        # Отключенная в настройках ReplicaRoutingMiddleware пишет только MiddlewareNotUsed
+        self.assertFalse([line for line in logs.output if 'adapted' in line])
+        self.assertTrue(iscoroutinefunction(MetricsMiddleware(poll_events)))
+
+    @override_settings(POLLS_METRICS_SLOW_MS=0, POLLS_METRICS_SLOW_TOP_SQL=2)
+    def test_slow_requests_are_logged_with_sql(self):
+        poll = make_poll()
+        with self.assertLogs('polls.metrics', 'WARNING') as logs:
+            self.client.get(reverse('poll-detail', args=[poll.id]))
+        self.assertIn('poll-detail', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    @override_settings(POLLS_METRICS=False)
+    def test_disabled_middleware_is_not_used(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            MetricsMiddleware(lambda request: None)
+        self.client.get(reverse('poll-list'))
+        self.assertEqual(registry.snapshot(), {})
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+
+class SqliteProfileTests(PollsTestCase):
+    def test_production_pragmas_are_applied_on_connect(self):
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        for suffix in ('', '-wal', '-shm'):
+            self.addCleanup(lambda p=path + suffix: os.path.exists(p) and os.remove(p))
+        profile = settings.POLLS_SQLITE_PROFILES['production']
+        wrapper = DatabaseWrapper({**connection.settings_dict, 'NAME': path, **profile}, alias='profile')
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            pragmas = {}
+            for name in ('journal_mode', 'synchronous', 'busy_timeout', 'temp_store'):
+                cursor.execute(f'PRAGMA {name}')
+                pragmas[name] = cursor.fetchone()[0]
+        # synchronous=NORMAL - 1, temp_store=MEMORY - 2, busy_timeout из timeout в мс
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 20000, 'temp_store': 2})
+
+        wrapper.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        self.assertIsNotNone(wrapper._gate)
+        wrapper.rollback()
+        wrapper.set_autocommit(True)
+        self.assertIsNone(wrapper._gate)
+
+    def bench_contention(self):
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            output = f.name
+        self.addCleanup(os.remove, output)
+        subprocess.run(
+            [sys.executable, 'manage.py', 'bench_contention', '--profiles', 'default,production',
+             '--processes', '3', '--threads', '2', '--votes', '120', '--output', output],
+            cwd=settings.BASE_DIR, check=True, capture_output=True,
+        )
+        with open(output, encoding='utf-8') as f:
+            results = json.load(f)
+        return results['default'], results['production']
+
+    def test_no_votes_lost_under_contention(self):
+        default, production = self.bench_contention()
+        self.assertEqual(production['stored'], 120)
+        self.assertEqual(production['counted'], 120)
+        for result in (default, production):
+            self.assertEqual(result['lost'], 0)
+
+    # Сравнение по времени зависит от загрузки машины - только по запросу
+    @tag('slow')
+    @skipUnless(os.environ.get('POLLS_SLOW_TESTS'), 'сравнение производительности: POLLS_SLOW_TESTS=1')
+    def test_production_profile_beats_default_under_contention(self):
+        default, production = self.bench_contention()
+        self.assertEqual(production['created'], 120)
+        self.assertLess(production['failed'], default['failed'])
+        self.assertGreater(production['votes_per_second'], default['votes_per_second'])
+
+
+@override_settings(POLLS_DB_REPLICA_ALIAS='replica', POLLS_DB_STICKY_SECONDS=5)
+class ReplicaRoutingTests(PollsTestCase):
+    def test_router_sends_reads_to_replica_only_when_allowed(self):
+        router = routing.PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(Poll), 'default')
+        with routing.read_from_replica():
+            self.assertEqual(router.db_for_read(Poll), 'replica')
+            self.assertEqual(router.db_for_write(Poll), 'default')
+            with routing.read_from_replica(False):
+                self.assertEqual(router.db_for_read(Vote), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'polls'))
+        self.assertIsNone(router.allow_migrate('default', 'polls'))
+
+    def test_client_sticks_to_primary_after_write(self):
+        seen = []
+
+        def view(request):
+            seen.append(routing.reading_from_replica())
+            return JsonResponse({}, status=201 if request.method == 'POST' else 200)
+
+        middleware = routing.ReplicaRoutingMiddleware(view)
+        factory = RequestFactory()
+        middleware(factory.get('/api/polls/list/'))
+        response = middleware(factory.post('/api/polls/1/vote/'))
+        self.assertEqual(response.cookies[routing.STICKY_COOKIE]['max-age'], 5)
+        sticky = factory.get('/api/polls/list/')
+        sticky.COOKIES[routing.STICKY_COOKIE] = '1'
+        middleware(sticky)
+        self.assertEqual(seen, [True, False, False])
+        self.assertFalse(routing.reading_from_replica())
+
+    async def test_async_chain_keeps_routing(self):
+        seen = []
+
+        async def view(request):
+            # Синхронный код за sync_to_async, как в poll_events
+            seen.append(await sync_to_async(routing.reading_from_replica)())
+            return JsonResponse({}, status=201 if request.method == 'POST' else 200)
+
+        middleware = routing.ReplicaRoutingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        factory = RequestFactory()
+        await middleware(factory.get('/api/polls/list/'))
+        response = await middleware(factory.post('/api/polls/1/vote/'))
+        self.assertEqual(response.cookies[routing.STICKY_COOKIE]['max-age'], 5)
+        self.assertEqual(seen, [True, False])
+
+    @override_settings(DEBUG=True)
+    def test_async_chain_is_not_adapted(self):
+        with self.assertLogs('django.request', 'DEBUG') as logs:
+            ASGIHandler()
+        self.assertFalse([line for line in logs.output if 'adapted' in line])
+
+    def replica_settings(self, path):
+        # DATABASES['replica'] в том виде, в каком его строит settings.py по POLLS_DB_REPLICA
+        with mock.patch.dict(os.environ, {'POLLS_DB_REPLICA': path}):
+            module = importlib.reload(project_settings)
+        self.addCleanup(importlib.reload, project_settings)
+        return module.DATABASES['replica']
+
+    def test_reads_go_to_read_only_replica_end_to_end(self):
+        poll = make_poll(title='Как на реплике')
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        # Тестовая база в памяти, и ее данные еще в незакоммиченной транзакции
+        # этого соединения - переносим их дампом через него же
+        connection.ensure_connection()
+        target = sqlite3.connect(path)
+        target.executescript('\n'.join(connection.connection.iterdump()))
+        target.close()
+
+        replica = self.replica_settings(path)
+        self.assertTrue(replica['NAME'].endswith('?mode=ro'))
+        self.assertNotIn('OPTIONS', replica)
+        self.assertNotIn('CONN_MAX_AGE', replica)
+        configured = connections.configure_settings({'default': connection.settings_dict, 'replica': replica})
+        connections.settings['replica'] = configured['replica']
+        self.addCleanup(connections.settings.pop, 'replica')
+        self.addCleanup(lambda: connections['replica'].close())
+
+        # Изменение есть только в default, реплика его еще не получила
+        Poll.objects.filter(pk=poll.pk).update(title='Уже в default')
+        url = reverse('poll-detail', args=[poll.pk])
+        self.assertEqual(self.client.get(url).data['title'], 'Как на реплике')
+        self.client.post(reverse('poll-vote', args=[poll.pk]), {'choice_id': poll.choices.first().id, 'user': 'u1'})
+        # После записи клиент читает из default
+        self.assertEqual(self.client.get(url).data['title'], 'Уже в default')
+
+        with self.assertRaises(OperationalError), connections['replica'].cursor() as cursor:
+            cursor.execute('DELETE FROM polls')
+
+    def test_replicate_command_copies_database(self):
+        paths = []
+        for _ in range(2):
+            fd, path = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(fd)
+            self.addCleanup(os.remove, path)
+            paths.append(path)
+        source, target = paths
+        with sqlite3.connect(source) as db:
+            db.execute('CREATE TABLE t (x)')
+            db.executemany('INSERT INTO t VALUES (?)', [(i,) for i in range(100)])
+        db.close()
+        call_command('replicate_db', '--source', source, '--target', target, stdout=io.StringIO())
+        replica = sqlite3.connect(target)
+        self.addCleanup(replica.close)
+        self.assertEqual(replica.execute('SELECT count(*) FROM t').fetchone()[0], 100)
+
+
+class IdempotencyTests(PollsTestCase):
+    def test_retried_vote_is_not_written_twice(self):
+        poll = make_poll(multiple_answers=True)
+        choice = poll.choices.first()
+        url = reverse('poll-vote', args=[poll.pk])
+        first = self.client.post(url, {'choice_id': choice.id, 'user': 'u1'}, HTTP_IDEMPOTENCY_KEY='k1')
+        retry = self.client.post(url, {'choice_id': choice.id, 'user': 'u1'}, HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Vote.objects.count(), 1)
+        # Полный ответ со списком голосов не хранится, он собирается заново
+        self.assertEqual(IdempotencyKey.objects.get().response, {'compact': None})
+
+        compact = url + '?response=compact'
+        first = self.client.post(compact, {'choice_id': choice.id, 'user': 'u3'}, HTTP_IDEMPOTENCY_KEY='k2')
+        # Компактные счетчики сохранены: только чтение ключа, голос не пишется
+        with self.assertNumQueries(1):
+            retry = self.client.post(compact, {'choice_id': choice.id, 'user': 'u3'}, HTTP_IDEMPOTENCY_KEY='k2')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Vote.objects.count(), 2)
+
+        other = self.client.post(url, {'choice_id': choice.id, 'user': 'u2'}, HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(other.status_code, 422)
+
+    def test_failed_request_can_be_retried_with_same_key(self):
+        poll = make_poll()
+        choice = poll.choices.first()
+        url = reverse('poll-vote', args=[poll.pk])
+        self.assertEqual(self.client.post(url, {'choice_id': 0, 'user': 'u1'}, HTTP_IDEMPOTENCY_KEY='k').status_code, 400)
+        response = self.client.post(url, {'choice_id': 0, 'user': 'u1'}, HTTP_IDEMPOTENCY_KEY='k')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(self.client.post(url, {'choice_id': choice.id, 'user': 'u1'}).status_code, 201)
+
+    def test_retried_submit_returns_original_attempt(self):
+        test = self.client.post(reverse('test-list-create'), test_payload(), format='json').json()
+        task = test['tasks'][0]
+        data = {'test': test['id'], 'user': 'u1',
+                'answers': [{'task': task['id'], 'selected_options': [task['options'][0]['id']]}]}
+        url = reverse('test-submit')
+        first = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='submit-1')
+        retry = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='submit-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.json()['id'], first.json()['id'])
+        self.assertEqual(TestAttempt.objects.count(), 1)
+
+    def test_key_and_vote_commit_together(self):
+        poll = make_poll(multiple_answers=True)
+        choice = poll.choices.first()
+        url = reverse('poll-vote', args=[poll.pk])
+        # Сбой после записи голоса, но до сохранения ответа: откатываются оба
+        with mock.patch.object(IdempotencyKey, 'save', side_effect=DatabaseError('disk I/O error')), \
+                self.assertRaises(DatabaseError):
+            self.client.post(url, {'choice_id': choice.id, 'user': 'u1'}, HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertFalse(Vote.objects.exists())
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(
+            self.client.post(url, {'choice_id': choice.id, 'user': 'u1'}, HTTP_IDEMPOTENCY_KEY='k1').status_code, 201)
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_retry_after_concurrent_commit_replays(self):
+        poll = make_poll(multiple_answers=True)
+        choice = poll.choices.first()
+        url = reverse('poll-vote', args=[poll.pk])
+        first = self.client.post(url, {'choice_id': choice.id, 'user': 'u1'}, HTTP_IDEMPOTENCY_KEY='k1')
+        # Повтор не увидел ключ при первом чтении (его еще не закоммитили)
+        # и споткнулся о него при вставке
+        real_filter = IdempotencyKey.objects.filter
+
+        def not_committed_yet(*args, **kwargs):
+            if 'expires_at__gt' in kwargs:
+                return IdempotencyKey.objects.none()
+            return real_filter(*args, **kwargs)
+
+        with mock.patch('polls.idempotency.IdempotencyKey.objects.filter', side_effect=not_committed_yet):
+            retry = self.client.post(url, {'choice_id': choice.id, 'user': 'u1'}, HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_retry_after_concurrent_failure_runs_again(self):
+        from polls import idempotency
+        poll = make_poll(multiple_answers=True)
+        choice = poll.choices.first()
+        url = reverse('poll-vote', args=[poll.pk])
+        real_claim = idempotency._claim
+        calls = []
+
+        def competitor_failed(key, fingerprint):
+            # Параллельный запрос держал ключ, упал и удалил строку
+            calls.append(key)
+            if len(calls) == 1:
+                raise idempotency._KeyTaken
+            return real_claim(key, fingerprint)
+
+        with mock.patch('polls.idempotency._claim', side_effect=competitor_failed):
+            response = self.client.post(url, {'choice_id': choice.id, 'user': 'u1'}, HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(Vote.objects.count(), 1)
+
+        with mock.patch('polls.idempotency._claim', side_effect=idempotency._KeyTaken):
+            response = self.client.post(url, {'choice_id': choice.id, 'user': 'u2'}, HTTP_IDEMPOTENCY_KEY='k2')
+        self.assertEqual(response.status_code, 409)
+
+    def test_expired_key_is_forgotten(self):
+        poll = make_poll(multiple_answers=True)
+        choices = list(poll.choices.order_by('id'))
+        url = reverse('poll-vote', args=[poll.pk])
+        self.client.post(url, {'choice_id': choices[0].id, 'user': 'u1'}, HTTP_IDEMPOTENCY_KEY='k1')
+        later = timezone.now() + timedelta(seconds=settings.POLLS_IDEMPOTENCY_TTL + 1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            response = self.client.post(url, {'choice_id': choices[1].id, 'user': 'u1'}, HTTP_IDEMPOTENCY_KEY='k1')
+            self.assertEqual(response.status_code, 201)
+            self.assertNotIn('Idempotent-Replayed', response)
+            call_command('purge_idempotency_keys', stdout=io.StringIO())
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_expired_keys_are_purged_on_write(self):
+        poll = make_poll(multiple_answers=True)
+        choice = poll.choices.first()
+        url = reverse('poll-vote', args=[poll.pk])
+        for i in range(3):
+            self.client.post(url, {'choice_id': choice.id, 'user': f'u{i}'}, HTTP_IDEMPOTENCY_KEY=f'k{i}')
+        later = timezone.now() + timedelta(seconds=settings.POLLS_IDEMPOTENCY_TTL + 1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.client.post(url, {'choice_id': choice.id, 'user': 'u9'}, HTTP_IDEMPOTENCY_KEY='k9')
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
@@ -0,0 +1,46 @@
+"""
+Время прохождения попытки теста.
+
+Попытка создается только при сдаче, поэтому начало прохождения сервер сам
+не видит. Клиент при старте теста запрашивает /tests/<pk>/start/ и получает
+start_token - подписанное (SECRET_KEY) время выдачи. При сдаче токен
+возвращается вместе с ответами: started_at попытки берется из него, а
+duration = submitted_at - started_at. Подделать или сдвинуть время нельзя,
+токен другого теста не принимается. Без токена (старые клиенты) время
+прохождения неизвестно: duration = None, в таблице лидеров такая попытка
+стоит после попыток с тем же баллом и известным временем, в статистике
+среднее время считается без нее.
+"""
+from django.core import signing
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+SALT = 'polls.attempt-start'
+
+
+def start_token(test_id):
+    started_at = timezone.now()
+    return started_at, signing.dumps({'test': test_id, 'started_at': started_at.isoformat()}, salt=SALT)
+
+
+def read_start_token(token, test_id):
+    """Время начала из start_token или None, если токен поддельный или от другого теста."""
+    try:
+        data = signing.loads(token, salt=SALT)
+    except signing.BadSignature:
+        return None
+    if data.get('test') != test_id:
+        return None
+    return parse_datetime(data['started_at'])
+
+
+def attempt_timing(started_at=None):
+    """Поля started_at, submitted_at и duration для новой попытки."""
+    submitted_at = timezone.now()
+    if started_at is None or started_at > submitted_at:
+        return {'started_at': submitted_at, 'submitted_at': submitted_at, 'duration': None}
+    return {
+        'started_at': started_at,
+        'submitted_at': submitted_at,
+        'duration': (submitted_at - started_at).total_seconds(),
+    }
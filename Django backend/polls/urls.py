@@ -13,9 +13,20 @@ urlpatterns = [
     path('<int:pk>/', views.PollRetrieveUpdateDestroyAPIView.as_view(), name='poll-detail'),
     path('<int:poll_id>/vote/', views.VoteCreateAPIView.as_view(), name='poll-vote'),
     path('<int:poll_id>/unvote/', views.VoteCancelAPIView.as_view(), name='poll-unvote'),
+    path('<int:pk>/events/', views.poll_events, name='poll-events'),
+    path('<int:pk>/export/', views.PollExportAPIView.as_view(), name='poll-export'),
+    path('ballot/', views.BallotCreateAPIView.as_view(), name='poll-ballot'),
+
+    path('import/', views.ImportAPIView.as_view(), name='import'),
 
     # 2. ТЕСТЫ (Tests) - Пути: /api/tests/...
     path('tests/', views.TestListCreateAPIView.as_view(), name='test-list-create'),
     path('tests/submit/', views.TestAttemptCreateAPIView.as_view(), name='test-submit'),
+    path('tests/attempts/<int:pk>/', views.TestAttemptRetrieveAPIView.as_view(), name='test-attempt-detail'),
     path('tests/<int:pk>/', views.TestRetrieveUpdateDestroyAPIView.as_view(), name='test-detail'),
+    path('tests/<int:pk>/start/', views.TestStartAPIView.as_view(), name='test-start'),
+    path('tests/<int:pk>/attempts/', views.TestAttemptListAPIView.as_view(), name='test-attempts'),
+    path('tests/<int:pk>/stats/', views.TestStatsAPIView.as_view(), name='test-stats'),
+    path('tests/<int:pk>/leaderboard/', views.TestLeaderboardAPIView.as_view(), name='test-leaderboard'),
+    path('tests/<int:pk>/export/', views.TestExportAPIView.as_view(), name='test-export'),
 ]
\ No newline at end of file
@@ -1,24 +1,48 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse
+from django.urls import reverse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.middleware.csrf import get_token
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.db import transaction
-from django.db.models import F
+from django.db.models import Count, F, OuterRef, Subquery
 
+from .cache import cached_payload, invalidate_poll, invalidate_test
+from .conditional import ConditionalMixin
+from .idempotency import IdempotencyMixin
+from .ingest import BUFFERED, ingest_mode
+from .live import broker, publish_on_commit
 from .models import Choice, Poll, Test, TestAttempt, Vote
 from .serializers import (
     PollCreateSerializer,
     PollDetailSerializer,
     VoteSerializer,
+    BallotSerializer,
+    compact_poll_results,
+    refresh_is_active,
     TestSerializer,
     TestAttemptSerializer,
+    embed_attempts,
+    request_user,
 )
 
-from .permissions import IsOwnerOrReadOnly
+from . import export
+from .importer import Importer
+from .pagination import AttemptPagination, KeysetPagination
+from . import leaderboard
+from . import metrics
+from .stats import get_test_stats
+from .timing import start_token
+from .permissions import IsOwner, IsOwnerOrReadOnly
 # --- CSRF ---
 def set_csrf_cookie(request):
     get_token(request)
@@ -30,10 +54,20 @@ def get_csrf(request):
     return JsonResponse({"detail": "CSRF cookie set"})
 
 
+# --- METRICS ---
+def metrics_view(request):
+    """Метрики MetricsMiddleware для Prometheus (/api/metrics/)."""
+    if not metrics.metrics_enabled():
+        raise Http404
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # --- POLLS ---
-class PollListCreateAPIView(generics.ListCreateAPIView):
-    queryset = Poll.objects.filter(active=True).order_by('-created_at')
+class PollListCreateAPIView(ConditionalMixin, generics.ListCreateAPIView):
+    version_kind = 'poll'
+    queryset = Poll.objects.filter(active=True).with_results().order_by('-created_at')
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -44,15 +78,43 @@ class PollListCreateAPIView(generics.ListCreateAPIView):
         # Берем owner из запроса, если его нет - Anonymous
         owner_name = self.request.data.get('owner', 'Anonymous')
         serializer.save(owner=owner_name)
+        invalidate_poll(serializer.instance.pk, collection=True)
 
 
-class PollRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Poll.objects.all()
+class PollRetrieveUpdateDestroyAPIView(ConditionalMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_kind = 'poll'
+    queryset = Poll.objects.with_results()
     serializer_class = PollDetailSerializer
     permission_classes = [IsOwnerOrReadOnly]
 
+    def retrieve(self, request, *args, **kwargs):
+        # Готовый ответ берется из версионного кэша (polls/cache.py)
+        def build():
+            return self.get_serializer(self.get_object()).data
+        payload = cached_payload('poll', self.kwargs['pk'], build, version=getattr(self, 'version', None))
+        return Response(refresh_is_active(payload))
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        invalidate_poll(serializer.instance.pk, collection=True)
+
+    def perform_destroy(self, instance):
+        poll_id = instance.pk
+        super().perform_destroy(instance)
+        invalidate_poll(poll_id, collection=True)
+
 
-class VoteCreateAPIView(generics.CreateAPIView):
+class CompactResultsMixin:
+    """
+    Ответ в компактном виде (?response=compact или заголовок
+    X-Response-Mode: compact) вместо полного PollDetailSerializer.
+    """
+    def wants_compact(self, request):
+        mode = request.query_params.get('response') or request.headers.get('X-Response-Mode')
+        return mode == 'compact'
+
+
+class VoteCreateAPIView(IdempotencyMixin, CompactResultsMixin, generics.CreateAPIView):
     serializer_class = VoteSerializer
     permission_classes = [AllowAny]
 
@@ -63,16 +125,43 @@ class VoteCreateAPIView(generics.CreateAPIView):
         serializer.save(user=user_name, poll=poll)
 
     def create(self, request, *args, **kwargs):
-        # Стандартное создание + возврат обновленного опроса
-        response = super().create(request, *args, **kwargs)
+        # В буферном режиме голос еще не записан - счетчики в ответе его не учитывают
+        buffered = ingest_mode() == BUFFERED
+        response_status = status.HTTP_202_ACCEPTED if buffered else status.HTTP_201_CREATED
         poll_id = self.kwargs.get('poll_id')
-        updated_poll = Poll.objects.get(pk=poll_id)
+
+        if self.wants_compact(request):
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            # Счетчики читаются в той же транзакции, что и запись голоса
+            with transaction.atomic():
+                self.perform_create(serializer)
+                data = compact_poll_results(poll_id, request.data.get('user', 'Anonymous'))
+            return Response(data, status=response_status)
+
+        # Стандартное создание + возврат обновленного опроса
+        super().create(request, *args, **kwargs)
+        return self.poll_response(request, response_status)
+
+    def poll_response(self, request, response_status):
+        updated_poll = Poll.objects.with_results().get(pk=self.kwargs.get('poll_id'))
         return Response(
             PollDetailSerializer(updated_poll, context={'request': request}).data,
-            status=status.HTTP_201_CREATED
+            status=response_status
         )
 
-class VoteCancelAPIView(APIView):
+    def idempotent_result(self, response):
+        # Полный ответ со списком всех голосов растет вместе с опросом -
+        # запоминаем только компактные счетчики, полный собираем заново
+        return {'compact': response.data if self.wants_compact(self.request) else None}
+
+    def replay_response(self, request, result, status_code):
+        if not self.wants_compact(request):
+            return self.poll_response(request, status_code)
+        data = result['compact'] or compact_poll_results(self.kwargs.get('poll_id'), request.data.get('user', 'Anonymous'))
+        return Response(data, status=status_code)
+
+class VoteCancelAPIView(CompactResultsMixin, APIView):
     permission_classes = [AllowAny]
 
     def post(self, request, poll_id):
@@ -88,51 +177,300 @@ class VoteCancelAPIView(APIView):
         # Находим все голоса этого пользователя в этом опросе
         votes = Vote.objects.filter(poll=poll, user=user_id)
 
-        if not votes.exists():
-            return Response({"message": "Голоса не найдены"}, status=status.HTTP_404_NOT_FOUND)
+        # Необязательный choice_id - отозвать только один выбранный вариант
+        choice_id = request.data.get('choice_id')
+        if choice_id not in (None, ''):
+            try:
+                votes = votes.filter(choice_id=int(choice_id))
+            except (TypeError, ValueError):
+                return Response({"choice_id": "Ожидается число."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Сколько голосов пользователь отдал за конкретный вариант
+        user_votes_per_choice = (
+            votes.filter(choice=OuterRef('pk'))
+            .values('choice')
+            .annotate(n=Count('id'))
+            .values('n')
+        )
 
         with transaction.atomic():
-            # Проходим по голосам, чтобы уменьшить счетчики
-            for vote in votes:
-                # Уменьшаем счетчик голосов у варианта (Choice)
-                # Используем F expression для атомарности (защита от гонки потоков)
-                Choice.objects.filter(id=vote.choice.id).update(votes_count=F('votes_count') - 1)
-            
-            # Удаляем записи о голосах
-            votes.delete()
+            # Два оператора на любое число голосов: один UPDATE уменьшает счетчики
+            # всех затронутых вариантов сразу, один DELETE удаляет голоса.
+            # UPDATE идет первым и берет блокировку записи, поэтому параллельная
+            # отмена увидит уже удаленные голоса и ничего не вычтет повторно.
+            Choice.objects.filter(id__in=votes.values('choice_id')).update(
+                votes_count=F('votes_count') - Subquery(user_votes_per_choice)
+            )
+            if broker.has_subscribers(poll.pk):
+                # Для живых результатов нужны сами изменения счетчиков;
+                # блокировка уже взята UPDATE, так что выборка согласована
+                removed = votes.values_list('choice_id').annotate(n=Count('id'))
+                publish_on_commit(poll.pk, {choice_id: -n for choice_id, n in removed})
+            deleted, _ = votes.delete()
+            invalidate_poll(poll.pk)
+
+            if not deleted:
+                return Response({"message": "Голоса не найдены"}, status=status.HTTP_404_NOT_FOUND)
+
+            if self.wants_compact(request):
+                return Response(compact_poll_results(poll.pk, user_id), status=status.HTTP_200_OK)
 
         # Возвращаем обновленные данные опроса, чтобы фронтенд сразу перерисовался
+        updated_poll = Poll.objects.with_results().get(pk=poll.pk)
         return Response(
-            PollDetailSerializer(poll, context={'request': request}).data,
+            PollDetailSerializer(updated_poll, context={'request': request}).data,
             status=status.HTTP_200_OK
         )
 
+class BallotCreateAPIView(APIView):
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        serializer = BallotSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+        created = any(r['status'] == 'created' for r in results)
+        return Response(
+            {'results': results},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
+        )
+
+def _poll_snapshot(pk):
+    if not Poll.objects.filter(pk=pk).exists():
+        raise Http404
+    return compact_poll_results(pk)
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _poll_event_stream(subscription, snapshot):
+    loop = asyncio.get_running_loop()
+    min_interval = getattr(settings, 'POLLS_LIVE_MIN_INTERVAL', 0.5)
+    keepalive = getattr(settings, 'POLLS_LIVE_KEEPALIVE', 15)
+    deadline = loop.time() + getattr(settings, 'POLLS_LIVE_MAX_SECONDS', 300)
+    try:
+        yield _sse('snapshot', snapshot)
+        while loop.time() < deadline:
+            try:
+                await asyncio.wait_for(subscription.ready.wait(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            deltas = subscription.take()
+            if deltas:
+                yield _sse('delta', {
+                    'id': subscription.poll_id,
+                    'choices': [{'id': choice_id, 'delta': n} for choice_id, n in sorted(deltas.items())],
+                })
+            # Всё, что придет за паузу, уйдет следующим событием одной пачкой
+            await asyncio.sleep(min_interval)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def poll_events(request, pk):
+    """
+    Server-Sent Events с изменениями счетчиков опроса: сначала snapshot с текущими
+    значениями, затем события delta. Нужен ASGI-сервер (uvicorn, daphne);
+    по истечении POLLS_LIVE_MAX_SECONDS поток закрывается, и EventSource
+    переподключается сам.
+    """
+    # Подписываемся до чтения снимка, чтобы не потерять голоса между ними
+    subscription = broker.subscribe(pk)
+    try:
+        snapshot = await sync_to_async(_poll_snapshot)(pk)
+    except BaseException:
+        broker.unsubscribe(subscription)
+        raise
+    response = StreamingHttpResponse(
+        _poll_event_stream(subscription, snapshot), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+class ExportAPIView(APIView):
+    """
+    Потоковая выгрузка (polls/export.py): ?output=csv (по умолчанию) или ?output=ndjson.
+    Доступна только владельцу объекта.
+    """
+    permission_classes = [IsOwner]
+    model = None
+
+    def get_output(self):
+        output = self.request.query_params.get('output', export.CSV)
+        if output not in export.CONTENT_TYPES:
+            raise ValidationError({'output': f'Поддерживаются форматы: {", ".join(export.CONTENT_TYPES)}.'})
+        return output
+
+    def get(self, request, pk):
+        obj = get_object_or_404(self.model, pk=pk)
+        self.check_object_permissions(request, obj)
+        return self.export(obj, self.get_output())
+
+
+class PollExportAPIView(ExportAPIView):
+    model = Poll
+
+    def export(self, poll, output):
+        rows = export.vote_rows(poll)
+        return export.stream_response(rows, export.VOTE_COLUMNS, output, f'poll-{poll.pk}-votes')
+
+
+class TestExportAPIView(ExportAPIView):
+    model = Test
+
+    def export(self, test, output):
+        rows = export.attempt_rows(test, output)
+        header = export.ATTEMPT_COLUMNS + export.ANSWER_COLUMNS
+        return export.stream_response(rows, header, output, f'test-{test.pk}-attempts')
+
+
+class ImportAPIView(APIView):
+    """
+    Импорт опросов и тестов из NDJSON (polls/importer.py). Тело читается
+    построчно из потока запроса, не целиком; ответ - отчет с ошибками по строкам.
+    """
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        importer = Importer(owner=request.headers.get('X-User-ID'))
+        stream = request.stream
+        lines = iter(stream.readline, b'') if stream is not None else ()
+        report = importer.run(lines)
+        status_code = status.HTTP_201_CREATED if not report['error_count'] else status.HTTP_207_MULTI_STATUS
+        return Response(report, status=status_code)
+
+
 # --- TESTS ---
-class TestListCreateAPIView(generics.ListCreateAPIView):
-    queryset = Test.objects.all()
+class TestQuerysetMixin:
+    # Сводка по попыткам зависит от того, кто спрашивает, и от режима совместимости
+    vary_headers = ('X-User-ID',)
+
+    def get_queryset(self):
+        return Test.objects.prefetch_related('tasks__options').with_attempts_summary(request_user(self.request))
+
+    def get_etag_variant(self):
+        return f'{request_user(self.request) or ""}|{int(embed_attempts(self.request))}'
+
+
+class TestListCreateAPIView(TestQuerysetMixin, ConditionalMixin, generics.ListCreateAPIView):
+    version_kind = 'test'
     serializer_class = TestSerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
 
     def perform_create(self, serializer):
         # Принудительно пишем owner из body запроса
         owner_name = self.request.data.get('owner', 'Anonymous')
         serializer.save(owner=owner_name)
+        invalidate_test(serializer.instance.pk, collection=True)
 
 
-class TestRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Test.objects.all()
+class TestRetrieveUpdateDestroyAPIView(TestQuerysetMixin, ConditionalMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_kind = 'test'
     serializer_class = TestSerializer
     permission_classes = [AllowAny]
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        invalidate_test(serializer.instance.pk, collection=True)
+
+    def perform_destroy(self, instance):
+        test_id = instance.pk
+        super().perform_destroy(instance)
+        invalidate_test(test_id, collection=True)
+
+
+class TestAttemptListAPIView(generics.ListAPIView):
+    """Попытки теста постранично (курсор по started_at, id), фильтр ?user=..."""
+    serializer_class = TestAttemptSerializer
+    permission_classes = [AllowAny]
+    pagination_class = AttemptPagination
+
+    def get_queryset(self):
+        test = get_object_or_404(Test.objects.only('id'), pk=self.kwargs['pk'])
+        queryset = TestAttempt.objects.filter(test=test)
+        user = self.request.query_params.get('user')
+        if user:
+            queryset = queryset.filter(user=user)
+        return queryset
+
+
+class TestStatsAPIView(APIView):
+    """Статистика теста из таблиц polls/stats.py - O(заданий), без чтения ответов."""
+    permission_classes = [AllowAny]
+
+    def get(self, request, pk):
+        test = get_object_or_404(Test.objects.only('id'), pk=pk)
+        return Response(get_test_stats(test.pk))
 
-class TestAttemptCreateAPIView(generics.CreateAPIView):
+
+class TestLeaderboardAPIView(APIView):
+    """Лучшие результаты теста: ?top=N (первые N мест) и ?user=X (место пользователя)."""
+    permission_classes = [AllowAny]
+
+    def get(self, request, pk):
+        test = get_object_or_404(Test.objects.only('id'), pk=pk)
+        default = getattr(settings, 'POLLS_LEADERBOARD_TOP', 10)
+        maximum = getattr(settings, 'POLLS_LEADERBOARD_MAX_TOP', 100)
+        try:
+            n = int(request.query_params.get('top', default))
+        except ValueError:
+            n = default
+        user = request.query_params.get('user')
+        return Response({
+            'test': test.pk,
+            'top': leaderboard.top(test.pk, max(0, min(n, maximum))),
+            'user': leaderboard.rank(test.pk, user) if user else None,
+        })
+
+
+class TestStartAPIView(APIView):
+    """Начало прохождения: start_token для сдачи, по нему считается время попытки (polls/timing.py)."""
+    permission_classes = [AllowAny]
+
+    def post(self, request, pk):
+        test = get_object_or_404(Test.objects.only('id'), pk=pk)
+        started_at, token = start_token(test.pk)
+        return Response({'test': test.pk, 'started_at': started_at, 'start_token': token},
+                        status=status.HTTP_201_CREATED)
+
+
+class TestAttemptRetrieveAPIView(generics.RetrieveAPIView):
+    """Попытка со статусом проверки (pending/completed/failed) и баллами."""
+    queryset = TestAttempt.objects.all()
+    serializer_class = TestAttemptSerializer
+    permission_classes = [AllowAny]
+
+
+class TestAttemptCreateAPIView(IdempotencyMixin, generics.CreateAPIView):
     queryset = TestAttempt.objects.all()
     serializer_class = TestAttemptSerializer
     permission_classes = [AllowAny]
 
-    def post(self, request, *args, **kwargs):
-        print("DEBUG: Данные попытки теста:", request.data)
-        serializer = self.get_serializer(data=request.data)
-        if not serializer.is_valid():
-            print("DEBUG: Ошибки валидации:", serializer.errors)
-        return super().post(request, *args, **kwargs)
\ No newline at end of file
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        if response.data['status'] == TestAttempt.PENDING:
+            # Асинхронная проверка: результат - по ссылке из Location
+            response.status_code = status.HTTP_202_ACCEPTED
+            response['Location'] = reverse('test-attempt-detail', args=[response.data['id']])
+        return response
+
+    def idempotent_result(self, response):
+        return {'id': response.data['id']}
+
+    def replay_response(self, request, result, status_code):
+        # Текущее состояние попытки: асинхронная проверка могла уже завершиться
+        attempt = get_object_or_404(TestAttempt, pk=result['id'])
+        headers = {}
+        if status_code == status.HTTP_202_ACCEPTED:
+            headers['Location'] = reverse('test-attempt-detail', args=[attempt.pk])
+        return Response(TestAttemptSerializer(attempt).data, status=status_code, headers=headers)
+
+    def perform_create(self, serializer):
+        attempt = serializer.save()
+        # Попытки входят в ответ теста (all_attempts), его ETag должен смениться
+        invalidate_test(attempt.test_id)
\ No newline at end of file
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым в цепочке, чтобы время ответа включало остальные middleware
+    'polls.metrics.MetricsMiddleware',
+    'polls.routing.ReplicaRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -61,6 +65,27 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Курсорная пагинация списков опросов и тестов (?cursor=...&page_size=...)
+POLLS_PAGE_SIZE = 50
+POLLS_MAX_PAGE_SIZE = 500
+
+# True - вкладывать полный список попыток (all_attempts) в ответы тестов,
+# как раньше; без этого его можно запросить через ?include_attempts=1
+POLLS_EMBED_ATTEMPTS = False
+
+# Запись голосов: 'direct' - сразу в запросе, 'buffered' - пачками (polls/ingest.py)
+POLLS_VOTE_INGEST = os.environ.get('POLLS_VOTE_INGEST', 'direct')
+POLLS_VOTE_BUFFER_SIZE = 500     # сброс при таком числе голосов в буфере
+POLLS_VOTE_BUFFER_DELAY = 0.5    # ... или через столько секунд
+
+# Максимум пар (poll_id, choice_id) в одном бюллетене /api/polls/ballot/
+POLLS_BALLOT_MAX_ITEMS = 100
+
+# Живые результаты /api/polls/<pk>/events/ (SSE, только под ASGI)
+POLLS_LIVE_MIN_INTERVAL = 0.5    # не чаще одного события за столько секунд на поток
+POLLS_LIVE_KEEPALIVE = 15
+POLLS_LIVE_MAX_SECONDS = 300
+
 ROOT_URLCONF = 'quiz_project.urls'
 
 TIME_ZONE = 'Europe/Moscow'
@@ -89,13 +114,111 @@ WSGI_APPLICATION = 'quiz_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Профили SQLite (бэкенд polls.sqlite, см. polls/sqlite/base.py).
+# 'default' - как стандартный django.db.backends.sqlite3: соединение на запрос,
+# журнал отката. 'production' - для конкурентной записи: WAL (читатели не ждут
+# писателя), synchronous=NORMAL (в WAL без риска испортить базу, теряется разве
+# что последняя транзакция при отключении питания), ожидание блокировки вместо
+# ошибки, BEGIN IMMEDIATE и очередь писателей в процессе, постоянные соединения.
+POLLS_DB_PROFILE = os.environ.get('POLLS_DB_PROFILE', 'default')
+POLLS_SQLITE_PROFILES = {
+    'default': {},
+    'production': {
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,  # секунд ожидания блокировки (busy_timeout) и очереди писателей
+            'transaction_mode': 'IMMEDIATE',
+            'write_gate': True,
+            'pragmas': {
+                'journal_mode': 'wal',
+                'synchronous': 'normal',
+                'mmap_size': 256 * 1024 * 1024,
+                'cache_size': -64 * 1024,  # в КиБ, то есть 64 МиБ на соединение
+                'temp_store': 'memory',
+            },
+        },
+    },
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'polls.sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
+        **POLLS_SQLITE_PROFILES[POLLS_DB_PROFILE],
     }
 }
 
+# Реплика для чтения (polls/routing.py): путь ко второму файлу SQLite, его
+# обновляет команда replicate_db. Без нее все читается из default.
+# Файл открывается только на чтение (URI с mode=ro) и без настроек профиля
+# для записи: очереди писателей, BEGIN IMMEDIATE, WAL и постоянных соединений
+POLLS_DB_REPLICA = os.environ.get('POLLS_DB_REPLICA')
+if POLLS_DB_REPLICA:
+    DATABASES['replica'] = {
+        'ENGINE': 'polls.sqlite',
+        'NAME': Path(POLLS_DB_REPLICA).resolve().as_uri() + '?mode=ro',
+        'TEST': {'MIRROR': 'default'},
+    }
+POLLS_DB_REPLICA_ALIAS = 'replica' if POLLS_DB_REPLICA else None
+# Столько секунд после записи клиент читается из default
+POLLS_DB_STICKY_SECONDS = 5
+
+DATABASE_ROUTERS = ['polls.routing.PrimaryReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Версии объектов и готовые ответы API (polls/cache.py).
+    # LocMemCache при переполнении вытесняет давно не читавшиеся ключи
+    'polls': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'polls',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
+# Сколько секунд помнить ответ на запрос с Idempotency-Key (таблица idempotency_keys,
+# просроченные ключи удаляет команда purge_idempotency_keys)
+POLLS_IDEMPOTENCY_TTL = 24 * 60 * 60
+
+# Кэш сериализованных опросов для GET /api/polls/<pk>/
+POLLS_RESULT_CACHE = True
+
+# Ключи ответов тестов в памяти процесса: предел по суммарному числу заданий
+POLLS_ANSWER_KEY_CACHE_TASKS = 50000
+
+# Проверка попыток: 'sync' - в запросе, 'async' - фоновыми потоками (polls/submissions.py)
+POLLS_GRADING_MODE = os.environ.get('POLLS_GRADING_MODE', 'sync')
+POLLS_GRADING_WORKERS = 2         # потоков проверки в процессе
+POLLS_GRADING_QUEUE_SIZE = 1000   # попыток в очереди, сверх этого - 429
+
+# Таблица лидеров /api/tests/<pk>/leaderboard/: размер top по умолчанию и предел
+POLLS_LEADERBOARD_TOP = 10
+POLLS_LEADERBOARD_MAX_TOP = 100
+
+# Выгрузки CSV/NDJSON читают базу пачками такого размера
+POLLS_EXPORT_CHUNK_SIZE = 2000
+
+# Импорт NDJSON: записей в одной транзакции и предел ошибок в отчете
+POLLS_IMPORT_BATCH_SIZE = 200
+POLLS_IMPORT_MAX_ERRORS = 1000
+
+# Метрики запросов по маршрутам (polls/metrics.py), /api/metrics/ для Prometheus.
+# Выключены - MetricsMiddleware снимается с цепочки и ничего не стоит
+POLLS_METRICS = os.environ.get('POLLS_METRICS') == '1'
+POLLS_METRICS_SLOW_MS = 500       # предупреждение в лог polls.metrics; None - не писать
+POLLS_METRICS_SLOW_TOP_SQL = 5    # столько самых долгих SQL-запросов в предупреждении
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
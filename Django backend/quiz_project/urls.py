@@ -16,10 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from polls.views import get_csrf
+from polls.views import get_csrf, metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/polls/', include('polls.urls')),
     path('api/csrf/', get_csrf, name='api_csrf_set'),
+    path('api/metrics/', metrics_view, name='metrics'),
 ]
@@ -9,7 +9,7 @@ export const TestDisplayContent = ({ testData, setTestData }) => {
     const tasks = testData?.tasks || [];
     const settings = testData?.settings || {};
     
-    const { submitAttempt, loading: isSubmitting, fetchTest } = useTestsApi();
+    const { submitAttempt, loading: isSubmitting, fetchTest, fetchAttempts, startTest } = useTestsApi();
 
     const currentUserId = localStorage.getItem('userId') || 'Anonymous';
     const [testBeginningMode, setTestBeginningMode] = useState(true);
@@ -17,10 +17,43 @@ export const TestDisplayContent = ({ testData, setTestData }) => {
     const [activeTaskIndex, setActiveTaskIndex] = useState(0);
     const [resultData, setResultData] = useState(null);
     const [completedTasks, setCompletedTasks] = useState([]);
+    // Токен начала попытки: без него сервер не знает, сколько длилось прохождение
+    const [startToken, setStartToken] = useState(null);
 
-    const userAttempts = testData?.all_attempts.filter(v => v.user === String(currentUserId));
+    // Свои попытки сервер отдает в сводке по X-User-ID
+    const userAttempts = testData?.attempts_summary?.my_attempts || [];
     const remainingAttempts = testData.attempt_number - userAttempts.length;
 
+    // Все результаты (для создателя) - постранично, следующая страница по ссылке next
+    const [allAttempts, setAllAttempts] = useState([]);
+    const [attemptsNext, setAttemptsNext] = useState(null);
+    const isOwner = testData?.owner === currentUserId;
+    const attemptsCount = testData?.attempts_summary?.count;
+
+    useEffect(() => {
+        if (!testId || !isOwner) return;
+        let isMounted = true;
+        fetchAttempts(testId)
+            .then(page => {
+                if (!isMounted) return;
+                setAllAttempts(page.results);
+                setAttemptsNext(page.next);
+            })
+            .catch(err => console.error('Ошибка загрузки результатов:', err));
+        return () => { isMounted = false; };
+    }, [testId, isOwner, attemptsCount, fetchAttempts]);
+
+    const handleLoadMoreAttempts = async () => {
+        if (!attemptsNext) return;
+        try {
+            const page = await fetchAttempts(testId, attemptsNext);
+            setAllAttempts(prev => [...prev, ...page.results]);
+            setAttemptsNext(page.next);
+        } catch (err) {
+            console.error('Ошибка загрузки результатов:', err);
+        }
+    };
+
     const [testCreatorPreviewVisibility, setTestCreatorPreviewVisibility] = useState(false);
 
     // ЖЕСТКАЯ ПРОВЕРКА: Инициализация как в рабочих опросах
@@ -83,6 +116,7 @@ export const TestDisplayContent = ({ testData, setTestData }) => {
         const payload = {
                 test: testId,
                 user: currentUserId,
+                ...(startToken ? { start_token: startToken } : {}),
                 answers: completedTasks.map(task => {
                     let selected_ids = [];
                     if (task.type === 'single') {
@@ -113,7 +147,15 @@ export const TestDisplayContent = ({ testData, setTestData }) => {
             console.error("Ошибка:", err);
         }
     };
-    const handleStartTest = () => {
+    const handleStartTest = async () => {
+        setStartToken(null);
+        try {
+            const started = await startTest(testId);
+            setStartToken(started?.start_token || null);
+        } catch (err) {
+            // Тест можно пройти и без токена, только время попытки не учтется
+            console.error("Ошибка начала теста:", err);
+        }
         initializeTasks();
         setTestBeginningMode(false);
     }
@@ -245,7 +287,7 @@ export const TestDisplayContent = ({ testData, setTestData }) => {
 
 
                 {/* --- СЕКЦИЯ С ВСЕМИ РЕЗУЛЬТАТАМИ --- */}
-                {(testData?.all_attempts && testData?.all_attempts.length > 0) ? (
+                {allAttempts.length > 0 ? (
                     <div style={{ marginBottom: '20px', textAlign: 'left' }}>
                         <h4 style={{ marginBottom: '10px' }}>Все результаты:</h4>
                         <div style={{ 
@@ -258,12 +300,12 @@ export const TestDisplayContent = ({ testData, setTestData }) => {
                             overflowY: 'auto',        
                             border: '1px solid #ddd'  
                         }}>
-                            {testData?.all_attempts.map((attempt, index) => (
-                                <div key={index} style={{ 
+                            {allAttempts.map((attempt, index) => (
+                                <div key={attempt.id ?? index} style={{ 
                                     display: 'flex', 
                                     justifyContent: 'space-between', 
                                     padding: '10px 5px',
-                                    borderBottom: index !== testData?.all_attempts.length - 1 ? '1px solid #ddd' : 'none'
+                                    borderBottom: index !== allAttempts.length - 1 ? '1px solid #ddd' : 'none'
                                 }}>
                                     <span style={{ fontWeight: 'bold', fontSize: '14px' }}>
                                         {attempt.user} 
@@ -276,6 +318,10 @@ export const TestDisplayContent = ({ testData, setTestData }) => {
                                     </span>
                                 </div>
                             ))}
+                            {attemptsNext && (
+                                <ActionButton onClick={handleLoadMoreAttempts}
+                                    style={{borderRadius: "10px", marginTop: '10px'}}>Показать еще</ActionButton>
+                            )}
                         </div>
                     </div>
                 ) : (<div style={{ color: '#888', textAlign: 'center', padding: '20px' }}>
@@ -59,7 +59,7 @@ const TestWidget = ({ initialTitle, pollId: testId }) => {
                     id: serverTest.id,
                     title: serverTest.title,
                     tasks: serverTest.tasks || [],
-                    all_attempts: serverTest.all_attempts,
+                    attempts_summary: serverTest.attempts_summary,
                     owner: serverTest.owner
                 });
 
@@ -42,7 +42,11 @@ export const useTestsApi = () => {
     setLoading(true);
     setError(null);
     try {
-        const data = await apiFetch(`${API_BASE_URL}${id}/`);
+        // Свои попытки приходят в attempts_summary.my_attempts по X-User-ID,
+        // полный список - постранично через fetchAttempts
+        const data = await apiFetch(`${API_BASE_URL}${id}/`, {
+            headers: { 'X-User-ID': localStorage.getItem('userId') || 'Anonymous' }
+        });
         return data;
     } catch (err) {
         setError(err.message);
@@ -52,6 +56,18 @@ export const useTestsApi = () => {
     }
   }, []);
 
+  // Попытки теста постранично: nextUrl - ссылка next из предыдущей страницы
+  const fetchAttempts = useCallback(async (testId, nextUrl = null) => {
+    setError(null);
+    try {
+        const data = await apiFetch(nextUrl || `${API_BASE_URL}${testId}/attempts/`);
+        return { results: data?.results || [], next: data?.next || null };
+    } catch (err) {
+        setError(err.message);
+        throw err;
+    }
+  }, []);
+
   const deleteTest = useCallback(async (testId, userId) => {
     setLoading(true);
     setError(null);
@@ -113,6 +129,17 @@ const createTest = useCallback(async (testCreationData, testSettingsData) => {
     }
 }, []);
 
+  // Начало прохождения: сервер выдает start_token, по нему считается время попытки
+  const startTest = useCallback(async (testId) => {
+    setError(null);
+    try {
+      return await apiFetch(`${API_BASE_URL}${testId}/start/`, { method: 'POST' });
+    } catch (err) {
+      setError(err.message);
+      throw err;
+    }
+  }, []);
+
   // Отправка результатов (попытки) теста
 const submitAttempt = useCallback(async (payload) => {
     setLoading(true);
@@ -135,6 +162,8 @@ const submitAttempt = useCallback(async (payload) => {
     error,
     createTest,
     fetchTest,
+    fetchAttempts,
+    startTest,
     submitAttempt,
     deleteTest
   };